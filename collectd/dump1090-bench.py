@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+#
+# Scale test for the collectd plugin (dump1090.py).
+#
+# Runs the plugin outside collectd, against fake-dump1090.py, with a mock
+# collectd module that just counts what is dispatched. For each Instance
+# count it configures the plugin with that many Instances and runs every
+# registered read callback COUNT times over a pool of reader threads (like
+# collectd's ReadThreads), reporting:
+#
+#   cycle time       wall-clock seconds to run every read callback once
+#   cpu              CPU seconds per cycle
+#   dispatches/s     values dispatched per second of cycle time
+#   rss              resident memory after the runs
+#   errors           exceptions that escaped a read callback (collectd
+#                    would log these and carry on)
+#
+#   dump1090-bench.py -n 1,10,50,100 --aircraft 500 --latency 0.05
+#
+# Results are also written as JSON (default collectd-bench.json).
+#
+
+import imp, json, os, platform, resource, sys, time, threading, types
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from contextlib import closing
+from optparse import OptionParser
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+
+class MockCollectd(types.ModuleType):
+    """Stands in for the collectd module that collectd-python provides."""
+
+    def __init__(self):
+        types.ModuleType.__init__(self, 'collectd')
+        self.config_callbacks = []
+        self.read_callbacks = []
+        self.messages = []
+        self.dispatched = 0
+        self.lock = threading.Lock()
+
+        mock = self
+        class Values(object):
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+
+            def dispatch(self, **kwargs):
+                with mock.lock:
+                    mock.dispatched += 1
+        self.Values = Values
+
+    def register_config(self, callback, name=None):
+        self.config_callbacks.append(callback)
+
+    def register_read(self, callback, data=None, name=None, interval=None):
+        self.read_callbacks.append((callback, data, name, interval))
+
+    def log(self, level, msg):
+        with self.lock:
+            self.messages.append((level, msg))
+
+    def error(self, msg): self.log('error', msg)
+    def warning(self, msg): self.log('warning', msg)
+    def notice(self, msg): self.log('notice', msg)
+    def info(self, msg): self.log('info', msg)
+    def debug(self, msg): self.log('debug', msg)
+
+class ConfigNode:
+    def __init__(self, key, values, children=()):
+        self.key = key
+        self.values = values
+        self.children = list(children)
+
+def rss_kb():
+    try:
+        with closing(open('/proc/self/status', 'r')) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def load_plugin(n_instances, url, stats_interval):
+    """Imports a fresh copy of dump1090.py against a fresh mock collectd and
+    configures it with N_INSTANCES Instances."""
+
+    mock = MockCollectd()
+    sys.modules['collectd'] = mock
+    sys.modules.pop('dump1090', None)
+    plugin = imp.load_source('dump1090', os.path.join(here, 'dump1090.py'))
+
+    instances = []
+    for i in xrange(n_instances):
+        options = [ConfigNode('URL', ['%s/site%d' % (url, i)])]
+        if stats_interval != 60:
+            options.append(ConfigNode('StatsInterval', [stats_interval]))
+        instances.append(ConfigNode('Instance', ['site%d' % i], options))
+
+    root = ConfigNode('Module', ['dump1090'], instances)
+    for callback in mock.config_callbacks:
+        callback(root)
+
+    return plugin, mock
+
+def run(n_instances, url, cycles, threads, stats_interval):
+    rss_before = rss_kb()
+    plugin, mock = load_plugin(n_instances, url, stats_interval)
+
+    errors = {}
+    def call(read):
+        callback, data, name, interval = read
+        try:
+            callback(data)
+        except Exception, e:
+            key = e.__class__.__name__
+            with mock.lock:
+                errors[key] = errors.get(key, 0) + 1
+
+    pool = ThreadPool(threads)
+    cycle_times = []
+    cpu_times = []
+    try:
+        for i in xrange(cycles):
+            start = time.time()
+            start_cpu = time.clock()
+            pool.map(call, mock.read_callbacks)
+            cpu_times.append(time.clock() - start_cpu)
+            cycle_times.append(time.time() - start)
+    finally:
+        pool.close()
+        pool.join()
+
+    total = sum(cycle_times)
+    return { 'instances' : n_instances,
+             'read_callbacks' : len(mock.read_callbacks),
+             'cycle_seconds' : total / cycles,
+             'max_cycle_seconds' : max(cycle_times),
+             'cpu_seconds' : sum(cpu_times) / cycles,
+             'dispatched' : mock.dispatched,
+             'dispatches_per_second' : mock.dispatched / total if total > 0 else None,
+             'rss_kb' : rss_kb(),
+             'rss_growth_kb' : rss_kb() - rss_before,
+             'errors' : errors,
+             'log_messages' : len(mock.messages) }
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--instances", default="1,10,50,100",
+                      help="comma-separated Instance counts to try (default %default)")
+    parser.add_option("-c", "--cycles", type="int", default=3,
+                      help="read cycles per Instance count (default %default)")
+    parser.add_option("-t", "--threads", type="int", default=5,
+                      help="reader threads, as collectd's ReadThreads (default %default)")
+    parser.add_option("--stats-interval", type="int", default=60,
+                      help="StatsInterval for every Instance (default %default)")
+    parser.add_option("--aircraft", type="int", default=200,
+                      help="aircraft in the fake aircraft.json (default %default)")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="fake server latency per request in seconds (default %default)")
+    parser.add_option("--failure-rate", type="float", default=0.0,
+                      help="fraction of fake server requests that fail (default %default)")
+    parser.add_option("--url", default=None,
+                      help="use an already-running fake-dump1090.py at this base URL instead of starting one")
+    parser.add_option("-o", "--output", default="collectd-bench.json",
+                      help="where to write the results (default %default)")
+    (options, args) = parser.parse_args()
+
+    server = None
+    url = options.url
+    if url is None:
+        # run the fake server in its own process so it doesn't compete for our GIL
+        fake = imp.load_source('fake_dump1090', os.path.join(here, 'fake-dump1090.py'))
+        port = 18000 + os.getpid() % 10000
+        server = multiprocessing.Process(target=fake.serve,
+                                         args=(('127.0.0.1', port), options.aircraft, options.latency, options.failure_rate))
+        server.daemon = True
+        server.start()
+        url = 'http://127.0.0.1:%d' % port
+        time.sleep(1.0)
+
+    results = []
+    try:
+        for n in [int(x) for x in options.instances.split(',')]:
+            r = run(n, url, options.cycles, options.threads, options.stats_interval)
+            results.append(r)
+            print '%4d instances: cycle %6.2fs (max %6.2fs)  cpu %6.2fs  %7.0f dispatches/s  rss %6.1fMB  errors %s' % (
+                n, r['cycle_seconds'], r['max_cycle_seconds'], r['cpu_seconds'], r['dispatches_per_second'] or 0,
+                r['rss_kb'] / 1024.0, ', '.join('%s=%d' % kv for kv in sorted(r['errors'].items())) or 'none')
+    finally:
+        if server is not None:
+            server.terminate()
+
+    with closing(open(options.output, 'w')) as f:
+        json.dump({ 'params' : { 'cycles' : options.cycles,
+                                 'threads' : options.threads,
+                                 'stats_interval' : options.stats_interval,
+                                 'aircraft' : options.aircraft,
+                                 'latency' : options.latency,
+                                 'failure_rate' : options.failure_rate },
+                    'environment' : { 'python' : platform.python_version(),
+                                      'machine' : platform.machine(),
+                                      'platform' : platform.platform() },
+                    'runs' : results }, f, indent=2, sort_keys=True)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+#
+# Prometheus / OpenMetrics exporter for dump1090, using the same metric
+# extraction as the collectd plugin (dump1090_metrics.py).
+#
+#   dump1090-exporter.py northwest=http://rpi.lxi:8081 southeast=http://twopi.lxi:8081
+#
+# Each receiver is polled in the background. The /metrics text is only
+# regenerated when the stats.json "end" timestamp of a receiver advances,
+# so a scrape just writes out the last pre-serialized page. A receiver
+# that fails to answer drops out of the page until it is back.
+#
+
+import httplib, json, sys, time, threading
+from urllib2 import urlopen, URLError
+from contextlib import closing
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from dump1090_metrics import stats_values, stats_1min_values, aircraft_values
+from position_filter import PositionFilter, RateLimitedLog
+
+# collectd type -> (metric type, data source names) as in dump1090.db
+TYPES = {
+    'dump1090_messages' : ('counter', ['value']),
+    'dump1090_cpu'      : ('counter', ['value']),
+    'dump1090_tracks'   : ('counter', ['value']),
+    'dump1090_dbfs'     : ('gauge', ['value']),
+    'dump1090_aircraft' : ('gauge', ['total', 'positions']),
+    'dump1090_range'    : ('gauge', ['value']),
+    'dump1090_mlat'     : ('gauge', ['value'])
+}
+
+def metric_name(type, ds):
+    if ds == 'value': return type
+    else: return type + '_' + ds
+
+def format_metrics(receivers):
+    # receivers: list of (name, metrics) with metrics as returned by dump1090_metrics
+    families = {}
+    for name, metrics in receivers:
+        for type, type_instance, t, values, interval in metrics:
+            kind, dsnames = TYPES[type]
+            suffix = ''
+            if interval is not None and kind == 'counter':
+                # a count over the last stats window rather than a running total
+                kind = 'gauge'
+                suffix = '_last1min'
+            for ds, value in zip(dsnames, values):
+                families.setdefault(metric_name(type, ds) + suffix, (kind, []))[1].append(
+                    '{receiver="%s",type="%s"} %s' % (name, type_instance, repr(float(value))))
+
+    lines = []
+    for family in sorted(families.keys()):
+        kind, samples = families[family]
+        lines.append('# TYPE %s %s' % (family, kind))
+        for sample in samples:
+            lines.append(family + sample)
+    lines.append('')
+    return '\n'.join(lines)
+
+class Receiver:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.last_end = None
+        self.metrics = []
+        self.position_filter = PositionFilter(log=RateLimitedLog(self.log))
+
+    def log(self, msg):
+        print >>sys.stderr, '%s: %s' % (self.name, msg)
+
+    def fetch(self, path):
+        with closing(urlopen(self.url + path, None, 5.0)) as f:
+            return json.load(f)
+
+    def poll(self):
+        """Returns True if the metrics changed."""
+        stats = self.fetch('/data/stats.json')
+        end = stats['total']['end']
+        if end == self.last_end:
+            return False
+
+        metrics = stats_values(stats) + stats_1min_values(stats)
+        try:
+            metrics += aircraft_values(self.fetch('/data/receiver.json'), self.fetch('/data/aircraft.json'),
+                                       self.position_filter)
+        except (URLError, IOError, ValueError, KeyError, TypeError, httplib.HTTPException):
+            pass
+
+        self.metrics = metrics
+        self.last_end = end
+        return True
+
+class Exporter:
+    def __init__(self, receivers):
+        self.receivers = receivers
+        self.page = format_metrics([])
+
+    def run(self, interval):
+        while True:
+            start = time.time()
+            changed = False
+            for receiver in self.receivers:
+                try:
+                    changed = receiver.poll() or changed
+                except Exception, e:
+                    # anything from a restarting dump1090 (BadStatusLine,
+                    # odd JSON, ...); drop the receiver's metrics so that a
+                    # dead receiver shows as a gap rather than flat values
+                    print >>sys.stderr, '%s: poll failed: %s: %s' % (receiver.name, e.__class__.__name__, e)
+                    if receiver.metrics:
+                        receiver.metrics = []
+                        changed = True
+                    receiver.last_end = None
+
+            if changed:
+                self.page = format_metrics([(r.name, r.metrics) for r in self.receivers])
+
+            time.sleep(max(0, interval - (time.time() - start)))
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class RequestHandler(BaseHTTPRequestHandler):
+    exporter = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.exporter.page
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] name=url [name=url ...]")
+    parser.add_option("-l", "--listen", default="0.0.0.0:9110",
+                      help="address:port to serve /metrics on (default %default)")
+    parser.add_option("-i", "--interval", type="float", default=10.0,
+                      help="seconds between checks of stats.json (default %default)")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("need at least one dump1090 instance")
+
+    receivers = []
+    for arg in args:
+        name, url = arg.split('=', 1)
+        receivers.append(Receiver(name, url.rstrip('/')))
+
+    exporter = Exporter(receivers)
+    t = threading.Thread(target=exporter.run, args=(options.interval,), name='poll')
+    t.daemon = True
+    t.start()
+
+    RequestHandler.exporter = exporter
+    host, port = options.listen.rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), RequestHandler)
+    server.serve_forever()
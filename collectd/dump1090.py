@@ -1,9 +1,17 @@
 import collectd
-import json, math
+import json
 from contextlib import closing
 from urllib2 import urlopen, URLError
 import urlparse
-import time
+
+from dump1090_metrics import stats_values, stats_slot_values, aircraft_values, summary_values
+from position_filter import PositionFilter, RateLimitedLog
+
+# per-instance position filters, so that max_range ignores bad positions
+position_filters = {}
+
+# per-instance end of the last one-minute signal slot dispatched
+signal_slots = {}
 
 def handle_config(root):
     for child in root.children:
@@ -12,225 +20,136 @@ def handle_config(root):
         if child.key == 'Instance':
             instance_name = child.values[0]
             url = None
+            cache = None
+            stats_interval = 60
             for ch2 in child.children:
                 if ch2.key == 'URL':
                     url = ch2.values[0]
+                elif ch2.key == 'Cache':
+                    cache = ch2.values[0].rstrip('/')
+                elif ch2.key == 'StatsInterval':
+                    stats_interval = int(ch2.values[0])
+                    if stats_interval not in (60, 300, 900):
+                        collectd.warning('dump1090 Instance %s: StatsInterval must be 60, 300 or 900' % instance_name)
+                        stats_interval = 60
             if not url:
                 collectd.warning('No URL found in dump1090 Instance ' + instance_name)
-            else:
+            elif stats_interval == 60:
                 collectd.register_read(callback=handle_read,
-                                       data=(instance_name, urlparse.urlparse(url).hostname, url),
+                                       data=(instance_name, urlparse.urlparse(url).hostname, url, cache, stats_interval),
                                        name='dump1090.' + instance_name)
                 collectd.register_read(callback=handle_read_1min,
-                                       data=(instance_name, urlparse.urlparse(url).hostname, url),
+                                       data=(instance_name, urlparse.urlparse(url).hostname, url, cache, stats_interval),
                                        name='dump1090.' + instance_name + '.1min',
                                        interval=60)
+            else:
+                # low-frequency polling: everything in one request every
+                # stats_interval seconds, with the per-minute signal values
+                # filled in from the 5 or 15 minute stats buckets
+                collectd.register_read(callback=handle_read_slow,
+                                       data=(instance_name, urlparse.urlparse(url).hostname, url, cache, stats_interval),
+                                       name='dump1090.' + instance_name,
+                                       interval=stats_interval)
 
         else:
             collectd.warning('Ignored config entry: ' + child.key)
         
 V=collectd.Values(host='', plugin='dump1090', time=0)
 
-def T(provisional):
-    now = time.time()
-    if provisional <= now + 60: return provisional
-    else: return now
+def dispatch(instance_name, host, metrics):
+    for type, type_instance, t, values, interval in metrics:
+        if interval is None:
+            V.dispatch(plugin_instance = instance_name,
+                       host=host,
+                       type=type,
+                       type_instance=type_instance,
+                       time=t,
+                       values = values)
+        else:
+            V.dispatch(plugin_instance = instance_name,
+                       host=host,
+                       type=type,
+                       type_instance=type_instance,
+                       time=t,
+                       values = values,
+                       interval = interval)
 
 def handle_read(data):
-    instance_name,host,url = data
+    instance_name,host,url,cache,stats_interval = data
 
-    read_stats(instance_name, host, url)
-    read_aircraft(instance_name, host, url)
+    if cache:
+        # read from a dump1090-cached daemon rather than dump1090 itself
+        read_stats(instance_name, host, cache)
+        read_aircraft_summary(instance_name, host, cache)
+    else:
+        read_stats(instance_name, host, url)
+        read_aircraft(instance_name, host, url)
 
 def handle_read_1min(data):
-    instance_name,host,url = data
-    read_stats_1min(instance_name, host, url);
-    
+    instance_name,host,url,cache,stats_interval = data
+    read_stats_1min(instance_name, host, cache or url);
+
+def handle_read_slow(data):
+    instance_name,host,url,cache,stats_interval = data
+
+    stats = read_stats(instance_name, host, cache or url)
+    if stats is not None:
+        dispatch_signal_slots(instance_name, host, stats, stats_interval)
+
+    if cache:
+        read_aircraft_summary(instance_name, host, cache)
+    else:
+        read_aircraft(instance_name, host, url)
+
 def read_stats_1min(instance_name, host, url):
     try:
         with closing(urlopen(url + '/data/stats.json', None, 5.0)) as stats_file:
             stats = json.load(stats_file)
-    except URLError:
+    except (URLError, IOError, ValueError):
         return
 
-    # Signal measurements - from the 1 min bucket
-    if stats['last1min'].has_key('local'):
-        if stats['last1min']['local'].has_key('signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='signal',
-                   time=T(stats['last1min']['end']),
-                   values = [stats['last1min']['local']['signal']],
-                   interval = 60)
-
-        if stats['last1min']['local'].has_key('peak_signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='peak_signal',
-                   time=T(stats['last1min']['end']),
-                   values = [stats['last1min']['local']['peak_signal']],
-                   interval = 60)
-
-        if stats['last1min']['local'].has_key('min_signal'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='min_signal',
-                   time=T(stats['last1min']['end']),
-                   values = [stats['last1min']['local']['min_signal']],
-                   interval = 60)
-
-        if stats['last1min']['local'].has_key('noise'):
-          V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_dbfs',
-                   type_instance='noise',
-                   time=T(stats['last1min']['end']),
-                   values = [stats['last1min']['local']['noise']],
-                   interval = 60)
-    
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_messages',
-                   type_instance='strong_signals',
-                   time=T(stats['last1min']['end']),
-                   values = [stats['last1min']['local']['strong_signals']],
-                   interval = 60)
+    dispatch_signal_slots(instance_name, host, stats, 60)
 
+def dispatch_signal_slots(instance_name, host, stats, stats_interval):
+    # after a missed poll, this also backfills the minutes in between
+    last_slot = signal_slots.get(instance_name, stats['last1min']['end'] - stats_interval)
+    metrics, signal_slots[instance_name] = stats_slot_values(stats, last_slot)
+    dispatch(instance_name, host, metrics)
 
 def read_stats(instance_name, host, url):
     try:
         with closing(urlopen(url + '/data/stats.json', None, 5.0)) as stats_file:
             stats = json.load(stats_file)
-    except URLError:
+    except (URLError, IOError, ValueError):
         return
 
-    # Local message counts
-    if stats['total'].has_key('local'):
-        counts = stats['total']['local']['accepted']
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_messages',
-                   type_instance='local_accepted',
-                   time=T(stats['total']['end']),
-                   values = [sum(counts)])
-        for i in xrange(len(counts)):
-            V.dispatch(plugin_instance = instance_name,
-                       host=host,
-                       type='dump1090_messages',
-                       type_instance='local_accepted_%d' % i,
-                       time=T(stats['total']['end']),
-                       values = [counts[i]])
-
-    # Remote message counts
-    if stats['total'].has_key('remote'):
-        counts = stats['total']['remote']['accepted']
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_messages',
-                   type_instance='remote_accepted',
-                   time=T(stats['total']['end']),
-                   values = [sum(counts)])
-        for i in xrange(len(counts)):
-            V.dispatch(plugin_instance = instance_name,
-                       host=host,
-                       type='dump1090_messages',
-                       type_instance='remote_accepted_%d' % i,
-                       time=T(stats['total']['end']),
-                       values = [counts[i]])
-
-    # Position counts
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_messages',
-               type_instance='positions',
-               time=T(stats['total']['end']),
-               values = [stats['total']['cpr']['global_ok'] + stats['total']['cpr']['local_ok']])
-
-    # Tracks
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tracks',
-               type_instance='all',
-               time=T(stats['total']['end']),
-               values = [stats['total']['tracks']['all']])
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_tracks',
-               type_instance='single_message',
-               time=T(stats['total']['end']),
-               values = [stats['total']['tracks']['single_message']])
-
-    # CPU
-    for k in stats['total']['cpu'].keys():
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_cpu',
-                   type_instance=k,
-                   time=T(stats['total']['end']),
-                   values = [stats['total']['cpu'][k]])
-
-def greatcircle(lat0, lon0, lat1, lon1):
-    lat0 = lat0 * math.pi / 180.0;
-    lon0 = lon0 * math.pi / 180.0;
-    lat1 = lat1 * math.pi / 180.0;
-    lon1 = lon1 * math.pi / 180.0;
-    return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
+    dispatch(instance_name, host, stats_values(stats))
+    return stats
 
 def read_aircraft(instance_name, host, url):
     try:
         with closing(urlopen(url + '/data/receiver.json', None, 5.0)) as receiver_file:
             receiver = json.load(receiver_file)
 
-        if receiver.has_key('lat'):
-            rlat = float(receiver['lat'])
-            rlon = float(receiver['lon'])
-        else:
-            rlat = rlon = None
-
         with closing(urlopen(url + '/data/aircraft.json', None, 5.0)) as aircraft_file:
             aircraft_data = json.load(aircraft_file)
 
-    except URLError:
+    except (URLError, IOError, ValueError):
         return
 
-    total = 0
-    with_pos = 0
-    max_range = 0
-    mlat = 0
-    for a in aircraft_data['aircraft']:
-        if a['seen'] < 15: total += 1        
-        if a.has_key('seen_pos') and a['seen_pos'] < 15:
-            with_pos += 1
-            if rlat is not None:
-                distance = greatcircle(rlat, rlon, a['lat'], a['lon'])
-                if distance > max_range: max_range = distance
-            if 'lat' in a.get('mlat', ()):
-                mlat += 1
-
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_aircraft',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [total, with_pos])
-    V.dispatch(plugin_instance = instance_name,
-               host=host,
-               type='dump1090_mlat',
-               type_instance='recent',
-               time=aircraft_data['now'],
-               values = [mlat])
-
-    if max_range > 0:
-        V.dispatch(plugin_instance = instance_name,
-                   host=host,
-                   type='dump1090_range',
-                   type_instance='max_range',
-                   time=aircraft_data['now'],
-                   values = [max_range])
-        
+    position_filter = position_filters.get(instance_name)
+    if position_filter is None:
+        position_filter = position_filters[instance_name] = PositionFilter(log=RateLimitedLog(collectd.info))
 
-collectd.register_config(callback=handle_config, name='dump1090')
+    dispatch(instance_name, host, aircraft_values(receiver, aircraft_data, position_filter))
+
+def read_aircraft_summary(instance_name, host, url):
+    try:
+        with closing(urlopen(url + '/data/summary.json', None, 5.0)) as summary_file:
+            summary = json.load(summary_file)
+    except (URLError, IOError, ValueError):
+        return
+
+    dispatch(instance_name, host, summary_values(summary))
 
+collectd.register_config(callback=handle_config, name='dump1090')
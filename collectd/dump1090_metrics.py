@@ -0,0 +1,160 @@
+#
+# Metric extraction for dump1090, independent of where the values end up.
+#
+# Each function takes the parsed JSON from dump1090 and returns a list of
+# (type, type_instance, time, values, interval) tuples, where type and
+# type_instance follow dump1090.db and interval is None for the default
+# collection interval. dump1090.py dispatches these to collectd, and
+# dump1090-exporter.py serves them to Prometheus.
+#
+
+import math, time
+from position_filter import xyz
+
+def T(provisional):
+    now = time.time()
+    if provisional <= now + 60: return provisional
+    else: return now
+
+def greatcircle(lat0, lon0, lat1, lon1):
+    lat0 = lat0 * math.pi / 180.0;
+    lon0 = lon0 * math.pi / 180.0;
+    lat1 = lat1 * math.pi / 180.0;
+    lon1 = lon1 * math.pi / 180.0;
+    return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
+
+# stats.json buckets that carry signal figures, shortest first
+SIGNAL_BUCKETS = ('last1min', 'last5min', 'last15min')
+
+def bucket_signal_values(bucket, t):
+    """Signal measurements from one stats.json bucket, as one-minute values at time T."""
+
+    metrics = []
+    if bucket.has_key('local'):
+        local = bucket['local']
+
+        for k in ('signal', 'peak_signal', 'min_signal', 'noise'):
+            if local.has_key(k):
+                metrics.append( ('dump1090_dbfs', k, t, [local[k]], 60) )
+
+        # strong_signals is a count over the whole bucket; scale it to one minute
+        strong_signals = local['strong_signals']
+        duration = bucket['end'] - bucket['start']
+        if duration > 61:
+            strong_signals = int(round(strong_signals * 60.0 / duration))
+        metrics.append( ('dump1090_messages', 'strong_signals', t, [strong_signals], 60) )
+
+    return metrics
+
+def stats_1min_values(stats):
+    # Signal measurements - from the 1 min bucket
+    return bucket_signal_values(stats['last1min'], T(stats['last1min']['end']))
+
+def stats_slot_values(stats, last_slot):
+    """Signal measurements for every one-minute slot ending after LAST_SLOT,
+    oldest first. Each slot takes its values from the shortest bucket that
+    covers it, so that polling every 5 or 15 minutes, or missing some polls,
+    still produces a value per minute; slots older than the last15min bucket
+    are lost. Returns (metrics, end of the newest slot)."""
+
+    end = stats['last1min']['end']
+    metrics = []
+    for k in xrange(14, -1, -1):
+        slot = end - 60 * k
+        if slot <= last_slot: continue
+
+        for name in SIGNAL_BUCKETS:
+            bucket = stats.get(name)
+            if bucket is not None and bucket['start'] <= slot - 59 and bucket['end'] >= slot - 1:
+                metrics += bucket_signal_values(bucket, T(slot))
+                break
+
+    return metrics, end
+
+def stats_values(stats):
+    metrics = []
+    t = T(stats['total']['end'])
+
+    # Local message counts
+    if stats['total'].has_key('local'):
+        counts = stats['total']['local']['accepted']
+        metrics.append( ('dump1090_messages', 'local_accepted', t, [sum(counts)], None) )
+        for i in xrange(len(counts)):
+            metrics.append( ('dump1090_messages', 'local_accepted_%d' % i, t, [counts[i]], None) )
+
+    # Remote message counts
+    if stats['total'].has_key('remote'):
+        counts = stats['total']['remote']['accepted']
+        metrics.append( ('dump1090_messages', 'remote_accepted', t, [sum(counts)], None) )
+        for i in xrange(len(counts)):
+            metrics.append( ('dump1090_messages', 'remote_accepted_%d' % i, t, [counts[i]], None) )
+
+    # Position counts
+    metrics.append( ('dump1090_messages', 'positions', t,
+                     [stats['total']['cpr']['global_ok'] + stats['total']['cpr']['local_ok']], None) )
+
+    # Tracks
+    metrics.append( ('dump1090_tracks', 'all', t, [stats['total']['tracks']['all']], None) )
+    metrics.append( ('dump1090_tracks', 'single_message', t, [stats['total']['tracks']['single_message']], None) )
+
+    # CPU
+    for k in stats['total']['cpu'].keys():
+        metrics.append( ('dump1090_cpu', k, t, [stats['total']['cpu'][k]], None) )
+
+    return metrics
+
+def aircraft_values(receiver, aircraft_data, position_filter=None):
+    # If a position_filter.PositionFilter is given, aircraft that it
+    # blacklists (implausible range or speed) don't count towards max_range.
+
+    if receiver.has_key('lat'):
+        rlat = float(receiver['lat'])
+        rlon = float(receiver['lon'])
+    else:
+        rlat = rlon = None
+
+    total = 0
+    with_pos = 0
+    max_range = 0
+    mlat = 0
+    positions = []
+    for a in aircraft_data['aircraft']:
+        if a['seen'] < 15: total += 1
+        if a.has_key('seen_pos') and a['seen_pos'] < 15:
+            with_pos += 1
+            if rlat is not None:
+                distance = greatcircle(rlat, rlon, a['lat'], a['lon'])
+                positions.append((a['hex'], a['lat'], a['lon'], a.get('altitude'), a['seen_pos'], distance))
+            if 'lat' in a.get('mlat', ()):
+                mlat += 1
+
+    if position_filter is None:
+        accepted = [True] * len(positions)
+    else:
+        now = aircraft_data['now']
+        batch = []
+        for icao, lat, lon, alt, seen_pos, distance in positions:
+            if not isinstance(alt, (int, float)): alt = 0     # missing or "ground"
+            batch.append((icao, now - seen_pos, distance, None, xyz(lat, lon, alt * 0.3048)))
+        accepted = position_filter.check_batch(batch)
+        position_filter.expire(now)
+
+    for (icao, lat, lon, alt, seen_pos, distance), ok in zip(positions, accepted):
+        if ok and distance > max_range: max_range = distance
+
+    return summary_values({ 'now' : aircraft_data['now'],
+                            'total' : total,
+                            'with_pos' : with_pos,
+                            'mlat' : mlat,
+                            'max_range' : max_range })
+
+def summary_values(summary):
+    # summary is an aircraft summary as produced by aircraft_values
+    # or served by dump1090-cached.py
+    metrics = [ ('dump1090_aircraft', 'recent', summary['now'], [summary['total'], summary['with_pos']], None),
+                ('dump1090_mlat', 'recent', summary['now'], [summary['mlat']], None) ]
+
+    if summary['max_range'] > 0:
+        metrics.append( ('dump1090_range', 'max_range', summary['now'], [summary['max_range']], None) )
+
+    return metrics
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+#
+# Stand-in for any number of dump1090 instances, for load-testing the
+# collectd plugin (see dump1090-bench.py) without real receivers.
+#
+#   fake-dump1090.py -l 127.0.0.1:8099 --aircraft 300 --latency 0.05 --failure-rate 0.01
+#
+# Any path of the form /NAME/data/FILE.json (or just /data/FILE.json) is
+# served, so each plugin Instance can use its own URL, e.g.
+# http://127.0.0.1:8099/site17. stats.json, receiver.json and
+# aircraft.json contain synthetic data that moves on every second, with
+# the same structure that dump1090-mutability produces.
+#
+
+import json, math, random, sys, time, threading
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+class FakeReceiver:
+    def __init__(self, n_aircraft, lat=52.2, lon=0.1, seed=1):
+        self.n_aircraft = n_aircraft
+        self.lat = lat
+        self.lon = lon
+        self.started = time.time()
+
+        rng = random.Random(seed)
+        self.aircraft = []
+        for i in xrange(n_aircraft):
+            self.aircraft.append( { 'hex' : '%06x' % (0x400000 + i),
+                                    'range' : rng.uniform(5000, 350000),
+                                    'bearing' : rng.uniform(0, 2 * math.pi),
+                                    'speed' : rng.uniform(100, 250),
+                                    'track' : rng.uniform(0, 2 * math.pi),
+                                    'altitude' : rng.randrange(1000, 40000, 100),
+                                    'mlat' : rng.random() < 0.1 } )
+
+        self.lock = threading.Lock()
+        self.second = None
+        self.pages = {}
+
+    def stats_bucket(self, start, end):
+        minutes = (end - start) / 60.0
+        return { 'start' : start,
+                 'end' : end,
+                 'local' : { 'accepted' : [int(20000 * minutes), int(500 * minutes)],
+                             'signal' : -18.5,
+                             'peak_signal' : -2.1,
+                             'min_signal' : -32.0,
+                             'noise' : -31.4,
+                             'strong_signals' : int(50 * minutes) },
+                 'remote' : { 'accepted' : [int(100 * minutes), 0] },
+                 'cpr' : { 'global_ok' : int(3000 * minutes), 'local_ok' : int(100 * minutes) },
+                 'tracks' : { 'all' : int(self.n_aircraft * minutes), 'single_message' : int(10 * minutes) },
+                 'cpu' : { 'demod' : int(12000 * minutes), 'reader' : int(2000 * minutes), 'background' : int(600 * minutes) } }
+
+    def build(self, now):
+        minute = now // 60 * 60
+        stats = { 'latest' : self.stats_bucket(now - 1, now),
+                  'last1min' : self.stats_bucket(minute - 60, minute),
+                  'last5min' : self.stats_bucket(minute - 300, minute),
+                  'last15min' : self.stats_bucket(minute - 900, minute),
+                  'total' : self.stats_bucket(self.started, now) }
+
+        receiver = { 'version' : 'fake', 'refresh' : 1000, 'history' : 0, 'lat' : self.lat, 'lon' : self.lon }
+
+        elapsed = now - self.started
+        aircraft = []
+        coslat = math.cos(self.lat * math.pi / 180.0)
+        for ac in self.aircraft:
+            x = ac['range'] * math.sin(ac['bearing']) + ac['speed'] * elapsed * math.sin(ac['track'])
+            y = ac['range'] * math.cos(ac['bearing']) + ac['speed'] * elapsed * math.cos(ac['track'])
+            a = { 'hex' : ac['hex'],
+                  'altitude' : ac['altitude'],
+                  'lat' : self.lat + y / 111320.0,
+                  'lon' : self.lon + x / (111320.0 * coslat),
+                  'seen' : 0.3,
+                  'seen_pos' : 0.8,
+                  'messages' : int(elapsed * 5) }
+            if ac['mlat']:
+                a['mlat'] = ['lat', 'lon']
+            aircraft.append(a)
+
+        return { 'stats.json' : json.dumps(stats),
+                 'receiver.json' : json.dumps(receiver),
+                 'aircraft.json' : json.dumps({ 'now' : now, 'messages' : int(elapsed * 5 * self.n_aircraft), 'aircraft' : aircraft }) }
+
+    def page(self, name):
+        now = int(time.time())
+        with self.lock:
+            if self.second != now:
+                self.pages = self.build(float(now))
+                self.second = now
+            return self.pages.get(name)
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+
+        if server.failure_rate > 0 and random.random() < server.failure_rate:
+            self.send_error(503)
+            return
+
+        page = server.receiver.page(self.path.rsplit('/', 1)[-1])
+        if page is None or '/data/' not in self.path:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # clients giving up on a slow (--latency) answer are expected
+        pass
+
+def serve(address, n_aircraft, latency=0.0, failure_rate=0.0):
+    httpd = FakeServer(address, FakeHandler)
+    httpd.receiver = FakeReceiver(n_aircraft)
+    httpd.latency = latency
+    httpd.failure_rate = failure_rate
+    httpd.serve_forever()
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-l", "--listen", default="127.0.0.1:8099",
+                      help="address to listen on (default %default)")
+    parser.add_option("-n", "--aircraft", type="int", default=200,
+                      help="number of aircraft in aircraft.json (default %default)")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="seconds to wait before answering each request (default %default)")
+    parser.add_option("--failure-rate", type="float", default=0.0,
+                      help="fraction of requests to answer with a 503 (default %default)")
+    (options, args) = parser.parse_args()
+
+    host, port = options.listen.rsplit(':', 1)
+    try:
+        serve((host, int(port)), options.aircraft, options.latency, options.failure_rate)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+#
+# On-demand alternative to running make-collectd-graphs.{sh,py} from cron.
+#
+# Serves the same graph filenames (dump1090-northwest-rate-24h.png,
+# machine-cpu-rpi-7d.png, ...) and the HTML pages in this directory, but
+# only draws a graph when someone asks for it. The PNG is then cached, and
+# redrawn only once the instance's RRDs have moved on by at least one step
+# of that graph's period. Simultaneous requests for the same graph wait for
+# a single render; renders run in a pool of worker processes.
+#
+#   graph-server.py -l 0.0.0.0:8092 --rrd-dir /var/lib/collectd/rrd
+#
+# The instances and graphs are the ones in make-collectd-graphs.py.
+#
+
+import imp, os, sys, threading, time
+import multiprocessing
+from contextlib import closing
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import rrdgraphs
+make_graphs = imp.load_source('make_collectd_graphs', os.path.join(here, 'make-collectd-graphs.py'))
+
+def build_routes(rrd_root):
+    """Returns { filename : (rrd_dir, step, rrdtool graph args) } for every
+    graph that make-collectd-graphs.py would draw."""
+
+    routes = {}
+    for host, short, title, graphs in make_graphs.INSTANCES:
+        rrd_dir = os.path.join(rrd_root, host, 'dump1090-' + short)
+        for graph_name, graph in graphs.items():
+            for period, step in rrdgraphs.PERIODS:
+                routes['dump1090-%s-%s-%s.png' % (short, graph_name, period)] = (rrd_dir, step, graph(rrd_dir, title, period, step))
+
+    for host, name in make_graphs.MACHINES:
+        rrd_dir = os.path.join(rrd_root, host, 'cpu-0')
+        for period, step in rrdgraphs.PERIODS:
+            routes['machine-cpu-%s-%s.png' % (name, period)] = (rrd_dir, step, rrdgraphs.machine_cpu_graph(rrd_dir, name, period, step))
+
+    return routes
+
+class Render:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+class GraphCache:
+    def __init__(self, routes, cache_dir, jobs, verbose=False):
+        self.routes = routes
+        self.cache_dir = cache_dir
+        self.verbose = verbose
+        self.pool = multiprocessing.Pool(jobs)
+
+        self.lock = threading.Lock()
+        self.rendered = {}       # filename -> RRD update time the cached PNG was drawn from
+        self.inflight = {}       # filename -> Render
+        self.counters = dict.fromkeys(['requests', 'hits', 'renders', 'coalesced', 'failures'], 0)
+
+        # graphs left from a previous run count as drawn when they were written
+        for filename in routes:
+            try: self.rendered[filename] = int(os.stat(os.path.join(cache_dir, filename)).st_mtime)
+            except OSError: pass
+
+    def get(self, filename):
+        """Returns the path of an up-to-date PNG for FILENAME, or None if
+        there is no such graph (or no data for it). Raises RuntimeError if
+        rendering failed."""
+
+        route = self.routes.get(filename)
+        if route is None:
+            return None
+
+        rrd_dir, step, args = route
+        last = make_graphs.last_update(rrd_dir)
+        if not last:
+            return None
+
+        path = os.path.join(self.cache_dir, filename)
+        with self.lock:
+            self.counters['requests'] += 1
+            drawn = self.rendered.get(filename)
+            if drawn is not None and last - drawn < step:
+                self.counters['hits'] += 1
+                return path
+
+            render = self.inflight.get(filename)
+            if render is None:
+                render = self.inflight[filename] = Render()
+                owner = True
+                self.counters['renders'] += 1
+            else:
+                owner = False
+                self.counters['coalesced'] += 1
+
+        if not owner:
+            render.done.wait()
+        else:
+            start = time.time()
+            error = 'rendering failed'
+            try:
+                output, error = self.pool.apply(make_graphs.render_job, ((path + '.new', args),))
+                if not error:
+                    os.rename(path + '.new', path)
+            except Exception, e:
+                # e.g. rrdtool reported success but wrote nothing; whatever
+                # it is, waiters must not be left blocked on this render
+                error = str(e) or e.__class__.__name__
+            finally:
+                with self.lock:
+                    del self.inflight[filename]
+                    if error:
+                        self.counters['failures'] += 1
+                    else:
+                        self.rendered[filename] = last
+
+                render.error = error
+                render.done.set()
+
+            if error and self.verbose:
+                print >>sys.stderr, '%s: %s' % (filename, error)
+            if self.verbose:
+                print >>sys.stderr, '%s rendered in %.2fs' % (filename, time.time() - start)
+
+        if render.error:
+            raise RuntimeError(render.error)
+        return path
+
+class GraphHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        name = self.path.split('?', 1)[0].lstrip('/') or 'day.html'
+        if '/' in name:
+            self.send_error(404)
+            return
+
+        if name.endswith('.png'):
+            try:
+                path = self.server.cache.get(name)
+            except RuntimeError, e:
+                self.send_error(500, str(e))
+                return
+            content_type = 'image/png'
+            max_age = 60
+        elif name.endswith('.html'):
+            path = os.path.join(self.server.html_dir, name)
+            content_type = 'text/html'
+            max_age = 300
+        else:
+            path = None
+
+        try:
+            with closing(open(path, 'rb')) as f:
+                data = f.read()
+        except (IOError, TypeError):
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'max-age=%d' % max_age)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class GraphServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-l", "--listen", default="0.0.0.0:8092",
+                      help="address to listen on (default %default)")
+    parser.add_option("--rrd-dir", default="/var/lib/collectd/rrd",
+                      help="collectd RRD directory (default %default)")
+    parser.add_option("--cache-dir", default="/var/cache/dump1090-graphs",
+                      help="where to keep rendered graphs (default %default)")
+    parser.add_option("--html-dir", default=here,
+                      help="where the HTML pages are (default %default)")
+    parser.add_option("-j", "--jobs", type="int", default=2,
+                      help="number of render worker processes (default %default)")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="report each render")
+    (options, args) = parser.parse_args()
+
+    if not os.path.isdir(options.cache_dir):
+        os.makedirs(options.cache_dir)
+
+    # the pool is forked before any server threads exist
+    cache = GraphCache(build_routes(options.rrd_dir), options.cache_dir, options.jobs, options.verbose)
+
+    host, port = options.listen.rsplit(':', 1)
+    httpd = GraphServer((host, int(port)), GraphHandler)
+    httpd.cache = cache
+    httpd.html_dir = options.html_dir
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+#
+# Python replacement for make-collectd-graphs.sh.
+#
+# Renders every graph for every period in one process using the rrdtool
+# Python bindings instead of forking rrdtool for each graph. Each instance's
+# RRD files are checked once per run, and a period is only redrawn when the
+# data has advanced by at least one step of that period since it was last
+# drawn, so this can be run from a single frequent cron entry, e.g.
+#
+#   */2 * * * *   /home/pi/make-collectd-graphs.py >/dev/null
+#
+
+import glob, json, os, sys, time
+import multiprocessing
+from contextlib import closing
+from optparse import OptionParser
+
+import rrdgraphs
+
+# (collectd host, short name, long name, graphs)
+INSTANCES = [
+    ('rpi.lxi', 'northwest', 'Northwest antenna', rrdgraphs.RECEIVER_GRAPHS),
+    ('twopi.lxi', 'southeast', 'Southeast antenna', rrdgraphs.RECEIVER_GRAPHS),
+    ('rpi.lxi', 'hub', 'Hub', rrdgraphs.HUB_GRAPHS)
+]
+
+# (collectd host, name)
+MACHINES = [
+    ('rpi.lxi', 'rpi')
+]
+
+def last_update(rrd_dir):
+    # most recent update of any RRD in the directory
+    latest = 0
+    for path in glob.glob(os.path.join(rrd_dir, '*.rrd')):
+        try: latest = max(latest, os.stat(path).st_mtime)
+        except OSError: pass
+    return int(latest)
+
+def render_job(job):
+    output, args = job
+    try:
+        rrdgraphs.render(output, args)
+        return (output, None)
+    except Exception, e:
+        return (output, str(e))
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--rrd-dir", default="/var/lib/collectd/rrd",
+                      help="collectd RRD directory (default %default)")
+    parser.add_option("--output-dir", default="/var/www/collectd",
+                      help="where to write graphs (default %default)")
+    parser.add_option("-p", "--period", action="append", default=None,
+                      help="only draw this period (may be repeated)")
+    parser.add_option("-j", "--jobs", type="int", default=2,
+                      help="number of worker processes (default %default)")
+    parser.add_option("-f", "--force", action="store_true", default=False,
+                      help="redraw everything, even if the data has not changed")
+    (options, args) = parser.parse_args()
+
+    try: os.nice(5)
+    except OSError: pass
+
+    periods = [p for p in rrdgraphs.PERIODS if options.period is None or p[0] in options.period]
+
+    state_file = os.path.join(options.output_dir, '.graph-state.json')
+    try:
+        with closing(open(state_file, 'r')) as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        state = {}
+
+    jobs = []
+    pending = {}
+    job_keys = {}
+
+    def add_jobs(name, template, rrd_dir, title, graphs):
+        last = last_update(rrd_dir)
+        if not last: return
+        for period, step in periods:
+            key = name + '-' + period
+            if not options.force and last - state.get(key, 0) < step:
+                continue
+            pending[key] = last
+            for graph_name, graph in sorted(graphs.items()):
+                output = os.path.join(options.output_dir, template % (graph_name, period))
+                jobs.append( (output, graph(rrd_dir, title, period, step)) )
+                job_keys[output] = key
+
+    for host, short, title, graphs in INSTANCES:
+        add_jobs('dump1090-' + short, 'dump1090-' + short + '-%s-%s.png',
+                 os.path.join(options.rrd_dir, host, 'dump1090-' + short), title, graphs)
+
+    for host, name in MACHINES:
+        add_jobs('machine-' + name, 'machine-%s-' + name + '-%s.png',
+                 os.path.join(options.rrd_dir, host, 'cpu-0'), name, { 'cpu' : rrdgraphs.machine_cpu_graph })
+
+    if options.jobs > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.map(render_job, jobs)
+        pool.close()
+        pool.join()
+    else:
+        results = map(render_job, jobs)
+
+    failed = False
+    for output, error in results:
+        if error:
+            print >>sys.stderr, '%s: %s' % (output, error)
+            failed = True
+            # try again next time
+            pending.pop(job_keys[output], None)
+
+    state.update(pending)
+    with closing(open(state_file + '.new', 'w')) as f:
+        json.dump(state, f)
+    os.rename(state_file + '.new', state_file)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
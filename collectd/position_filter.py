@@ -0,0 +1 @@
+../polar-plots/position_filter.py
\ No newline at end of file
@@ -0,0 +1,137 @@
+#
+# Graph definitions for the dump1090 collectd data, matching
+# make-collectd-graphs.sh, for use with the rrdtool Python bindings.
+#
+# Each graph function takes the RRD directory, a title prefix, the period
+# and the step and returns the rrdtool graph arguments (without the output
+# filename).
+#
+
+def common_args(title, period, step):
+    return ['--start', 'end-' + period,
+            '--width', '480',
+            '--height', '200',
+            '--step', str(step),
+            '--title', title]
+
+def signal_graph(rrd, title, period, step):
+    return common_args(title + ' signal', period, step) + [
+        '--vertical-label', 'dBFS',
+        '--upper-limit', '0',
+        '--lower-limit', '-50',
+        '--rigid',
+        '--units-exponent', '0',
+        'DEF:signal=%s/dump1090_dbfs-signal.rrd:value:AVERAGE' % rrd,
+        'DEF:peak=%s/dump1090_dbfs-peak_signal.rrd:value:AVERAGE' % rrd,
+        'CDEF:us=signal,UN,-100,signal,IF',
+        'AREA:-100#00FF00:mean signal power',
+        'AREA:us#FFFFFF',
+        'LINE1:peak#0000FF:peak signal power']
+
+def local_rate_graph(rrd, title, period, step):
+    return common_args(title + ' message rate', period, step) + [
+        '--vertical-label', 'messages/second',
+        '--lower-limit', '0',
+        '--units-exponent', '0',
+        '--right-axis', '360:0',
+        'DEF:messages=%s/dump1090_messages-local_accepted.rrd:value:AVERAGE' % rrd,
+        'DEF:strong=%s/dump1090_messages-strong_signals.rrd:value:AVERAGE' % rrd,
+        'DEF:positions=%s/dump1090_messages-positions.rrd:value:AVERAGE' % rrd,
+        'CDEF:y2strong=strong,10,*',
+        'CDEF:y2positions=positions,10,*',
+        'LINE1:messages#0000FF:messages received',
+        'AREA:y2strong#FF0000:messages >-3dBFS / hr (RHS)',
+        'LINE1:y2positions#00c0FF:positions / hr (RHS)']
+
+def remote_rate_graph(rrd, title, period, step):
+    return common_args(title + ' message rate', period, step) + [
+        '--vertical-label', 'messages/second',
+        '--lower-limit', '0',
+        '--units-exponent', '0',
+        '--right-axis', '360:0',
+        'DEF:messages=%s/dump1090_messages-remote_accepted.rrd:value:AVERAGE' % rrd,
+        'DEF:positions=%s/dump1090_messages-positions.rrd:value:AVERAGE' % rrd,
+        'CDEF:y2positions=positions,10,*',
+        'LINE1:messages#0000FF:messages received',
+        'LINE1:y2positions#00c0FF:position / hr (RHS)']
+
+def aircraft_graph(rrd, title, period, step):
+    return common_args(title + ' aircraft seen', period, step) + [
+        '--vertical-label', 'aircraft',
+        '--lower-limit', '0',
+        '--units-exponent', '0',
+        'DEF:all=%s/dump1090_aircraft-recent.rrd:total:AVERAGE' % rrd,
+        'DEF:pos=%s/dump1090_aircraft-recent.rrd:positions:AVERAGE' % rrd,
+        'AREA:all#00FF00:aircraft tracked',
+        'LINE1:pos#0000FF:aircraft with positions']
+
+def tracks_graph(rrd, title, period, step):
+    return common_args(title + ' tracks seen', period, step) + [
+        '--vertical-label', 'tracks/hour',
+        '--lower-limit', '0',
+        '--units-exponent', '0',
+        'DEF:all=%s/dump1090_tracks-all.rrd:value:AVERAGE' % rrd,
+        'DEF:single=%s/dump1090_tracks-single_message.rrd:value:AVERAGE' % rrd,
+        'CDEF:hall=all,3600,*,1000,MIN',
+        'CDEF:hsingle=single,3600,*,1000,MIN',
+        'AREA:hall#00FF00:unique tracks',
+        'AREA:hsingle#FF0000:tracks with single message']
+
+def cpu_graph(rrd, title, period, step):
+    return common_args(title + ' CPU', period, step) + [
+        '--vertical-label', 'CPU %',
+        '--lower-limit', '0',
+        '--upper-limit', '100',
+        '--rigid',
+        'DEF:demod=%s/dump1090_cpu-demod.rrd:value:AVERAGE' % rrd,
+        'CDEF:demodp=demod,10,/',
+        'DEF:reader=%s/dump1090_cpu-reader.rrd:value:AVERAGE' % rrd,
+        'CDEF:readerp=reader,10,/',
+        'DEF:background=%s/dump1090_cpu-background.rrd:value:AVERAGE' % rrd,
+        'CDEF:backgroundp=background,10,/',
+        'AREA:readerp#008000:USB',
+        'AREA:backgroundp#00C000:other:STACK',
+        'AREA:demodp#00FF00:demodulator:STACK']
+
+def machine_cpu_graph(rrd, title, period, step):
+    return common_args(title + ' overall CPU', period, step) + [
+        '--vertical-label', 'CPU / %',
+        '--lower-limit', '0',
+        '--upper-limit', '100',
+        '--rigid',
+        '--units-exponent', '0',
+        'DEF:idle=%s/cpu-idle.rrd:value:AVERAGE' % rrd,
+        'DEF:interrupt=%s/cpu-interrupt.rrd:value:AVERAGE' % rrd,
+        'DEF:nice=%s/cpu-nice.rrd:value:AVERAGE' % rrd,
+        'DEF:softirq=%s/cpu-softirq.rrd:value:AVERAGE' % rrd,
+        'DEF:steal=%s/cpu-steal.rrd:value:AVERAGE' % rrd,
+        'DEF:system=%s/cpu-system.rrd:value:AVERAGE' % rrd,
+        'DEF:user=%s/cpu-user.rrd:value:AVERAGE' % rrd,
+        'DEF:wait=%s/cpu-wait.rrd:value:AVERAGE' % rrd,
+        'CDEF:all=idle,interrupt,nice,softirq,steal,system,user,wait,+,+,+,+,+,+,+',
+        'CDEF:pinterrupt=100,interrupt,*,all,/',
+        'CDEF:pnice=100,nice,*,all,/',
+        'CDEF:psoftirq=100,softirq,*,all,/',
+        'CDEF:psteal=100,steal,*,all,/',
+        'CDEF:psystem=100,system,*,all,/',
+        'CDEF:puser=100,user,*,all,/',
+        'CDEF:pwait=100,wait,*,all,/',
+        'AREA:pinterrupt#000080:irq',
+        'AREA:psoftirq#0000C0:softirq:STACK',
+        'AREA:psteal#0000FF::STACK',
+        'AREA:pwait#C00000:io:STACK',
+        'AREA:psystem#FF0000:sys:STACK',
+        'AREA:puser#40FF40:user:STACK',
+        'AREA:pnice#008000:nice:STACK']
+
+# graph name -> graph function, for each kind of instance
+COMMON_GRAPHS = { 'acs' : aircraft_graph, 'cpu' : cpu_graph, 'tracks' : tracks_graph }
+RECEIVER_GRAPHS = dict(COMMON_GRAPHS, signal = signal_graph, rate = local_rate_graph)
+HUB_GRAPHS = dict(COMMON_GRAPHS, rate = remote_rate_graph)
+
+# the periods graphed, and the step used for each
+PERIODS = [ ('24h', 180), ('7d', 1200), ('30d', 5400), ('365d', 86400) ]
+
+def render(output, args):
+    import rrdtool
+    rrdtool.graph(output, *args)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+#
+# Small resident daemon that polls one or more dump1090 instances once per
+# interval and serves the results to local consumers (the collectd plugin,
+# the MRTG probe, plot jobs) so that the load on dump1090 doesn't grow with
+# the number of consumers.
+#
+#   dump1090-cached.py northwest=http://rpi.lxi:8081 southeast=http://twopi.lxi:8081
+#
+# For each instance NAME it serves:
+#
+#   /NAME/data/stats.json     - stats.json as last fetched from dump1090
+#   /NAME/data/receiver.json  - receiver.json as last fetched from dump1090
+#   /NAME/data/summary.json   - a compact summary of aircraft.json
+#
+# stats.json and summary.json return 404 if the last fetch failed.
+#
+
+import httplib, json, math, sys, time, threading, traceback
+from urllib2 import urlopen, URLError
+from contextlib import closing
+from optparse import OptionParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from position_filter import PositionFilter, RateLimitedLog, xyz
+
+def greatcircle(lat0, lon0, lat1, lon1):
+    lat0 = lat0 * math.pi / 180.0;
+    lon0 = lon0 * math.pi / 180.0;
+    lat1 = lat1 * math.pi / 180.0;
+    lon1 = lon1 * math.pi / 180.0;
+    return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
+
+def summarize_aircraft(receiver, aircraft_data, position_filter=None):
+    # If a position_filter.PositionFilter is given, aircraft that it
+    # blacklists (implausible range or speed) don't count towards the
+    # max ranges, as in collectd/dump1090_metrics.py.
+
+    if receiver is not None and receiver.has_key('lat'):
+        rlat = float(receiver['lat'])
+        rlon = float(receiver['lon'])
+    else:
+        rlat = rlon = None
+
+    total = 0
+    with_pos = 0
+    mlat = 0
+    max_range = 0
+    max_range_5min = 0
+    positions = []
+    for a in aircraft_data['aircraft']:
+        if a['seen'] < 15: total += 1
+        if a.has_key('seen_pos'):
+            if a['seen_pos'] < 15:
+                with_pos += 1
+                if 'lat' in a.get('mlat', ()):
+                    mlat += 1
+            if rlat is not None and a['seen_pos'] < 300:
+                distance = greatcircle(rlat, rlon, a['lat'], a['lon'])
+                positions.append((a['hex'], a['lat'], a['lon'], a.get('altitude'), a['seen_pos'], distance))
+
+    if position_filter is None:
+        accepted = [True] * len(positions)
+    else:
+        now = aircraft_data['now']
+        batch = []
+        for icao, lat, lon, alt, seen_pos, distance in positions:
+            if not isinstance(alt, (int, float)): alt = 0     # missing or "ground"
+            batch.append((icao, now - seen_pos, distance, None, xyz(lat, lon, alt * 0.3048)))
+        accepted = position_filter.check_batch(batch)
+        position_filter.expire(now)
+
+    for (icao, lat, lon, alt, seen_pos, distance), ok in zip(positions, accepted):
+        if not ok: continue
+        if seen_pos < 15: max_range = max(max_range, distance)
+        max_range_5min = max(max_range_5min, distance)
+
+    return { 'now' : aircraft_data['now'],
+             'messages' : aircraft_data.get('messages'),
+             'total' : total,
+             'with_pos' : with_pos,
+             'mlat' : mlat,
+             'max_range' : max_range,
+             'max_range_5min' : max_range_5min }
+
+class Instance:
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.receiver = None
+        self.position_filter = PositionFilter(log=RateLimitedLog(lambda msg: sys.stderr.write('%s: %s\n' % (name, msg))))
+        # path -> serialized JSON, replaced wholesale on each poll
+        self.documents = {}
+
+    def fetch(self, path):
+        with closing(urlopen(self.url + path, None, 5.0)) as f:
+            return f.read()
+
+    def poll(self, poll_receiver):
+        # a document whose fetch fails is dropped, so that consumers see a
+        # gap (404) rather than the last good values while dump1090 is down
+        documents = dict(self.documents)
+
+        try:
+            documents['/data/stats.json'] = self.fetch('/data/stats.json')
+        except (URLError, IOError, httplib.HTTPException), e:
+            print >>sys.stderr, '%s: failed to fetch stats.json: %s' % (self.name, e)
+            documents.pop('/data/stats.json', None)
+
+        try:
+            if poll_receiver or self.receiver is None:
+                raw = self.fetch('/data/receiver.json')
+                self.receiver = json.loads(raw)
+                documents['/data/receiver.json'] = raw
+
+            aircraft_data = json.loads(self.fetch('/data/aircraft.json'))
+            documents['/data/summary.json'] = json.dumps(summarize_aircraft(self.receiver, aircraft_data, self.position_filter), separators=(',',':'))
+        except (URLError, IOError, ValueError, KeyError, TypeError, httplib.HTTPException), e:
+            print >>sys.stderr, '%s: failed to fetch aircraft data: %s' % (self.name, e)
+            documents.pop('/data/summary.json', None)
+
+        self.documents = documents
+
+    def run(self, interval):
+        count = 0
+        while True:
+            start = time.time()
+            try:
+                self.poll(count % 30 == 0)
+            except Exception:
+                traceback.print_exc()
+            count += 1
+            time.sleep(max(0, interval - (time.time() - start)))
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class RequestHandler(BaseHTTPRequestHandler):
+    instances = {}
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].split('/', 2)
+        if len(parts) == 3:
+            instance = self.instances.get(parts[1])
+            body = instance and instance.documents.get('/' + parts[2])
+        else:
+            body = None
+
+        if body is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] name=url [name=url ...]")
+    parser.add_option("-l", "--listen", default="127.0.0.1:8090",
+                      help="address:port to serve on (default %default)")
+    parser.add_option("-i", "--interval", type="float", default=10.0,
+                      help="seconds between polls of each dump1090 (default %default)")
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("need at least one dump1090 instance")
+
+    for arg in args:
+        name, url = arg.split('=', 1)
+        instance = Instance(name, url.rstrip('/'))
+        RequestHandler.instances[name] = instance
+        t = threading.Thread(target=instance.run, args=(options.interval,), name='poll-' + name)
+        t.daemon = True
+        t.start()
+
+    host, port = options.listen.rsplit(':', 1)
+    server = ThreadingHTTPServer((host, int(port)), RequestHandler)
+    server.serve_forever()
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import json, math, sys
-from urllib2 import urlopen
 from contextlib import closing
 
 def greatcircle(lat0, lon0, lat1, lon1):
@@ -12,6 +11,9 @@ def greatcircle(lat0, lon0, lat1, lon1):
     return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
 
 def get_max_range(baseurl):
+    # urllib2 pulls in httplib, ssl etc, so only load it when it's needed
+    from urllib2 import urlopen
+
     with closing(urlopen(baseurl + '/data/receiver.json', None, 5.0)) as f:
         receiver = json.load(f)
 
@@ -34,9 +36,9 @@ def get_max_range(baseurl):
                         
         return maxrange
 
-if __name__ == '__main__':
-    import sys
-    baseurl = sys.argv[1]
+def main(argv=None):
+    if argv is None: argv = sys.argv[1:]
+    baseurl = argv[0]
     maxrange = get_max_range(baseurl)
 
     if maxrange is None: print 'UNKNOWN'
@@ -44,3 +46,6 @@ if __name__ == '__main__':
     print '0'
     print '0'
     print 'dump1090 at ' + baseurl
+
+if __name__ == '__main__':
+    main()
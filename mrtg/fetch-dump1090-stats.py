@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+#
+# Combined MRTG probe for dump1090.
+#
+# Fetches receiver.json and aircraft.json once and works out aircraft
+# counts, the message counter and the maximum range in one pass, then
+# prints the MRTG output for whichever target was asked for:
+#
+#   fetch-dump1090-stats.py http://rpi.lxi:8081 aircraft
+#   fetch-dump1090-stats.py http://rpi.lxi:8081 messages
+#   fetch-dump1090-stats.py http://rpi.lxi:8081 range
+#
+# The results are cached on disk for a short while (30s by default) so
+# that MRTG's separate invocations for each target share a single fetch.
+#
+# Positions go through the same plausibility filter as the collectd plugin
+# (position_filter.py) before counting towards the maximum range. Its state
+# is kept on disk between runs, so the speed check works across polls.
+#
+
+import json, math, os, sys, time, hashlib, tempfile
+from urllib2 import urlopen, URLError
+from contextlib import closing
+from optparse import OptionParser
+from position_filter import PositionFilter, xyz
+
+def greatcircle(lat0, lon0, lat1, lon1):
+    lat0 = lat0 * math.pi / 180.0;
+    lon0 = lon0 * math.pi / 180.0;
+    lat1 = lat1 * math.pi / 180.0;
+    lon1 = lon1 * math.pi / 180.0;
+    return 6371e3 * math.acos(math.sin(lat0) * math.sin(lat1) + math.cos(lat0) * math.cos(lat1) * math.cos(abs(lon0 - lon1)))
+
+def filter_filename(baseurl):
+    return os.path.join(tempfile.gettempdir(), 'dump1090-mrtg-%s.filter.json' % hashlib.md5(baseurl).hexdigest())
+
+def load_filter(baseurl):
+    # nowhere useful to report blacklistings from an MRTG probe
+    position_filter = PositionFilter(log=lambda msg, *args: None)
+    try:
+        with closing(open(filter_filename(baseurl), 'r')) as f:
+            state = json.load(f)
+        position_filter.last = dict((icao, (ts, tuple(pos))) for icao, (ts, pos) in state['last'].items())
+        position_filter.blacklist = state['blacklist']
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+    return position_filter
+
+def save_filter(baseurl, position_filter):
+    filename = filter_filename(baseurl)
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+        with closing(os.fdopen(fd, 'w')) as f:
+            json.dump({ 'last' : position_filter.last, 'blacklist' : position_filter.blacklist }, f)
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        pass
+
+def fetch_stats(baseurl):
+    with closing(urlopen(baseurl + '/data/receiver.json', None, 5.0)) as f:
+        receiver = json.load(f)
+
+    with closing(urlopen(baseurl + '/data/aircraft.json', None, 5.0)) as f:
+        aircraft = json.load(f)
+
+    if receiver.has_key('lat') and receiver.has_key('lon'):
+        rlat = receiver['lat']
+        rlon = receiver['lon']
+    else:
+        rlat = rlon = None
+
+    total = 0
+    with_pos = 0
+    max_range = None
+    batch = []
+    for ac in aircraft['aircraft']:
+        if ac['seen'] < 15: total += 1
+        if ac.has_key('seen_pos'):
+            if ac['seen_pos'] < 15: with_pos += 1
+            if rlat is not None and ac['seen_pos'] < 300:
+                distance = greatcircle(rlat, rlon, ac['lat'], ac['lon'])
+                alt = ac.get('altitude')
+                if not isinstance(alt, (int, float)): alt = 0     # missing or "ground"
+                batch.append((ac['hex'], aircraft['now'] - ac['seen_pos'], distance, None,
+                              xyz(ac['lat'], ac['lon'], alt * 0.3048)))
+
+    if batch:
+        position_filter = load_filter(baseurl)
+        for (icao, ts, distance, elev, pos), ok in zip(batch, position_filter.check_batch(batch)):
+            if ok and (max_range is None or distance > max_range):
+                max_range = distance
+        position_filter.expire(aircraft['now'])
+        save_filter(baseurl, position_filter)
+
+    return { 'time' : time.time(),
+             'total' : total,
+             'with_pos' : with_pos,
+             'messages' : aircraft.get('messages'),
+             'max_range' : max_range }
+
+def fetch_summary(daemon_url):
+    # read the precomputed summary from a dump1090-cached daemon
+    with closing(urlopen(daemon_url + '/data/summary.json', None, 5.0)) as f:
+        summary = json.load(f)
+
+    return { 'time' : time.time(),
+             'total' : summary['total'],
+             'with_pos' : summary['with_pos'],
+             'messages' : summary['messages'],
+             'max_range' : summary['max_range_5min'] or None }
+
+def cache_filename(baseurl):
+    return os.path.join(tempfile.gettempdir(), 'dump1090-mrtg-%s.json' % hashlib.md5(baseurl).hexdigest())
+
+def get_stats(baseurl, max_age):
+    filename = cache_filename(baseurl)
+    if max_age > 0:
+        try:
+            with closing(open(filename, 'r')) as f:
+                stats = json.load(f)
+            if time.time() - stats['time'] < max_age:
+                return stats
+        except (IOError, ValueError, KeyError):
+            pass
+
+    stats = fetch_stats(baseurl)
+
+    if max_age > 0:
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+            with closing(os.fdopen(fd, 'w')) as f:
+                json.dump(stats, f)
+            os.rename(tmp, filename)
+        except (IOError, OSError):
+            pass
+
+    return stats
+
+def mrtg_value(v, fmt='%d'):
+    if v is None: return 'UNKNOWN'
+    else: return fmt % v
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] baseurl aircraft|messages|range")
+    parser.add_option("-d", "--daemon", default=None,
+                      help="read from this dump1090-cached instance URL instead of dump1090 itself")
+    parser.add_option("-c", "--cache-age", type="int", default=30,
+                      help="reuse results fetched within this many seconds, 0 to disable (default %default)")
+    (options, args) = parser.parse_args()
+    if len(args) != 2 or args[1] not in ('aircraft', 'messages', 'range'):
+        parser.error("need a base URL and one of aircraft, messages, range")
+
+    baseurl, target = args
+    try:
+        if options.daemon:
+            stats = fetch_summary(options.daemon.rstrip('/'))
+        else:
+            stats = get_stats(baseurl, options.cache_age)
+    except (URLError, IOError, ValueError, KeyError):
+        stats = {}
+
+    if target == 'aircraft':
+        print mrtg_value(stats.get('total'))
+        print mrtg_value(stats.get('with_pos'))
+    elif target == 'messages':
+        print mrtg_value(stats.get('messages'))
+        print '0'
+    else:
+        max_range = stats.get('max_range')
+        print mrtg_value(None if max_range is None else max_range / 1852.0, '%.1f')
+        print '0'
+    print '0'
+    print 'dump1090 at ' + baseurl
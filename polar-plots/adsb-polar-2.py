@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 
-import math, csv, os, time, traceback
+import math, csv, os, sys, time, json, signal, traceback, zlib
 from contextlib import closing
+from itertools import islice
+from position_filter import PositionFilter
 
 WGS84_A = 6378137.0
 WGS84_F =  1.0/298.257223563;
@@ -13,6 +15,9 @@ MEAN_R = 6371009.0
 ABSOLUTE_MAXIMUM_RANGE = 500000.0
 ABSOLUTE_MINIMUM_ELEVATION = -5.0
 
+# positions are read and filtered in batches of this size
+BATCH_SIZE = 32
+
 def dtor(d):
     return d * math.pi / 180.0
 
@@ -140,6 +145,62 @@ def range_bearing_elevation(c,l):
     horiz_range = math.sqrt(dy*dy + dz*dz)               # distance projected onto YZ (ground/horizon plane); something like ground distance if the Earth was flat
     return (slant, horiz_range, bearing, elev, (lrx,lry,lrz))
 
+# Bin edges are written to the CSVs as %.2f; an edge read back that is
+# within this of one of our own edges is taken to be that edge.
+EDGE_TOLERANCE = 0.0051
+
+rebin_cache = {}
+
+def rebin_weights(start, size, n, low, high):
+    """Returns ((i, fraction), ...), the share of the interval [LOW, HIGH)
+    that falls in each of the N bins of SIZE from START: one row of the
+    sparse matrix that maps an old layout onto this one. Rows are memoized,
+    since the rows of a CSV being imported share a handful of distinct
+    edges. If the interval lies wholly inside the bins, the last fraction
+    is None, meaning "whatever is left"."""
+
+    key = (start, size, n, low, high)
+    weights = rebin_cache.get(key)
+    if weights is not None:
+        return weights
+
+    k = round((low - start) / size)
+    if abs(start + k * size - low) < EDGE_TOLERANCE: low = start + k * size
+    k = round((high - start) / size)
+    if abs(start + k * size - high) < EDGE_TOLERANCE: high = start + k * size
+
+    weights = []
+    if high - low >= 1e-6:
+        first = max(0, int(math.floor((low - start) / size)))
+        last = min(n, int(math.ceil((high - start) / size)))
+        for i in xrange(first, last):
+            fraction = (min(start + (i+1) * size, high) - max(start + i * size, low)) / (high - low)
+            if fraction > 1e-9:
+                weights.append((i, fraction))
+
+        if weights and low >= start and high <= start + n * size:
+            weights[-1] = (weights[-1][0], None)
+
+    weights = rebin_cache[key] = tuple(weights)
+    return weights
+
+def split(weights, updates, airsec):
+    """Yields (i, updates, airsec), the shares of UPDATES and AIRSEC given
+    WEIGHTS from rebin_weights(). The last bin takes the remainder, so the
+    shares add up to the totals."""
+
+    total_updates = updates
+    total_airsec = airsec
+    for i, fraction in weights:
+        if fraction is None:
+            yield i, updates, airsec
+        else:
+            frac_updates = fraction * total_updates
+            frac_airsec = fraction * total_airsec
+            updates -= frac_updates
+            airsec -= frac_airsec
+            yield i, frac_updates, frac_airsec
+
 class BinHisto:
     def __init__(self, n_bins, min_bin_value, max_bin_value):
         self.n_bins = n_bins
@@ -179,21 +240,11 @@ class BinHisto:
         os.rename(filename + '.new', filename)
 
     def import_bin(self, low, high, updates, airsec):
-        firstbin = max(0, self.bin_for(low))
-        lastbin = min(self.n_bins, self.bin_for(high) + 1)
-
-        for i in xrange(firstbin, lastbin):
-            if high-low < 1e-6: break
-            low_val = max(self.bin_start(i), low)
-            high_val = min(self.bin_end(i), high)
-            fraction = (high_val - low_val) / (high - low)
-            frac_updates = fraction * updates
-            frac_airsec = fraction * airsec
-            self.update_bins[i] += frac_updates
-            self.airsec_bins[i] += frac_airsec
-            updates -= frac_updates
-            airsec -= frac_airsec
-            low = high_val
+        update_bins = self.update_bins
+        airsec_bins = self.airsec_bins
+        for i, frac_updates, frac_airsec in split(rebin_weights(self.min_bin, self.bin_size, self.n_bins, low, high), updates, airsec):
+            update_bins[i] += frac_updates
+            airsec_bins[i] += frac_airsec
 
     def read(self, filename):
         with closing(open(filename, 'r')) as r:
@@ -245,22 +296,9 @@ class PolarHisto:
         os.rename(filename + '.new', filename)
 
     def import_sector(self, b_low, b_high, h_low, h_high, updates, airsec):
-        firstsect = max(0, self.sector_for(b_low))
-        lastsect = min(self.n_sectors, self.sector_for(b_high) + 1)
-        if lastsect <= firstsect: lastsect = self.n_sectors  # handle 360->0 wrap
-
-        for i in xrange(firstsect, lastsect):
-            if b_high - b_low < 1e-6: break
-            
-            low_val = max(self.sector_start(i), b_low)
-            high_val = min(self.sector_end(i), b_high)
-            fraction = (high_val - low_val) / (b_high - b_low)
-            frac_updates = fraction * updates
-            frac_airsec = fraction * airsec
+        # sectors run from 0 to 360 without wrapping, as the CSVs do
+        for i, frac_updates, frac_airsec in split(rebin_weights(0.0, self.sector_size, self.n_sectors, b_low, b_high), updates, airsec):
             self.sectors[i].import_bin(h_low, h_high, frac_updates, frac_airsec)
-            updates -= frac_updates
-            airsec -= frac_airsec
-            b_low = high_val
 
     def read(self, filename):
         with closing(open(filename, 'r')) as r:
@@ -310,7 +348,7 @@ class MultiPolarRangeHisto:
 
     def import_sector(self, b_low, b_high, h_low, h_high, updates, airsec):
         for sr,er,h in self.ranges:
-            if h_low >= sr or h_high <= er:
+            if h_low < er and h_high > sr:
                 low_val = max(sr, h_low)
                 high_val = min(er, h_high)
                 fraction = (high_val - low_val) / (h_high - h_low)
@@ -337,160 +375,722 @@ class MultiPolarRangeHisto:
 class aircraft(object):
     pass
 
-def process_basestation_messages(home, f):
-    count = 0
-    #range_histo = BinHisto(220, 0, 440000)
-
-    # this sets up approx 2km x 2km bins out to 400km
-    # XX why don't I just use 2km x 2km square grid?
-    polar_range_histo = MultiPolarRangeHisto([ (0, 40000, 2.86, 2000),
-                                               (40000, 60000, 1.91, 2000),
-                                               (60000, 80000, 1.43, 2000),
-                                               (80000, 100000, 1.15, 2000),
-                                               (100000, 150000, 0.76, 2000),
-                                               (150000, 200000, 0.57, 2000),
-                                               (200000, 250000, 0.46, 2000),
-                                               (250000, 300000, 0.38, 2000),
-                                               (300000, 350000, 0.33, 2000),
-                                               (350000, 400000, 0.29, 2000) ])
-
-    polar_elev_histo = MultiPolarRangeHisto([ (-15.0,  15.0, 1.00, 0.25),
-                                              ( 15.0,  20.0, 1.20, 0.30),
-                                              ( 20.0,  25.0, 1.40, 0.35),
-                                              ( 25.0,  30.0, 1.60, 0.40),
-                                              ( 30.0,  35.0, 1.80, 0.45),
-                                              ( 35.0,  40.0, 2.00, 0.50),
-                                              ( 40.0,  45.0, 2.20, 0.55),
-                                              ( 45.0,  60.0, 2.40, 0.60),
-                                              ( 60.0,  65.0, 2.60, 0.65),
-                                              ( 65.0,  70.0, 2.80, 0.70),
-                                              ( 70.0,  75.0, 3.00, 0.75),
-                                              ( 75.0,  80.0, 3.20, 0.80),
-                                              ( 80.0,  85.0, 3.40, 0.85),
-                                              ( 85.0,  90.0, 3.60, 0.90) ])
-
-    rbe_from_home = range_bearing_elevation_from(home)
-
-    #try: range_histo.read('range.csv')
-    #except: traceback.print_exc()
-
-    try: polar_range_histo.read('polar_range.csv')
-    except: traceback.print_exc()
-
-    try: polar_elev_histo.read('polar_elev.csv')
-    except: traceback.print_exc()
-
-    current_aircraft = {}
-    last_save = time.time()
-    last_reset = 0
-    recent_updates = 0
-
-    c = csv.reader(f, delimiter=',')
+class Instrumentation(object):
+    """Counters and per-stage timers for process_positions.
+
+    Per-position stage timers are only sampled on one position in SAMPLE_EVERY,
+    and scaled up when reported, to keep the overhead down. Stats can be dumped on request
+    (see request_dump, e.g. from a signal handler) and/or written periodically
+    to a JSON file; a profiler (cProfile, or a statistical sampler driven by
+    SIGPROF) can be run for a fixed window while processing continues."""
+
+    SAMPLE_EVERY = 16
+
+    def __init__(self, stats_file=None, stats_interval=30.0, profile_output='adsb-polar.prof'):
+        self.counters = dict.fromkeys(['lines', 'skipped', 'parse_failures', 'positions',
+                                       'blacklist_position', 'blacklist_speed', 'unblacklist',
+                                       'expired', 'saves', 'polls', 'poll_failures', 'sampled_out'], 0)
+        self.timers = dict.fromkeys(['geodesy', 'filter', 'histogram', 'save'], 0.0)
+        self.gauges = {}
+        self.started = time.time()
+
+        self.stats_file = stats_file
+        self.stats_interval = stats_interval
+        self.last_stats = self.started
+
+        self.profile_output = profile_output
+        self.profile_request = None
+        self.profiler = None
+        self.profile_end = None
+
+    def snapshot(self):
+        elapsed = time.time() - self.started
+        timers = {}
+        for k, v in self.timers.items():
+            timers[k] = v if k in ('save', 'filter') else v * self.SAMPLE_EVERY
+        return { 'time' : time.time(),
+                 'uptime' : elapsed,
+                 'counters' : dict(self.counters),
+                 'timers' : timers,
+                 'gauges' : dict(self.gauges),
+                 'positions_per_second' : self.counters['positions'] / elapsed if elapsed > 0 else 0.0 }
+
+    def write_stats(self):
+        with closing(open(self.stats_file + '.new', 'w')) as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        os.rename(self.stats_file + '.new', self.stats_file)
+
+    def request_dump(self, *args):
+        # Python runs signal handlers in the main thread between bytecodes,
+        # so this can dump at once; the readers retry reads that the signal
+        # interrupts, so it works while waiting on an idle feed too
+        json.dump(self.snapshot(), sys.stderr, indent=2, sort_keys=True)
+        print >>sys.stderr
+
+    def request_profile(self, seconds, mode='cprofile'):
+        # safe to call from a signal handler; profiling starts in tick()
+        self.profile_request = (seconds, mode)
+
+    def start_profile(self, now, seconds, mode):
+        if self.profiler is not None: return
+        if mode == 'sample':
+            self.profiler = SamplingProfiler()
+        else:
+            import cProfile
+            self.profiler = cProfile.Profile()
+        self.profiler.enable()
+        self.profile_end = now + seconds
+        print >>sys.stderr, 'profiling (%s) for %.0fs' % (mode, seconds)
+
+    def stop_profile(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.profile_output)
+        self.profiler = None
+        print >>sys.stderr, 'profile written to %s' % self.profile_output
+
+    def tick(self, now):
+        if self.profile_request is not None:
+            seconds, mode = self.profile_request
+            self.profile_request = None
+            self.start_profile(now, seconds, mode)
+
+        if self.profiler is not None and now >= self.profile_end:
+            self.stop_profile()
+
+        if self.stats_file and (now - self.last_stats) >= self.stats_interval:
+            self.last_stats = now
+            self.write_stats()
+
+    def finish(self):
+        if self.profiler is not None:
+            self.stop_profile()
+        if self.stats_file:
+            self.write_stats()
+
+class SamplingProfiler(object):
+    """A minimal statistical profiler: samples the stack on SIGPROF and
+    writes collapsed stacks (one 'frame;frame;frame count' line per stack,
+    as used by flamegraph.pl), most frequent first."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = {}
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+            frame = frame.f_back
+        key = ';'.join(reversed(stack))
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+    def enable(self):
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+    def dump_stats(self, filename):
+        with closing(open(filename, 'w')) as f:
+            for key, count in sorted(self.samples.items(), key=lambda x: -x[1]):
+                f.write('%s %d\n' % (key, count))
+
+def read_basestation(f, stats=None, sampler=None):
+    """Yields (icao, timestamp, timestamp_string, lat, lng, alt_ft) for each
+    MSG,3 (airborne position) line of the SBS stream F. If SAMPLER (an
+    OverloadSampler) is given, positions from aircraft it is not keeping
+    are dropped before the timestamp is parsed."""
+
+    counters = stats.counters if stats is not None else dict.fromkeys(['lines', 'skipped', 'parse_failures', 'sampled_out'], 0)
+    # file iteration loses its place if a signal interrupts the read, but
+    # readline() runs the handler and retries; F may also be a list of lines
+    c = csv.reader(iter(f.readline, '') if hasattr(f, 'readline') else f, delimiter=',')
     for row in c:
-        if row[0] != 'MSG': continue
-        if row[1] != '3': continue
+        counters['lines'] += 1
+        if row[0] != 'MSG' or row[1] != '3':
+            counters['skipped'] += 1
+            continue
 
         try:
             icao = row[4]
             alt_ft = float(row[11])
-            alt_m = ft_to_m(alt_ft)
             lat = float(row[14])
             lng = float(row[15])            
         except:
+            counters['parse_failures'] += 1
             continue
-        
+
+        if sampler is not None and not sampler.keep(icao):
+            counters['sampled_out'] += 1
+            sampler.positions += 1
+            continue
+
         timestamp_string = row[8] + ' ' + row[9]
         base_timestamp, millis = timestamp_string.split('.')
         update_timestamp = time.mktime(time.strptime(base_timestamp, '%Y/%m/%d %H:%M:%S')) + int(millis)/1000.0
 
-        tr,hr,b,e,l = rbe_from_home((lat,lng,alt_m))
-
-        # horiz_range is approx equal to great circle distance for the small angles we will deal with:
-        # difference is (tan(x)/x - 1) (about 1% at 10 degrees)
-        # 
-        # This seems to work well both at short range (where using line-of-sight distance would cause a zero-offset
-        # due to altitude) and long range (where the signals are close to the horizon, and using great circle distance
-        # would add an unwanted curvature effect)
-
-        r = hr
-
-        ac = current_aircraft.get(icao)
-        if not ac:
-            current_aircraft[icao] = ac = aircraft()
-            aircraft.last = update_timestamp
-            aircraft.range = r
-            aircraft.bearing = b
-            aircraft.elevation = e
-            aircraft.position_xyz = l
-            aircraft.position_llu = (lat,lng,alt_ft)
-            aircraft.blacklist = None
-
-        if r > ABSOLUTE_MAXIMUM_RANGE or e < ABSOLUTE_MINIMUM_ELEVATION:
-            if not ac.blacklist:
-                print "contact with improbable position, blacklisting: %s %s @ %.3f,%.3f,%.0f range %.1fkm elevation %.1f" % (timestamp_string, icao, lat, lng, alt_ft, r/1000.0, e)
-            ac.blacklist = update_timestamp + 60
-
-        elapsed = update_timestamp - ac.last
-        if elapsed > 0:
-            dx = l[0] - ac.position_xyz[0]
-            dy = l[1] - ac.position_xyz[1]
-            dz = l[2] - ac.position_xyz[2]
-            moved = math.sqrt(dx*dx+dy*dy+dz*dz)
-            if (elapsed > 4.0 or moved > 2000.0) and moved / elapsed > 500.0:   # 500m/s, about 970 knots
-                if not ac.blacklist:
-                    print "contact with improbable speed, blacklisting: %s %s @ %.3f,%.3f,%.0f -> %.3f,%.3f,%.0f moved %.1fkm at %.1fm/s" % (timestamp_string, icao, ac.position_llu[0], ac.position_llu[1], ac.position_llu[2], lat, lng, alt_ft, moved/1000.0, moved/elapsed)
-                ac.blacklist = update_timestamp + 60
-
-            if not ac.blacklist:
-                #range_histo.add(ac.range, 1, elapsed)
-                polar_range_histo.add(ac.bearing, ac.range, 1, elapsed)
-                polar_elev_histo.add(ac.bearing, ac.elevation, 1, elapsed)
-
-        if ac.blacklist and ac.blacklist < update_timestamp:
-            print "un-blacklisting", timestamp_string, icao
-            ac.blacklist = None
-
-        ac.last = update_timestamp
-        ac.range = r
-        ac.bearing = b
-        ac.elevation = e
-        ac.position_xyz = l
-        ac.position_llu = (lat,lng,alt_ft)
-        recent_updates += 1
-    
-        if (update_timestamp - last_reset) > 30.0:
-            last_reset = update_timestamp
+        yield (icao, update_timestamp, timestamp_string, lat, lng, alt_ft)
+
+def read_aircraft_json(source, interval=5.0, stats=None):
+    """Polls SOURCE (an aircraft.json URL or filename) every INTERVAL seconds.
+    For each poll, yields a list of (icao, timestamp, timestamp_string, lat,
+    lng, alt_ft) for the aircraft whose position has changed since the last
+    poll, and a matching list of weights: the number of messages received from
+    each aircraft since then, to stand in for the individual updates."""
+
+    import httplib, urllib2
+    counters = stats.counters if stats is not None else dict.fromkeys(['polls', 'poll_failures'], 0)
+
+    # icao -> (position timestamp, message count) at the last poll
+    last = {}
+    next_poll = time.time()
+    while True:
+        delay = next_poll - time.time()
+        if delay > 0: time.sleep(delay)
+        next_poll = max(next_poll + interval, time.time())
+
+        counters['polls'] += 1
+        try:
+            if '://' in source:
+                f = urllib2.urlopen(source, None, 5.0)
+            else:
+                f = open(source, 'r')
+            with closing(f):
+                data = json.load(f)
+            now = data['now']
+            aircraft_data = data['aircraft']
+        except (IOError, ValueError, KeyError, TypeError, httplib.HTTPException), e:
+            # including BadStatusLine while dump1090 restarts, and documents
+            # without now/aircraft
+            counters['poll_failures'] += 1
+            print >>sys.stderr, 'reading %s failed: %s: %s' % (source, e.__class__.__name__, e)
+            continue
+
+        batch = []
+        weights = []
+        seen = {}
+        for a in aircraft_data:
+            if 'seen_pos' not in a or 'lat' not in a:
+                continue
+
+            icao = a['hex']
+            timestamp = now - a['seen_pos']
+            messages = a.get('messages', 0)
+            seen[icao] = (timestamp, messages)
+
+            prev = last.get(icao)
+            if prev is not None and timestamp <= prev[0] + 0.05:
+                seen[icao] = prev   # position hasn't moved on
+                continue
+
+            alt_ft = a.get('altitude', 0)
+            if not isinstance(alt_ft, (int, float)): alt_ft = 0     # "ground"
+            timestamp_string = time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(timestamp)) + ('%.3f' % (timestamp % 1))[1:]
+            batch.append((icao, timestamp, timestamp_string, a['lat'], a['lon'], alt_ft))
+            weights.append(max(1, messages - prev[1]) if prev is not None else 1)
+
+        last = seen
+        # keep the batch in time order, as the stream readers would
+        order = sorted(xrange(len(batch)), key=lambda i: batch[i][1])
+        yield [batch[i] for i in order], [weights[i] for i in order]
+
+def micro_batches(positions, size):
+    positions = iter(positions)
+    while True:
+        batch = list(islice(positions, size))
+        if not batch: return
+        yield batch
+
+def process_basestation_messages(home, f):
+    process_positions(home, read_basestation(f))
+
+def make_range_histo():
+    # this sets up approx 2km x 2km bins out to 400km
+    # XX why don't I just use 2km x 2km square grid?
+    return MultiPolarRangeHisto([ (0, 40000, 2.86, 2000),
+                                  (40000, 60000, 1.91, 2000),
+                                  (60000, 80000, 1.43, 2000),
+                                  (80000, 100000, 1.15, 2000),
+                                  (100000, 150000, 0.76, 2000),
+                                  (150000, 200000, 0.57, 2000),
+                                  (200000, 250000, 0.46, 2000),
+                                  (250000, 300000, 0.38, 2000),
+                                  (300000, 350000, 0.33, 2000),
+                                  (350000, 400000, 0.29, 2000) ])
+
+def make_elev_histo():
+    return MultiPolarRangeHisto([ (-15.0,  15.0, 1.00, 0.25),
+                                  ( 15.0,  20.0, 1.20, 0.30),
+                                  ( 20.0,  25.0, 1.40, 0.35),
+                                  ( 25.0,  30.0, 1.60, 0.40),
+                                  ( 30.0,  35.0, 1.80, 0.45),
+                                  ( 35.0,  40.0, 2.00, 0.50),
+                                  ( 40.0,  45.0, 2.20, 0.55),
+                                  ( 45.0,  60.0, 2.40, 0.60),
+                                  ( 60.0,  65.0, 2.60, 0.65),
+                                  ( 65.0,  70.0, 2.80, 0.70),
+                                  ( 70.0,  75.0, 3.00, 0.75),
+                                  ( 75.0,  80.0, 3.20, 0.80),
+                                  ( 80.0,  85.0, 3.40, 0.85),
+                                  ( 85.0,  90.0, 3.60, 0.90) ])
+
+class OverloadSampler(object):
+    """Sheds load when the collector falls behind a live feed.
+
+    The lag is how far the newest position's timestamp is behind the wall
+    clock, less the smallest such lag seen so far (which absorbs any clock
+    offset between the feed and this host). The collector is overloaded at
+    the end of an INTERVAL-second window if the lag is over MAX_LAG and not
+    shrinking, or if it used more than MAX_CPU of a CPU; the lag alone can
+    miss this when the feed is read through a pipe, since the writer is
+    then held up and its timestamps stay fresh. Either check can be turned
+    off with None.
+
+    When overloaded the sampling ratio doubles, up to MAX_RATIO. Only
+    aircraft whose ICAO address hashes into 1 in RATIO are then kept, so
+    each kept aircraft's track stays whole, and the collector scales their
+    updates and airsec up by RATIO. The ratio halves again once the lag has
+    gone and the CPU use projected for half the ratio leaves some headroom."""
+
+    def __init__(self, max_lag=10.0, max_cpu=0.9, max_ratio=64, interval=10.0):
+        self.max_lag = max_lag
+        self.max_cpu = max_cpu
+        self.max_ratio = max_ratio
+        self.interval = interval
+
+        self.ratio = 1
+        self.min_lag = None
+        self.lag = 0.0
+        self.rate = 0.0
+        self.load = 0.0
+
+        self.window_start = None
+        self.window_cpu = 0.0
+        self.window_lag = 0.0
+        self.positions = 0
+
+    def keep(self, icao):
+        # the kept set at ratio 2N is a subset of the kept set at ratio N
+        return (zlib.crc32(icao) & (self.ratio - 1)) == 0
+
+    def observe(self, lag, n_positions):
+        if self.min_lag is None or lag < self.min_lag:
+            self.min_lag = lag
+        self.lag = lag - self.min_lag
+        self.positions += n_positions
+
+    def update(self, now):
+        """Called regularly; returns True if the ratio changed."""
+
+        if self.window_start is None:
+            self.window_start = now
+            self.window_cpu = time.clock()
+            self.window_lag = self.lag
+            return False
+
+        wall = now - self.window_start
+        if wall < self.interval:
+            return False
+
+        cpu = time.clock() - self.window_cpu
+        self.rate = self.positions / wall
+        self.load = cpu / wall
+
+        lagging = self.max_lag is not None and self.lag > self.max_lag
+        old_ratio = self.ratio
+        if (lagging and self.lag >= self.window_lag) or (self.max_cpu is not None and self.load > self.max_cpu):
+            self.ratio = min(self.ratio * 2, self.max_ratio)
+        elif self.ratio > 1 and (self.max_lag is None or self.lag < self.max_lag / 4):
+            # nearly all the work is per kept position (unkept SBS lines are
+            # dropped before their timestamp is parsed), so halving the
+            # ratio about doubles the CPU used
+            if 2 * self.load < 0.8 * (self.max_cpu or 1.0):
+                self.ratio //= 2
+
+        self.window_start = now
+        self.window_cpu = time.clock()
+        self.window_lag = self.lag
+        self.positions = 0
+        return self.ratio != old_ratio
+
+class Collector(object):
+    """Range and elevation histograms for one receiver at HOME = (lat, lon, alt),
+    kept in OUTDIR. Positions are handed over in batches with add_batch(), and
+    periodic() should be called regularly to write the histograms out.
+    If SHARED is given, the histograms are also kept live in that
+    memory-mapped file (see polar_shared.py). If QUADTREE is set, an
+    adaptive-resolution coverage histogram (see polar_quadtree.py) is kept
+    alongside as polar_quadtree.bin. If SAMPLER (an OverloadSampler) is
+    given, it decides which aircraft to keep when the collector falls
+    behind. If ARCHIVE is given, a snapshot of the histograms is appended
+    to that archive file (see polar_archive.py) every ARCHIVE_INTERVAL
+    seconds."""
+
+    def __init__(self, home, outdir='.', stats=None, name=None, shared=None, quadtree=False, sampler=None,
+                 archive=None, archive_interval=3600.0):
+        if stats is None: stats = Instrumentation()
+        self.stats = stats
+        self.outdir = outdir
+        self.name = name
+        #self.range_histo = BinHisto(220, 0, 440000)
+
+        self.polar_range_histo = make_range_histo()
+        self.polar_elev_histo = make_elev_histo()
+
+        self.rbe_from_home = range_bearing_elevation_from(home)
+
+        #try: self.range_histo.read('range.csv')
+        #except: traceback.print_exc()
+
+        try: self.polar_range_histo.read(os.path.join(outdir, 'polar_range.csv'))
+        except: traceback.print_exc()
+
+        try: self.polar_elev_histo.read(os.path.join(outdir, 'polar_elev.csv'))
+        except: traceback.print_exc()
+
+        if shared:
+            import polar_shared
+            self.shared = polar_shared.SharedHistograms(shared, [('range', self.polar_range_histo),
+                                                                 ('elevation', self.polar_elev_histo)])
+        else:
+            self.shared = None
+
+        if quadtree:
+            import polar_quadtree
+            self.quadtree = polar_quadtree.QuadTree()
+            try: self.quadtree = polar_quadtree.QuadTree.read(os.path.join(outdir, 'polar_quadtree.bin'))
+            except: traceback.print_exc()
+        else:
+            self.quadtree = None
+
+        self.sampler = sampler
+
+        if archive:
+            import polar_archive
+            self.archive = polar_archive.ArchiveWriter(archive, [('range', self.polar_range_histo),
+                                                                 ('elevation', self.polar_elev_histo)])
+            self.archive_interval = archive_interval
+        else:
+            self.archive = None
+        self.position_filter = PositionFilter(max_range=ABSOLUTE_MAXIMUM_RANGE,
+                                              min_elevation=ABSOLUTE_MINIMUM_ELEVATION,
+                                              counters=stats.counters)
+
+        self.current_aircraft = {}
+        self.last_save = time.time()
+        self.last_reset = 0
+        self.recent_updates = 0
+
+    def add_batch(self, batch, weights=None):
+        """Processes a list of (icao, timestamp, timestamp_string, lat, lng, alt_ft) positions.
+        Each position counts as one update, unless WEIGHTS gives a list of
+        update counts to use instead."""
+
+        if not batch: return
+
+        sampler = self.sampler
+        if sampler:
+            sampler.observe(time.time() - batch[-1][1], len(batch))
+            scale = sampler.ratio
+            if scale > 1:
+                kept = [i for i in xrange(len(batch)) if sampler.keep(batch[i][0])]
+                self.stats.counters['sampled_out'] += len(batch) - len(kept)
+                if weights: weights = [weights[i] for i in kept]
+                batch = [batch[i] for i in kept]
+                if not batch: return
+        else:
+            scale = 1
+
+        counters = self.stats.counters
+        timers = self.stats.timers
+        sample_every = self.stats.SAMPLE_EVERY
+        rbe_from_home = self.rbe_from_home
+        polar_range_histo = self.polar_range_histo
+        polar_elev_histo = self.polar_elev_histo
+        position_filter = self.position_filter
+        current_aircraft = self.current_aircraft
+        quadtree = self.quadtree
+
+        updates = []
+        geometry = []
+        for icao, update_timestamp, timestamp_string, lat, lng, alt_ft in batch:
+            counters['positions'] += 1
+            sample = (counters['positions'] % sample_every == 0)
+
+            if sample: t0 = time.time()
+            tr,hr,b,e,l = rbe_from_home((lat,lng,ft_to_m(alt_ft)))
+            if sample: timers['geodesy'] += time.time() - t0
+
+            # horiz_range is approx equal to great circle distance for the small angles we will deal with:
+            # difference is (tan(x)/x - 1) (about 1% at 10 degrees)
+            # 
+            # This seems to work well both at short range (where using line-of-sight distance would cause a zero-offset
+            # due to altitude) and long range (where the signals are close to the horizon, and using great circle distance
+            # would add an unwanted curvature effect)
+
+            updates.append((icao, update_timestamp, hr, e, l))
+            geometry.append(b)
+
+        t0 = time.time()
+        accepted = position_filter.check_batch(updates)
+        timers['filter'] += time.time() - t0
+
+        if self.shared: self.shared.begin()
+
+        for i in xrange(len(updates)):
+            icao, update_timestamp, r, e, l = updates[i]
+            b = geometry[i]
+
+            ac = current_aircraft.get(icao)
+            if not ac:
+                current_aircraft[icao] = ac = aircraft()
+                ac.last = update_timestamp
+                ac.range = r
+                ac.bearing = b
+                ac.elevation = e
+                ac.position = l
+
+            sample = (i % sample_every == 0)
+            elapsed = update_timestamp - ac.last
+            if elapsed > 0 and accepted[i]:
+                if sample: t0 = time.time()
+                n = (weights[i] if weights else 1) * scale
+                elapsed *= scale
+                #range_histo.add(ac.range, n, elapsed)
+                polar_range_histo.add(ac.bearing, ac.range, n, elapsed)
+                polar_elev_histo.add(ac.bearing, ac.elevation, n, elapsed)
+                if quadtree:
+                    # l is in a frame with the receiver on the X axis and the
+                    # ground plane in YZ: Y is east, Z is north
+                    quadtree.add(ac.position[1], ac.position[2], n, elapsed)
+                if sample: timers['histogram'] += time.time() - t0
+
+            ac.last = update_timestamp
+            ac.range = r
+            ac.bearing = b
+            ac.elevation = e
+            ac.position = l
+
+        self.recent_updates += len(updates)
+
+        if (update_timestamp - self.last_reset) > 30.0:
+            self.last_reset = update_timestamp
             for icao, ac in current_aircraft.items():
                 if (update_timestamp - ac.last) > 30.0:
                     # expire it.
                     # note that we still have to add 1 update to account for the initial update
                     # that hasn't been added yet.
 
-                    if not ac.blacklist:
-                        elapsed = 30.0 # always assume 30, even if we noticed it late
+                    if not position_filter.is_blacklisted(icao):
+                        elapsed = 30.0 * scale # always assume 30, even if we noticed it late
                         #range_histo.add(ac.range, 1, elapsed)
-                        polar_range_histo.add(ac.bearing, ac.range, 1, elapsed)
-                        polar_elev_histo.add(ac.bearing, ac.elevation, 1, elapsed)
-                        
-                    del current_aircraft[icao]
+                        polar_range_histo.add(ac.bearing, ac.range, scale, elapsed)
+                        polar_elev_histo.add(ac.bearing, ac.elevation, scale, elapsed)
+                        if quadtree: quadtree.add(ac.position[1], ac.position[2], scale, elapsed)
 
+                    del current_aircraft[icao]
+                    position_filter.forget(icao)
+                    counters['expired'] += 1
+
+        if self.shared: self.shared.end()
+
+    def periodic(self, now):
+        prefix = self.name + ': ' if self.name else ''
+        sampler = self.sampler
+        if sampler and sampler.update(now):
+            print '%sLag %.1fs, %.0f positions/s, CPU %.0f%%: now sampling 1 in %d aircraft' % (prefix, sampler.lag, sampler.rate,
+                                                                                             sampler.load * 100, sampler.ratio)
+            # aircraft that are no longer sampled are dropped without the
+            # usual expiry update, so they don't add unscaled data
+            for icao in self.current_aircraft.keys():
+                if not sampler.keep(icao):
+                    del self.current_aircraft[icao]
+                    self.position_filter.forget(icao)
+
+        if sampler:
+            gauges = self.stats.gauges
+            key = self.name + '.' if self.name else ''
+            gauges[key + 'sampling_ratio'] = sampler.ratio
+            gauges[key + 'lag'] = sampler.lag
+            gauges[key + 'ingest_rate'] = sampler.rate
+
+        if (now - self.last_save) > 30.0:
+            print '%sActive aircraft: %d   Update rate: %.1f/s%s' % (prefix, len(self.current_aircraft),
+                                                                     self.recent_updates / (now - self.last_save),
+                                                                     '   Sampling 1 in %d' % sampler.ratio if sampler and sampler.ratio > 1 else '')
+            self.recent_updates = 0
+            self.last_save = now
+            self.save()
+
+            archive = self.archive
+            if archive and (archive.last_time is None or now - archive.last_time >= self.archive_interval):
+                t0 = time.time()
+                archive.append(now)
+                self.stats.timers['save'] += time.time() - t0
+
+    def save(self):
+        t0 = time.time()
+        #self.range_histo.write('range.csv')
+        self.polar_range_histo.write(os.path.join(self.outdir, 'polar_range.csv'))
+        self.polar_elev_histo.write(os.path.join(self.outdir, 'polar_elev.csv'))
+        if self.quadtree: self.quadtree.write(os.path.join(self.outdir, 'polar_quadtree.bin'))
+        self.stats.timers['save'] += time.time() - t0
+        self.stats.counters['saves'] += 1
+
+    def close(self, now):
+        # the final save; the archive also gets a last snapshot, so that a
+        # run shorter than the save interval, or the last partial interval
+        # of a long one, isn't lost
+        self.save()
+        if self.archive:
+            t0 = time.time()
+            if self.archive.last_time != now:
+                self.archive.append(now)
+            self.archive.close()
+            self.stats.timers['save'] += time.time() - t0
+
+def process_positions(home, positions, outdir='.', stats=None, shared=None, quadtree=False, sampler=None,
+                      archive=None, archive_interval=3600.0):
+    if stats is None: stats = Instrumentation()
+    collector = Collector(home, outdir, stats, shared=shared, quadtree=quadtree, sampler=sampler,
+                          archive=archive, archive_interval=archive_interval)
+
+    for batch in micro_batches(positions, BATCH_SIZE):
+        collector.add_batch(batch)
         now = time.time()
-        if (now - last_save) > 30.0:
-            print 'Active aircraft: %d   Update rate: %.1f/s' % (len(current_aircraft), recent_updates / (now - last_save))
-            recent_updates = 0
-            last_save = now
-
-            #range_histo.write('range.csv')
-            polar_range_histo.write('polar_range.csv')
-            polar_elev_histo.write('polar_elev.csv')
-            
-    #range_histo.write('range.csv')
-    polar_range_histo.write('polar_range.csv')
-    polar_elev_histo.write('polar_elev.csv')
+        collector.periodic(now)
+        stats.tick(now)
+
+    collector.close(time.time())
+    stats.finish()
+
+def process_aircraft_json(home, polls, outdir='.', stats=None, shared=None, quadtree=False,
+                          archive=None, archive_interval=3600.0):
+    """Like process_positions, but for the (batch, weights) pairs
+    produced by read_aircraft_json."""
+
+    if stats is None: stats = Instrumentation()
+    collector = Collector(home, outdir, stats, shared=shared, quadtree=quadtree,
+                          archive=archive, archive_interval=archive_interval)
+
+    try:
+        for batch, weights in polls:
+            collector.add_batch(batch, weights)
+            now = time.time()
+            collector.periodic(now)
+            stats.tick(now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close(time.time())
+        stats.finish()
 
 if __name__ == '__main__':
-    import sys
-
-    home = (52.2, 0.1, 20)
-    process_basestation_messages(home, sys.stdin)
-
+    import logging
+    from optparse import OptionParser
+
+    parser = OptionParser(usage="%prog [options] [sbs-file]")
+    parser.add_option("--lat", type="float", default=52.2,
+                      help="receiver latitude (default %default)")
+    parser.add_option("--lon", type="float", default=0.1,
+                      help="receiver longitude (default %default)")
+    parser.add_option("--alt", type="float", default=20,
+                      help="receiver altitude in metres (default %default)")
+    parser.add_option("--beast", metavar="HOST:PORT", default=None,
+                      help="read Beast binary data from HOST:PORT (e.g. localhost:30005) instead of SBS")
+    parser.add_option("--beast-file", metavar="FILE", default=None,
+                      help="read a capture of Beast binary data from FILE instead of SBS")
+    parser.add_option("--aircraft-json", metavar="URL|FILE", default=None,
+                      help="poll aircraft.json (e.g. http://localhost/dump1090/data/aircraft.json) instead of reading SBS")
+    parser.add_option("--poll-interval", type="float", default=5.0,
+                      help="seconds between polls of --aircraft-json (default %default)")
+    parser.add_option("-d", "--dir", default=".",
+                      help="directory to read and write the histogram CSVs in (default %default)")
+    parser.add_option("--shared", metavar="FILE", default=None,
+                      help="also keep the histograms live in memory-mapped FILE (e.g. /run/polar.shm) for plotters to read")
+    parser.add_option("--quadtree", action="store_true", default=False,
+                      help="also keep an adaptive-resolution coverage histogram in polar_quadtree.bin")
+    parser.add_option("--archive", metavar="FILE", default=None,
+                      help="append a snapshot of the histograms to archive FILE every --archive-interval seconds")
+    parser.add_option("--archive-interval", metavar="SECONDS", type="float", default=3600.0,
+                      help="seconds between --archive snapshots (default %default)")
+    parser.add_option("--max-lag", metavar="SECONDS", type="float", default=None,
+                      help="if a live feed backs up by more than SECONDS, sample a fraction of the aircraft (scaled up to compensate) until it catches up")
+    parser.add_option("--max-cpu", metavar="FRACTION", type="float", default=None,
+                      help="likewise if the collector uses more than FRACTION of a CPU (e.g. 0.9)")
+    parser.add_option("--max-sampling", metavar="N", type="int", default=64,
+                      help="never keep fewer than 1 in N aircraft under --max-lag/--max-cpu (default %default)")
+    parser.add_option("--time", action="store_true", default=False,
+                      help="report processing time and position rate when the input ends")
+    parser.add_option("--stats-file", metavar="FILE", default=None,
+                      help="periodically write counters and stage timings to FILE as JSON")
+    parser.add_option("--stats-interval", type="float", default=30.0,
+                      help="seconds between writes of --stats-file (default %default)")
+    parser.add_option("--profile", metavar="SECONDS", type="float", default=None,
+                      help="profile the first SECONDS of processing")
+    parser.add_option("--profile-mode", choices=["cprofile", "sample"], default="cprofile",
+                      help="cprofile, or sample for a low-overhead statistical profile (default %default)")
+    parser.add_option("--profile-output", metavar="FILE", default="adsb-polar.prof",
+                      help="where to write profiles (default %default)")
+    (options, args) = parser.parse_args()
+
+    # blacklisting messages from the position filter, rate-limited
+    logging.basicConfig(stream=sys.stdout, format='%(message)s', level=logging.INFO)
+
+    # SIGUSR1 dumps the current stats to stderr,
+    # SIGUSR2 profiles the next --profile seconds (default 60)
+    stats = Instrumentation(options.stats_file, options.stats_interval, options.profile_output)
+    signal.signal(signal.SIGUSR1, stats.request_dump)
+    signal.signal(signal.SIGUSR2, lambda *args: stats.request_profile(options.profile or 60.0, options.profile_mode))
+    if options.profile:
+        stats.request_profile(options.profile, options.profile_mode)
+
+    home = (options.lat, options.lon, options.alt)
+
+    class counted:
+        def __init__(self, it):
+            self.it = it
+            self.count = 0
+        def __iter__(self):
+            for x in self.it:
+                self.count += 1
+                yield x
+
+    if options.aircraft_json:
+        process_aircraft_json(home, read_aircraft_json(options.aircraft_json, options.poll_interval, stats),
+                              options.dir, stats, options.shared, options.quadtree,
+                              archive=options.archive, archive_interval=options.archive_interval)
+        sys.exit(0)
+
+    if options.max_lag or options.max_cpu:
+        sampler = OverloadSampler(options.max_lag, options.max_cpu, options.max_sampling)
+    else:
+        sampler = None
+
+    if options.beast or options.beast_file:
+        import beast, socket
+        if options.beast:
+            host, port = options.beast.rsplit(':', 1)
+            source = socket.create_connection((host, int(port)))
+            positions = beast.read_positions(beast.read_frames(source), home)
+        else:
+            source = open(options.beast_file, 'rb')
+            positions = beast.read_positions(beast.read_frames(source), home, clock=os.path.getmtime(options.beast_file))
+    else:
+        source = open(args[0], 'r') if args else sys.stdin
+        positions = read_basestation(source, stats, sampler)
+
+    positions = counted(positions)
+    start = time.time()
+    start_cpu = time.clock()
+    process_positions(home, positions, options.dir, stats, options.shared, options.quadtree, sampler,
+                      options.archive, options.archive_interval)
+
+    if options.time:
+        elapsed = time.time() - start
+        cpu = time.clock() - start_cpu
+        print 'Processed %d positions in %.2fs (%.2fs CPU), %.0f positions/s' % (positions.count, elapsed, cpu, positions.count / max(cpu, 1e-6))
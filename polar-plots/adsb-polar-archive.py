@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+#
+# Lists or extracts snapshots from an archive kept by adsb-polar-2.py --archive.
+#
+#   adsb-polar-archive.py polar_archive.bin
+#       lists the snapshots
+#
+#   adsb-polar-archive.py --at '2016-05-01 12:00' -o polar_range.csv polar_archive.bin
+#       writes the range histogram as it was then
+#
+#   adsb-polar-archive.py --from 2016-05-01 --to 2016-05-08 -o week.csv polar_archive.bin
+#       writes just what was collected in that week
+#
+# The output is in the collector's CSV format, so any of the plotters can
+# draw it. Times are local, as YYYY-MM-DD[ HH:MM[:SS]], or seconds since
+# the epoch.
+#
+
+import sys, time
+from optparse import OptionParser
+
+import polar_archive
+
+def parse_time(s):
+    try:
+        return float(s)
+    except ValueError:
+        pass
+
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError('bad time: %s' % s)
+
+def format_time(t):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t))
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] archive")
+    parser.add_option("--at", default=None,
+                      help="extract the last snapshot at or before this time")
+    parser.add_option("--from", dest="start", default=None,
+                      help="extract what was collected since this time (with --to)")
+    parser.add_option("--to", dest="end", default=None,
+                      help="extract what was collected up to this time (default: the latest snapshot)")
+    parser.add_option("-n", "--histogram", choices=["range", "elevation"], default="range",
+                      help="range or elevation (default %default)")
+    parser.add_option("-o", "--output", default=None,
+                      help="CSV file to write")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("need an archive file")
+
+    try:
+        reader = polar_archive.ArchiveReader(args[0])
+    except (IOError, ValueError), e:
+        print >>sys.stderr, e
+        sys.exit(1)
+
+    try:
+        if options.at is None and options.start is None and options.end is None:
+            for i, t in enumerate(reader.times()):
+                print '%5d  %s' % (i, format_time(t))
+            sys.exit(0)
+
+        if not options.output:
+            parser.error("need an output file (-o)")
+        if reader.count == 0:
+            print >>sys.stderr, '%s: no snapshots yet' % args[0]
+            sys.exit(1)
+
+        try:
+            if options.at is not None:
+                i = reader.find(parse_time(options.at))
+                values = reader.snapshot(i) if i >= 0 else None
+            else:
+                start = parse_time(options.start) if options.start else 0
+                end = parse_time(options.end) if options.end else reader.times()[-1]
+                values = reader.between(start, end)
+        except ValueError, e:
+            parser.error(str(e))
+
+        if values is None:
+            print >>sys.stderr, 'no snapshot that early'
+            sys.exit(1)
+        if options.at is None and reader.find(start) >= reader.find(end):
+            print >>sys.stderr, 'no snapshots in that range; writing an empty histogram'
+
+        polar_archive.write_csv(reader.cells(values, options.histogram), options.output)
+    finally:
+        reader.close()
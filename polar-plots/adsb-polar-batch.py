@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+#
+# Renders a whole list of polar plots in one go, from a single load of
+# polar_range.csv and polar_elev.csv.
+#
+# The configuration is a JSON file like:
+#
+# {
+#   "range": "polar_range.csv",
+#   "elevation": "polar_elev.csv",
+#   "outputs": [
+#     { "type": "combined", "output": "polar.png" },
+#     { "type": "range", "output": "polar-small.png", "size": 400 },
+#     { "type": "range", "output": "polar-north.png", "bearings": [315, 45], "max_range": 200000 },
+#     { "type": "elevation", "output": "elevation.png", "size": 400 }
+#   ]
+# }
+#
+# Instead of "range" and "elevation", "shared": "/run/polar.shm" reads the
+# live histograms from a collector run with --shared.
+#
+# Each output can set type (range, elevation, combined or quadtree), output,
+# size, max_range, max_rate and bearings (a window of bearings to draw).
+# quadtree outputs draw the adaptive-resolution histogram that a collector
+# run with --quadtree writes; "quadtree" names the file (default
+# polar_quadtree.bin).
+#
+
+import json, sys, time
+import multiprocessing
+from contextlib import closing
+from optparse import OptionParser
+
+import polar_render, polar_quadtree
+
+snapshot = None
+quadtree = None
+
+def render_one(spec):
+    start = time.time()
+    if spec.get('type') == 'quadtree':
+        output = polar_quadtree.render(quadtree, spec)
+    else:
+        output = polar_render.render(snapshot, spec)
+    return (output, time.time() - start)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] config.json")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+                      help="number of worker processes (default %default)")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="report the time taken for each image")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("need a config file")
+
+    with closing(open(args[0], 'r')) as f:
+        config = json.load(f)
+
+    start = time.time()
+    types = set(spec.get('type', 'combined') for spec in config['outputs'])
+    if 'quadtree' in types:
+        quadtree = polar_quadtree.QuadTree.read(config.get('quadtree', 'polar_quadtree.bin'))
+        types.discard('quadtree')
+
+    if types:
+        snapshot = polar_render.Snapshot()
+        if 'shared' in config:
+            snapshot.read_shared(config['shared'])
+        else:
+            snapshot.read_range(config.get('range', 'polar_range.csv'))
+            if types != set(['range']):
+                snapshot.read_elevation(config.get('elevation', 'polar_elev.csv'))
+    if options.verbose:
+        print "loaded snapshot in %.2fs" % (time.time() - start)
+
+    # workers are forked after the snapshot is loaded, so they share it
+    if options.jobs > 1 and len(config['outputs']) > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.map(render_one, config['outputs'])
+        pool.close()
+        pool.join()
+    else:
+        results = map(render_one, config['outputs'])
+
+    if options.verbose:
+        for output, elapsed in results:
+            print "%s rendered in %.2fs" % (output, elapsed)
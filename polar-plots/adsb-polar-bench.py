@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+
+#
+# Benchmarks for the polar collection / plotting pipeline.
+#
+# Generates deterministic synthetic traffic (SBS lines, Beast frames and
+# aircraft.json snapshots) for a configurable number of aircraft around a
+# receiver, then times each stage of the pipeline separately:
+#
+#   parse-sbs      read_basestation() over the SBS lines
+#   parse-beast    Beast frame reading and CPR decoding
+#   geodesy        range_bearing_elevation_from() for every position
+#   histogram      MultiPolarRangeHisto.add() for every position
+#   write / read   checkpointing the histograms to CSV and reading them back
+#   render         drawing polar.png via polar_render (if PIL is available)
+#
+# Results are written as JSON (default bench.json) so that runs against
+# different versions can be compared.
+#
+
+import imp, json, math, os, platform, random, shutil, sys, tempfile, time
+from contextlib import closing
+from cStringIO import StringIO
+from optparse import OptionParser
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+adsb_polar = imp.load_source('adsb_polar_2', os.path.join(here, 'adsb-polar-2.py'))
+import beast
+
+#
+# Synthetic traffic
+#
+
+class SyntheticTraffic:
+    def __init__(self, home, n_aircraft, rate, duration, max_range, seed):
+        self.home = home
+        self.rng = random.Random(seed)
+
+        self.aircraft = []
+        for i in xrange(n_aircraft):
+            # start somewhere within max_range, heading in a random direction at 200-250m/s
+            self.aircraft.append( { 'icao' : 0x400000 + i,
+                                    'bearing' : self.rng.uniform(0, 360),
+                                    'range' : max_range * math.sqrt(self.rng.random()),
+                                    'track' : self.rng.uniform(0, 360),
+                                    'speed' : self.rng.uniform(200, 250),
+                                    'alt_ft' : self.rng.randint(40, 400) * 100,
+                                    'offset' : self.rng.random() / rate } )
+
+        # (timestamp, index) of every position update, in time order
+        self.updates = []
+        for i, ac in enumerate(self.aircraft):
+            t = ac['offset']
+            while t < duration:
+                self.updates.append( (t, i) )
+                t += self.rng.expovariate(rate)
+        self.updates.sort()
+
+    def position(self, ac, t):
+        # flat-earth approximation is plenty for generating test data
+        x = ac['range'] * math.sin(math.radians(ac['bearing'])) + ac['speed'] * t * math.sin(math.radians(ac['track']))
+        y = ac['range'] * math.cos(math.radians(ac['bearing'])) + ac['speed'] * t * math.cos(math.radians(ac['track']))
+        lat = self.home[0] + y / 111195.0
+        lon = self.home[1] + x / (111195.0 * math.cos(math.radians(self.home[0])))
+        return (lat, lon, ac['alt_ft'])
+
+    def positions(self, start_time):
+        for t, i in self.updates:
+            ac = self.aircraft[i]
+            lat, lon, alt_ft = self.position(ac, t)
+            yield (start_time + t, ac['icao'], lat, lon, alt_ft)
+
+    def sbs_lines(self, start_time):
+        lines = []
+        for ts, icao, lat, lon, alt_ft in self.positions(start_time):
+            d = time.strftime('%Y/%m/%d', time.localtime(ts))
+            tm = time.strftime('%H:%M:%S', time.localtime(ts)) + '.%03d' % int((ts % 1) * 1000)
+            lines.append('MSG,3,111,11111,%06X,111111,%s,%s,%s,%s,,%d,,,%.5f,%.5f,,,0,0,0,0\n' % (icao, d, tm, d, tm, alt_ft, lat, lon))
+        return lines
+
+    def beast_data(self, start_time):
+        out = bytearray()
+        odd = {}
+        for ts, icao, lat, lon, alt_ft in self.positions(start_time):
+            odd[icao] = f = 1 - odd.get(icao, 1)
+            out += beast_frame(int((ts - start_time) * 12e6), encode_position(icao, lat, lon, alt_ft, f))
+        return str(out)
+
+    def aircraft_json(self, t, start_time):
+        now = start_time + t
+        result = []
+        for ac in self.aircraft:
+            lat, lon, alt_ft = self.position(ac, t)
+            result.append( { 'hex' : '%06x' % ac['icao'],
+                             'lat' : lat, 'lon' : lon, 'altitude' : alt_ft,
+                             'seen' : 0.5, 'seen_pos' : 0.5,
+                             'messages' : int(t * 4) } )
+        return { 'now' : now, 'messages' : int(t * 4) * len(self.aircraft), 'aircraft' : result }
+
+def cpr_encode(lat, lon, odd):
+    i = 1 if odd else 0
+    dlat = 360.0 / (60 - i)
+    yz = int(math.floor(beast.CPR_MAX * beast.cpr_mod(lat, dlat) / dlat + 0.5))
+    rlat = dlat * (yz / beast.CPR_MAX + math.floor(lat / dlat))
+    nl = beast.cpr_nl(rlat) - i
+    dlon = 360.0 / nl if nl > 0 else 360.0
+    xz = int(math.floor(beast.CPR_MAX * beast.cpr_mod(lon, dlon) / dlon + 0.5))
+    return (yz & 0x1FFFF, xz & 0x1FFFF)
+
+def encode_position(icao, lat, lon, alt_ft, odd):
+    # DF17 airborne position, TC11, 25ft altitude encoding
+    n = int((alt_ft + 1000) / 25)
+    alt12 = ((n & 0x7F0) << 1) | 0x10 | (n & 0xF)
+    yz, xz = cpr_encode(lat, lon, odd)
+    me = (11 << 51) | (alt12 << 36) | (odd << 34) | (yz << 17) | xz
+    msg = bytearray([(17 << 3) | 5, (icao >> 16) & 255, (icao >> 8) & 255, icao & 255])
+    for k in xrange(6, -1, -1):
+        msg.append((me >> (8*k)) & 255)
+    msg += '\0\0\0'
+    crc = beast.crc_residual(msg)
+    msg[11] = (crc >> 16) & 255
+    msg[12] = (crc >> 8) & 255
+    msg[13] = crc & 255
+    return msg
+
+def beast_frame(ts, msg):
+    body = bytearray([(ts >> s) & 255 for s in (40, 32, 24, 16, 8, 0)]) + bytearray([128]) + msg
+    out = bytearray('\x1a\x33')
+    for b in body:
+        out.append(b)
+        if b == 0x1a: out.append(0x1a)
+    return out
+
+#
+# Stages
+#
+
+def timed(results, name, count, fn, *args):
+    start = time.time()
+    start_cpu = time.clock()
+    result = fn(*args)
+    cpu = time.clock() - start_cpu
+    results[name] = { 'seconds' : time.time() - start,
+                      'cpu_seconds' : cpu,
+                      'count' : count,
+                      'per_second' : count / cpu if cpu > 0 else None }
+    return result
+
+def run(options):
+    home = (options.lat, options.lon, options.alt)
+    start_time = time.mktime((2016, 1, 1, 0, 0, 0, 0, 0, -1))
+    results = {}
+
+    gen_start = time.time()
+    traffic = SyntheticTraffic(home, options.aircraft, options.rate, options.duration, options.max_range, options.seed)
+    sbs = traffic.sbs_lines(start_time)
+    n = len(sbs)
+    beast_data = traffic.beast_data(start_time) if not options.no_beast else None
+    generate_seconds = time.time() - gen_start
+
+    positions = timed(results, 'parse-sbs', n, lambda: list(adsb_polar.read_basestation(sbs)))
+
+    # read_basestation takes a list of lines (as adsb-polar-multi.py passes)
+    # or a file (as adsb-polar-2.py does); both must parse the same
+    if list(adsb_polar.read_basestation(StringIO(''.join(sbs)))) != positions:
+        raise RuntimeError('read_basestation parsed a file differently from a list of lines')
+
+    if beast_data is not None:
+        timed(results, 'parse-beast', n,
+              lambda: list(beast.read_positions(beast.read_frames(StringIO(beast_data)), home, clock=start_time)))
+
+    rbe = adsb_polar.range_bearing_elevation_from(home)
+    rbes = timed(results, 'geodesy', n,
+                 lambda: [rbe((lat, lng, adsb_polar.ft_to_m(alt_ft))) for icao, ts, tss, lat, lng, alt_ft in positions])
+
+    range_histo = adsb_polar.make_range_histo()
+    elev_histo = adsb_polar.make_elev_histo()
+    def add_all():
+        for tr, hr, b, e, l in rbes:
+            range_histo.add(b, hr, 1, 1.0)
+            elev_histo.add(b, e, 1, 1.0)
+    timed(results, 'histogram', n, add_all)
+
+    tmpdir = tempfile.mkdtemp(prefix='adsb-polar-bench')
+    try:
+        range_csv = os.path.join(tmpdir, 'polar_range.csv')
+        elev_csv = os.path.join(tmpdir, 'polar_elev.csv')
+        def write_all():
+            range_histo.write(range_csv)
+            elev_histo.write(elev_csv)
+        timed(results, 'write', 1, write_all)
+        results['write']['bytes'] = os.path.getsize(range_csv) + os.path.getsize(elev_csv)
+
+        def read_all():
+            adsb_polar.make_range_histo().read(range_csv)
+            adsb_polar.make_elev_histo().read(elev_csv)
+        timed(results, 'read', 1, read_all)
+
+        try:
+            import polar_render
+            import PIL
+        except ImportError:
+            results['render'] = None
+        else:
+            def render():
+                snap = polar_render.Snapshot()
+                snap.read_range(range_csv)
+                snap.read_elevation(elev_csv)
+                polar_render.render(snap, { 'type' : 'combined', 'output' : os.path.join(tmpdir, 'polar.png') })
+            timed(results, 'render', 1, render)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return { 'params' : { 'aircraft' : options.aircraft,
+                          'rate' : options.rate,
+                          'duration' : options.duration,
+                          'max_range' : options.max_range,
+                          'seed' : options.seed,
+                          'home' : home,
+                          'positions' : n },
+             'environment' : { 'python' : platform.python_version(),
+                               'implementation' : platform.python_implementation(),
+                               'machine' : platform.machine(),
+                               'platform' : platform.platform() },
+             'generate_seconds' : generate_seconds,
+             'stages' : results }
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--aircraft", type="int", default=200,
+                      help="number of simulated aircraft (default %default)")
+    parser.add_option("-r", "--rate", type="float", default=2.0,
+                      help="position updates per second per aircraft (default %default)")
+    parser.add_option("-t", "--duration", type="float", default=120.0,
+                      help="seconds of traffic to simulate (default %default)")
+    parser.add_option("-m", "--max-range", type="float", default=350000.0,
+                      help="maximum starting range of aircraft in metres (default %default)")
+    parser.add_option("-s", "--seed", type="int", default=1,
+                      help="random seed (default %default)")
+    parser.add_option("--lat", type="float", default=52.2)
+    parser.add_option("--lon", type="float", default=0.1)
+    parser.add_option("--alt", type="float", default=20)
+    parser.add_option("--no-beast", action="store_true", default=False,
+                      help="skip generating and parsing Beast data")
+    parser.add_option("-o", "--output", default="bench.json",
+                      help="where to write the results (default %default)")
+    parser.add_option("--write-traffic", metavar="PREFIX", default=None,
+                      help="also save the generated traffic as PREFIX.sbs, PREFIX.beast and PREFIX-aircraft.json")
+    (options, args) = parser.parse_args()
+
+    results = run(options)
+
+    with closing(open(options.output, 'w')) as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    for name in ('parse-sbs', 'parse-beast', 'geodesy', 'histogram', 'write', 'read', 'render'):
+        r = results['stages'].get(name)
+        if r is None: continue
+        if r['count'] > 1:
+            print '%-12s %8.3fs CPU  %10.0f/s' % (name, r['cpu_seconds'], r['per_second'])
+        else:
+            print '%-12s %8.3fs CPU' % (name, r['cpu_seconds'])
+
+    if options.write_traffic:
+        home = (options.lat, options.lon, options.alt)
+        start_time = time.mktime((2016, 1, 1, 0, 0, 0, 0, 0, -1))
+        traffic = SyntheticTraffic(home, options.aircraft, options.rate, options.duration, options.max_range, options.seed)
+        with closing(open(options.write_traffic + '.sbs', 'w')) as f:
+            f.writelines(traffic.sbs_lines(start_time))
+        with closing(open(options.write_traffic + '.beast', 'wb')) as f:
+            f.write(traffic.beast_data(start_time))
+        with closing(open(options.write_traffic + '-aircraft.json', 'w')) as f:
+            json.dump(traffic.aircraft_json(options.duration, start_time), f)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+#
+# Exports polar_range.csv as GeoJSON coverage contours, for web maps that
+# would otherwise have to fetch a freshly drawn PNG.
+#
+# For each rate level (default 0.5, 1.0 and 1.5 updates/s/aircraft) and
+# each bearing step, the contour is at the far edge of the furthest bin
+# whose rate is above the level, as adsb-polar-plot.py does for rate > 1.0.
+# Each level becomes one polygon around the receiver, simplified with
+# Douglas-Peucker to within --tolerance metres. Lower levels come first, so
+# drawing the features in order stacks them.
+#
+# The per-bearing ranges are kept in a state file (default OUTPUT.state)
+# along with a signature of the bins each bearing covers. Only bearings
+# whose bins have changed are recomputed, only levels with a changed
+# bearing are re-simplified, and the output isn't rewritten if nothing
+# changed.
+#
+
+import hashlib, json, math, os
+from contextlib import closing
+from optparse import OptionParser
+
+import polar_render
+
+MEAN_R = 6371009.0
+
+def dtor(d):
+    return d * math.pi / 180.0
+
+def rtod(r):
+    return r * 180.0 / math.pi
+
+def destination(lat, lon, bearing, distance):
+    # destination point given start, bearing and distance, assuming spherical geometry
+    # from http://www.movable-type.co.uk/scripts/latlong.html
+    lat1 = dtor(lat)
+    lon1 = dtor(lon)
+    brng = dtor(bearing)
+    d = distance / MEAN_R
+
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) + math.cos(lat1) * math.sin(d) * math.cos(brng))
+    lon2 = lon1 + math.atan2(math.sin(brng) * math.sin(d) * math.cos(lat1),
+                             math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return (rtod(lat2), (rtod(lon2) + 540) % 360 - 180)
+
+def cells_by_bearing(rows, step):
+    """Groups (b_start, b_end, r_start, r_end, rate) rows by the bearing
+    steps whose centres they cover."""
+
+    n = int(round(360.0 / step))
+    bearings = [[] for i in xrange(n)]
+    for row in rows:
+        b_start, b_end = row[0], row[1]
+        first = int(math.ceil(b_start / step - 0.5))
+        i = first
+        while (i + 0.5) * step < b_end:
+            bearings[i % n].append(row)
+            i += 1
+    return bearings
+
+def signature(cells):
+    h = hashlib.sha1()
+    for cell in sorted(cells):
+        h.update(repr(cell))
+    return h.hexdigest()
+
+def max_ranges(cells, levels):
+    ranges = [0.0] * len(levels)
+    for b_start, b_end, r_start, r_end, rate in cells:
+        for j in xrange(len(levels)):
+            if rate > levels[j] and r_end > ranges[j]:
+                ranges[j] = r_end
+    return ranges
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of the polyline POINTS; the first
+    and last points are always kept."""
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = points[first]
+        dx = points[last][0] - x0
+        dy = points[last][1] - y0
+        length = math.hypot(dx, dy)
+
+        worst = None
+        worst_d = tolerance
+        for i in xrange(first + 1, last):
+            x, y = points[i]
+            if length > 0:
+                d = abs(dy * (x - x0) - dx * (y - y0)) / length
+            else:
+                d = math.hypot(x - x0, y - y0)
+            if d > worst_d:
+                worst = i
+                worst_d = d
+
+        if worst is not None:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+
+    return [points[i] for i in xrange(len(points)) if keep[i]]
+
+def contour(home, ranges, step, tolerance):
+    """Returns the closed ring of [lon, lat] for one level, or None if the
+    level has no coverage."""
+
+    if not any(ranges):
+        return None
+
+    # simplify in a flat east/north plane around the receiver; start the
+    # ring at the furthest point, since Douglas-Peucker always keeps the ends
+    n = len(ranges)
+    start = max(xrange(n), key=lambda i: ranges[i])
+    points = []
+    for k in xrange(n + 1):
+        i = (start + k) % n
+        b = dtor((i + 0.5) * step)
+        points.append((ranges[i] * math.sin(b), ranges[i] * math.cos(b)))
+
+    ring = []
+    for x, y in simplify(points, tolerance):
+        r = math.hypot(x, y)
+        if r > 0:
+            lat, lon = destination(home[0], home[1], (rtod(math.atan2(x, y)) + 360) % 360, r)
+        else:
+            lat, lon = home
+        ring.append([round(lon, 5), round(lat, 5)])
+
+    # GeoJSON wants exterior rings anticlockwise; ours runs clockwise with bearing
+    ring.reverse()
+    return ring
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] receiver_lat receiver_lon")
+    parser.add_option("-i", "--input", default="polar_range.csv",
+                      help="polar range histogram to read (default %default)")
+    parser.add_option("-s", "--shared", metavar="FILE", default=None,
+                      help="read the live histograms of a collector run with --shared FILE instead")
+    parser.add_option("-o", "--output", default="coverage.geojson",
+                      help="GeoJSON file to write (default %default)")
+    parser.add_option("--state", default=None,
+                      help="state kept between runs (default OUTPUT.state)")
+    parser.add_option("-l", "--levels", default="0.5,1.0,1.5",
+                      help="comma-separated rate levels in updates/s/aircraft (default %default)")
+    parser.add_option("--step", type="float", default=1.0,
+                      help="bearing step in degrees (default %default)")
+    parser.add_option("-t", "--tolerance", type="float", default=1000.0,
+                      help="simplification tolerance in metres (default %default)")
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error("need the receiver latitude and longitude")
+
+    home = (float(args[0]), float(args[1]))
+    levels = sorted(float(x) for x in options.levels.split(','))
+    state_file = options.state or options.output + '.state'
+
+    # anything that changes how the contours are drawn invalidates the state
+    params = { 'home' : home, 'levels' : levels, 'step' : options.step, 'tolerance' : options.tolerance }
+    try:
+        with closing(open(state_file, 'r')) as f:
+            state = json.load(f)
+        if state.get('params') != json.loads(json.dumps(params)):
+            state = None
+    except (IOError, ValueError):
+        state = None
+    if state is None:
+        state = { 'params' : params, 'signatures' : {}, 'ranges' : {}, 'contours' : {} }
+
+    if options.shared:
+        import polar_shared
+        cells = polar_shared.read(options.shared)['range']
+    else:
+        cells = polar_render.read_cells(options.input)
+
+    bearings = cells_by_bearing(polar_render.range_rates(cells), options.step)
+
+    changed = set()
+    for i in xrange(len(bearings)):
+        key = str(i)
+        sig = signature(bearings[i])
+        if state['signatures'].get(key) == sig: continue
+
+        ranges = max_ranges(bearings[i], levels)
+        old = state['ranges'].get(key, [0.0] * len(levels))
+        for j in xrange(len(levels)):
+            if ranges[j] != old[j]: changed.add(j)
+        state['signatures'][key] = sig
+        state['ranges'][key] = ranges
+
+    for j in changed:
+        ranges = [state['ranges'][str(i)][j] for i in xrange(len(bearings))]
+        state['contours'][str(j)] = contour(home, ranges, options.step, options.tolerance)
+
+    features = None
+    if changed or not os.path.exists(options.output):
+        features = []
+        for j in xrange(len(levels)):
+            ring = state['contours'].get(str(j))
+            if ring is None: continue
+            features.append({ 'type' : 'Feature',
+                              'properties' : { 'min_rate' : levels[j],
+                                               'max_range_km' : round(max(state['ranges'][str(i)][j] for i in xrange(len(bearings))) / 1000.0, 1) },
+                              'geometry' : { 'type' : 'Polygon', 'coordinates' : [ring] } })
+
+        with closing(open(options.output + '.new', 'w')) as f:
+            json.dump({ 'type' : 'FeatureCollection', 'features' : features }, f, separators=(',', ':'))
+        os.rename(options.output + '.new', options.output)
+
+    with closing(open(state_file + '.new', 'w')) as f:
+        json.dump(state, f)
+    os.rename(state_file + '.new', state_file)
+
+    if features is None:
+        print "no change"
+    else:
+        print "%d levels changed, %d contours written" % (len(changed), len(features))
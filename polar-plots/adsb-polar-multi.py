@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+#
+# Collects polar range/elevation histograms for several receivers in a
+# single process, instead of running one adsb-polar-2.py per receiver.
+#
+# The configuration is a JSON file like:
+#
+# {
+#   "sites": [
+#     { "name": "home", "home": [52.2, 0.1, 20], "feed": "localhost:30003", "format": "sbs", "dir": "home" },
+#     { "name": "mast", "home": [52.3, 0.2, 45], "feed": "mast:30005", "format": "beast", "dir": "mast" }
+#   ]
+# }
+#
+# home is the receiver's latitude, longitude and altitude in metres; feed
+# is the HOST:PORT to read SBS (port 30003) or Beast (port 30005) data
+# from; dir is where the site's polar_range.csv and polar_elev.csv are
+# kept (default: the site name). An optional "shared" filename keeps the
+# site's histograms live in a memory-mapped file (see polar_shared.py), and
+# "quadtree": true keeps an adaptive-resolution histogram as well (see
+# polar_quadtree.py). "max_lag": SECONDS and/or "max_cpu": FRACTION turn on
+# overload sampling as with adsb-polar-2.py --max-lag/--max-cpu (max_cpu
+# counts the whole worker process, so it suits a site that has one alone).
+# "archive": FILE and "archive_interval": SECONDS keep a snapshot archive as
+# with --archive.
+#
+# Every site has its own histograms, position filter and precomputed
+# geometry, and all feeds are read from one select() loop. With -j N the
+# sites are shared out between N worker processes.
+#
+
+import errno, imp, json, os, select, signal, socket, sys, time
+import multiprocessing
+from contextlib import closing
+from optparse import OptionParser
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+adsb_polar = imp.load_source('adsb_polar_2', os.path.join(here, 'adsb-polar-2.py'))
+import beast
+
+RECONNECT_INTERVAL = 30.0
+
+class Site:
+    def __init__(self, config, stats):
+        self.name = config['name']
+        self.home = tuple(config['home'])
+        host, port = config['feed'].rsplit(':', 1)
+        self.address = (host, int(port))
+        self.format = config.get('format', 'sbs')
+        if self.format not in ('sbs', 'beast'):
+            raise ValueError('%s: unknown feed format %r' % (self.name, self.format))
+
+        outdir = config.get('dir', self.name)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        self.stats = stats
+        if config.get('max_lag') or config.get('max_cpu'):
+            sampler = adsb_polar.OverloadSampler(config.get('max_lag'), config.get('max_cpu'))
+        else:
+            sampler = None
+        self.collector = adsb_polar.Collector(self.home, outdir, stats, self.name, config.get('shared'),
+                                              config.get('quadtree', False), sampler,
+                                              config.get('archive'), config.get('archive_interval', 3600.0))
+        self.sock = None
+        self.next_connect = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def connect(self, now):
+        self.next_connect = now + RECONNECT_INTERVAL
+        try:
+            self.sock = socket.create_connection(self.address, 5.0)
+        except socket.error, e:
+            print >>sys.stderr, '%s: connecting to %s:%d failed: %s' % (self.name, self.address[0], self.address[1], e)
+            return
+
+        self.sock.setblocking(0)
+        self.partial = ''
+        self.frames = beast.FrameParser()
+        self.decoder = beast.PositionDecoder(self.home)
+
+    def disconnect(self):
+        self.sock.close()
+        self.sock = None
+
+    def read(self):
+        try:
+            data = self.sock.recv(65536)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR): return
+            data = ''
+
+        if not data:
+            print >>sys.stderr, '%s: lost connection to %s:%d' % (self.name, self.address[0], self.address[1])
+            self.disconnect()
+            return
+
+        if self.format == 'sbs':
+            lines = (self.partial + data).split('\n')
+            self.partial = lines.pop()
+            positions = list(adsb_polar.read_basestation(lines, self.stats, self.collector.sampler))
+        else:
+            positions = list(self.decoder.positions(self.frames.feed(data)))
+
+        self.collector.add_batch(positions)
+
+def run(configs):
+    stats = adsb_polar.Instrumentation()
+    sites = [Site(config, stats) for config in configs]
+
+    # save the histograms on the way out
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    try:
+        while True:
+            now = time.time()
+            for site in sites:
+                if site.sock is None and now >= site.next_connect:
+                    site.connect(now)
+
+            active = [site for site in sites if site.sock is not None]
+            if active:
+                try:
+                    readable, writable, failed = select.select(active, [], [], 1.0)
+                except select.error, e:
+                    if e.args[0] != errno.EINTR: raise
+                    readable = []
+            else:
+                time.sleep(1.0)
+                readable = []
+
+            for site in readable:
+                site.read()
+
+            now = time.time()
+            for site in sites:
+                site.collector.periodic(now)
+            stats.tick(now)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        now = time.time()
+        for site in sites:
+            site.collector.close(now)
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] config.json")
+    parser.add_option("-j", "--jobs", type="int", default=1,
+                      help="number of worker processes to share the sites between (default %default)")
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("expected a configuration file")
+
+    with closing(open(args[0], 'r')) as f:
+        configs = json.load(f)['sites']
+
+    jobs = max(1, min(options.jobs, len(configs)))
+    if jobs == 1:
+        run(configs)
+    else:
+        workers = [multiprocessing.Process(target=run, args=(configs[i::jobs],)) for i in xrange(jobs)]
+        for worker in workers:
+            worker.start()
+
+        def stop(*args):
+            for worker in workers:
+                worker.terminate()
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # the workers get the interrupt too, and save as they exit
+            for worker in workers:
+                worker.join()
@@ -1,14 +1,40 @@
 #!/usr/bin/env python
 
-import csv, math, os, sys
-import cairo, colorsys
+import csv, math, os, hashlib, cPickle
 from contextlib import closing
+from optparse import OptionParser
 
-data = []
-max_range = 0.0
+# cairo (and colorsys) are imported by the functions that use them, so that
+# importing this module (see adsb-polar-worker.py) is cheap
 
-with closing(open('polar_range.csv', 'r')) as f:
-    r = csv.reader(f)
+max_range = 400000.0
+max_rate = 2.0
+
+# Rates are quantized into a fixed palette, so that every sector of the
+# same colour can go into a single path and be filled in one go.
+N_COLOURS = 64
+
+def bucket_for(x):
+    if x < 0.1: return 0
+    intensity = min(1.0, (1.0 * x / max_rate) ** 0.8)
+    return int(intensity * (N_COLOURS - 1) + 0.5)
+
+def make_palette():
+    import cairo, colorsys
+    palette = []
+    for i in xrange(N_COLOURS):
+        intensity = 1.0 * i / (N_COLOURS - 1)
+        h = intensity * 0.5
+        s = 1.0
+        l = 0.3 + intensity*0.5
+        r,g,b = colorsys.hls_to_rgb(h,l,s)
+        palette.append(cairo.SolidPattern(r,g,b,1.0))
+    return palette
+
+def read_sectors(raw):
+    # returns {(b_start,b_end): [(r_start,r_end,bucket), ...]}
+    sectors = {}
+    r = csv.reader(raw.splitlines())
     r.next() # header
     for row in r:
         b_start = float(row[0])
@@ -23,85 +49,194 @@ with closing(open('polar_range.csv', 'r')) as f:
             rate = 0.0
 
         if rate > 0:
-            data.append( ( (b_start-90) * math.pi / 180.0, (b_end-90) * math.pi / 180.0, r_start, r_end, rate) )
-            max_range = max(max_range, r_end)
-
-SIZE = 800
-
-max_range = 400000.0
-max_rate = 2.0
-def color_for(x):
-    if x < 0.1: intensity = 0
-    else: intensity = (1.0 * x / max_rate) ** 0.8
-
-    h = intensity * 0.5
-    s = 1.0
-    l = 0.3 + intensity*0.5
-    r,g,b = colorsys.hls_to_rgb(h,l,s)
-    return cairo.SolidPattern(r,g,b,1.0)
-
-surface = cairo.ImageSurface(cairo.FORMAT_RGB24, SIZE, SIZE)
-cc = cairo.Context(surface)
-
-cc.translate(SIZE/2, SIZE/2)
-cc.scale(SIZE/2 / max_range, SIZE/2 / max_range)
-
-one_pixel = min( cc.device_to_user_distance(1.0, 1.0) )
+            sectors.setdefault((b_start, b_end), []).append( (r_start, r_end, bucket_for(rate)) )
+
+    for cells in sectors.values():
+        cells.sort()
+    return sectors
+
+def group_by_colour(sectors):
+    # Group cells by colour, merging runs of adjacent range bins within a sector
+    # that ended up with the same colour into a single annular sector.
+    by_colour = {}
+    for (b_start, b_end), cells in sectors.items():
+        last = None
+        for r_start, r_end, bucket in cells:
+            if last is not None and last[3] == r_start and last[4] == bucket:
+                last[3] = r_end
+                continue
+            last = [b_start, b_end, r_start, r_end, bucket]
+            by_colour.setdefault(bucket, []).append(last)
+    return by_colour
+
+def wedge(cc, b_start, b_end, r_start, r_end):
+    s_start = (b_start-90) * math.pi / 180.0
+    s_end = (b_end-90) * math.pi / 180.0
+    cc.new_sub_path()
+    cc.arc(0, 0, r_end, s_start, s_end)
+    cc.arc_negative(0, 0, r_start, s_end, s_start)
+    cc.close_path()
 
-cc.set_source_rgb(1.0,1.0,1.0)
-cc.set_antialias(cairo.ANTIALIAS_DEFAULT);
-cc.set_font_size(10 * one_pixel)
-for r in xrange(0, int(max_range) + 100000, 100000):
-    cc.new_path()
-    cc.set_line_width(one_pixel)
-    cc.arc(0, 0, r, 0, math.pi*2)
-    cc.stroke()
+def draw_grid(cc, preview=False):
+    import cairo
+    one_pixel = min( cc.device_to_user_distance(1.0, 1.0) )
 
-    if r > 0:
-        text = ' %.0f km' % (r/1000.0)
-        t_xb,t_yb,t_w,t_h,t_xa,t_ya = cc.text_extents(text)
+    cc.set_source_rgb(1.0,1.0,1.0)
+    cc.set_antialias(cairo.ANTIALIAS_DEFAULT);
+    cc.set_font_size(10 * one_pixel)
+    for r in xrange(0, int(max_range) + 100000, 100000):
         cc.new_path()
-        cc.set_line_width(2 * one_pixel)
-        cc.move_to(t_xb, -r + t_yb)
-        cc.show_text(text)
-
-for i in xrange(16):
-    a = 22.5*i
-    acos = math.cos(a * math.pi / 180.0)
-    asin = math.sin(a * math.pi / 180.0)
-
-    cc.new_path()
-    if i % 2 == 0:
         cc.set_line_width(one_pixel)
-    else:
-        cc.set_line_width(0.5 * one_pixel)
-    cc.move_to(0.1 * max_range * acos, 0.1 * max_range * asin)
-    cc.line_to(2 * max_range * acos, 2 * max_range * asin)
-    cc.stroke()
-
-cc.set_antialias(cairo.ANTIALIAS_NONE);
-for s_start, s_end, r_start, r_end, rate in data:
-    if rate == 0.0: continue
+        cc.arc(0, 0, r, 0, math.pi*2)
+        cc.stroke()
+
+        if r > 0 and not preview:
+            text = ' %.0f km' % (r/1000.0)
+            t_xb,t_yb,t_w,t_h,t_xa,t_ya = cc.text_extents(text)
+            cc.new_path()
+            cc.set_line_width(2 * one_pixel)
+            cc.move_to(t_xb, -r + t_yb)
+            cc.show_text(text)
+
+    for i in xrange(16):
+        a = 22.5*i
+        acos = math.cos(a * math.pi / 180.0)
+        asin = math.sin(a * math.pi / 180.0)
 
-    cc.new_path()
-    cc.move_to(r_end * math.cos(s_start), r_end * math.sin(s_start))
-    cc.arc(0, 0, r_end, s_start, s_end)
-    cc.arc_negative(0, 0, r_start, s_end, s_start)
-    cc.close_path()
-    cc.set_source(color_for(rate))
-    cc.fill()
-
-if len(sys.argv) > 1:
+        cc.new_path()
+        if i % 2 == 0:
+            cc.set_line_width(one_pixel)
+        else:
+            cc.set_line_width(0.5 * one_pixel)
+        cc.move_to(0.1 * max_range * acos, 0.1 * max_range * asin)
+        cc.line_to(2 * max_range * acos, 2 * max_range * asin)
+        cc.stroke()
+
+def draw_cells(cc, by_colour):
+    import cairo
+    palette = make_palette()
+    fills = 0
+    cc.set_antialias(cairo.ANTIALIAS_NONE);
+    for bucket in sorted(by_colour.keys()):
+        cc.new_path()
+        for b_start, b_end, r_start, r_end, _ in by_colour[bucket]:
+            wedge(cc, b_start, b_end, r_start, r_end)
+        cc.set_source(palette[bucket])
+        cc.fill()
+        fills += 1
+    return fills
+
+def draw_caption(cc, text):
+    import cairo
+    cc.save()
     cc.identity_matrix()
     cc.set_source_rgb(1.0,1.0,1.0)
     cc.set_antialias(cairo.ANTIALIAS_DEFAULT);
     cc.set_font_size(10)
     cc.set_line_width(1)
 
-    text = sys.argv[1]
     t_xb,t_yb,t_w,t_h,t_xa,t_ya = cc.text_extents(text)
     cc.new_path()
     cc.move_to(5 - t_xb,5 - t_yb)
     cc.show_text(text)
+    cc.restore()
+
+def render(size=800, output='polar.png', caption=None, preview=False, force=False, verbose=False):
+    import cairo
+    cachefile = output + ".cache"
+
+    with closing(open('polar_range.csv', 'rb')) as f:
+        raw = f.read()
+
+    # The render cache remembers the quantized cells of the last render, keyed by
+    # a hash of the CSV contents and the render parameters. If nothing changed we
+    # don't render at all; if only some sectors changed, only those wedges are
+    # repainted on top of the previous image.
+    params = (size, max_range, max_rate, N_COLOURS, caption, preview)
+    digest = hashlib.sha1(raw).hexdigest()
+    cache = None
+    if not force and os.path.exists(output):
+        try:
+            with closing(open(cachefile, 'rb')) as f:
+                cache = cPickle.load(f)
+            if cache['params'] != params: cache = None
+        except Exception:
+            cache = None
+
+    if cache is not None and cache['digest'] == digest:
+        if verbose: print "%s is up to date" % output
+        return
+
+    sectors = read_sectors(raw)
+
+    dirty = None
+    if cache is not None:
+        old_sectors = cache['sectors']
+        dirty = [k for k in set(sectors.keys()) | set(old_sectors.keys()) if sectors.get(k) != old_sectors.get(k)]
+
+    if dirty is not None and len(dirty) < len(sectors) / 2:
+        surface = cairo.ImageSurface.create_from_png(output)
+    else:
+        dirty = None
+        surface = cairo.ImageSurface(cairo.FORMAT_RGB24, size, size)
+
+    cc = cairo.Context(surface)
+    cc.translate(size/2, size/2)
+    cc.scale(size/2 / max_range, size/2 / max_range)
 
-surface.write_to_png("polar.png")
+    if dirty is not None:
+        # restrict everything that follows to the changed wedges, cleared to background.
+        # The clip is not antialiased so repainted pixels match a full render exactly.
+        cc.new_path()
+        for k in dirty:
+            cells = sectors.get(k, []) + old_sectors.get(k, [])
+            wedge(cc, k[0], k[1], min(c[0] for c in cells), max(c[1] for c in cells))
+        cc.set_antialias(cairo.ANTIALIAS_NONE)
+        cc.clip()
+        cc.set_source_rgb(0.0,0.0,0.0)
+        cc.paint()
+
+    draw_grid(cc, preview)
+    fills = draw_cells(cc, group_by_colour(sectors))
+    if caption is not None:
+        draw_caption(cc, caption)
+
+    if verbose:
+        if dirty is None:
+            print "full render: %d sectors drawn with %d fills" % (len(sectors), fills)
+        else:
+            print "partial render: %d of %d sectors changed, %d fills" % (len(dirty), len(sectors), fills)
+
+    surface.write_to_png(output + ".new")
+    os.rename(output + ".new", output)
+
+    with closing(open(cachefile + ".new", 'wb')) as f:
+        cPickle.dump({ 'params' : params, 'digest' : digest, 'sectors' : sectors }, f, -1)
+    os.rename(cachefile + ".new", cachefile)
+
+def main(argv=None):
+    parser = OptionParser(usage="%prog [options] [caption]")
+    parser.add_option("-s", "--size", type="int", default=800,
+                      help="image size in pixels (default %default)")
+    parser.add_option("-p", "--preview", action="store_true", default=False,
+                      help="render a quick low-resolution preview to polar-preview.png")
+    parser.add_option("-o", "--output", default=None,
+                      help="output filename (default polar.png, or polar-preview.png with --preview)")
+    parser.add_option("-f", "--force", action="store_true", default=False,
+                      help="ignore the render cache and redraw everything")
+    parser.add_option("-v", "--verbose", action="store_true", default=False,
+                      help="report how many fills were needed")
+    (options, args) = parser.parse_args(argv)
+
+    size = options.size
+    output = options.output
+    if options.preview:
+        size = min(size, 200)
+        if output is None: output = "polar-preview.png"
+    if output is None: output = "polar.png"
+    caption = args[0] if len(args) > 0 else None
+
+    render(size, output, caption, options.preview, options.force, options.verbose)
+
+if __name__ == '__main__':
+    main()
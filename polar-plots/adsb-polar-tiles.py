@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+#
+# Renders polar_range.csv as a pyramid of Web Mercator z/x/y PNG tiles
+# around the receiver, for overlaying on a slippy map.
+#
+# Only tiles that contain data are written, and a tile is only re-rendered
+# when the cells that overlap it have changed colour since the last run (or
+# the receiver position or colour scale has changed, which moves or
+# recolours everything).
+#
+
+import csv, math, os, sys, json, hashlib
+import multiprocessing
+from contextlib import closing
+from optparse import OptionParser
+from PIL import Image, ImageDraw, ImageColor
+
+MEAN_R = 6371009.0
+TILE_SIZE = 256
+
+max_rate = 2.0
+N_COLOURS = 64
+ALPHA = 160
+
+def dtor(d):
+    return d * math.pi / 180.0
+
+def rtod(r):
+    return r * 180.0 / math.pi
+
+def destination(lat, lon, bearing, distance):
+    # destination point given start, bearing and distance, assuming spherical geometry
+    # from http://www.movable-type.co.uk/scripts/latlong.html
+    lat1 = dtor(lat)
+    lon1 = dtor(lon)
+    brng = dtor(bearing)
+    d = distance / MEAN_R
+
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) + math.cos(lat1) * math.sin(d) * math.cos(brng))
+    lon2 = lon1 + math.atan2(math.sin(brng) * math.sin(d) * math.cos(lat1),
+                             math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return (rtod(lat2), (rtod(lon2) + 540) % 360 - 180)
+
+def mercator(lat, lon):
+    # returns world coordinates in the range 0..1
+    lat = max(-85.05112878, min(85.05112878, lat))
+    x = (lon + 180.0) / 360.0
+    s = math.sin(dtor(lat))
+    y = 0.5 - math.log((1 + s) / (1 - s)) / (4 * math.pi)
+    return (x, y)
+
+def bucket_for(x):
+    if x < 0.1: return 0
+    intensity = min(1.0, (1.0 * x / max_rate) ** 0.8)
+    return int(intensity * (N_COLOURS - 1) + 0.5)
+
+def colour_for_bucket(bucket):
+    intensity = 1.0 * bucket / (N_COLOURS - 1)
+    r,g,b = ImageColor.getrgb("hsl(%d,%d%%,%d%%)" % (int(intensity * 180), 100, int(30 + intensity*50)))
+    return (r,g,b,ALPHA)
+
+def read_cells(filename):
+    cells = []
+    with closing(open(filename, 'r')) as f:
+        r = csv.reader(f)
+        r.next() # header
+        for row in r:
+            b_start = float(row[0])
+            b_end = float(row[1])
+            r_start = float(row[2])
+            r_end = float(row[3])
+            updates = float(row[4])
+            airsec = float(row[5])
+            if airsec > 2.0:
+                rate = float(updates) / airsec
+            else:
+                rate = 0.0
+
+            if rate > 0:
+                cells.append( (b_start, b_end, r_start, r_end, bucket_for(rate)) )
+    return cells
+
+def cell_outline(home, b_start, b_end, r_start, r_end):
+    # approximate the annular sector by a polygon, with
+    # a vertex at least every degree along each arc
+    steps = max(1, int(math.ceil(b_end - b_start)))
+    outer = [b_start + (b_end - b_start) * i / steps for i in xrange(steps + 1)]
+    points = [mercator(*destination(home[0], home[1], b, r_end)) for b in outer]
+    if r_start > 0:
+        points += [mercator(*destination(home[0], home[1], b, r_start)) for b in reversed(outer)]
+    else:
+        points.append(mercator(home[0], home[1]))
+    return points
+
+def clipped_area(points, x0, y0, x1, y1):
+    # area of the polygon POINTS clipped to the rectangle (Sutherland-Hodgman)
+    for inside, cross in ((lambda p: p[0] >= x0, lambda a, b: (x0, a[1] + (b[1] - a[1]) * (x0 - a[0]) / (b[0] - a[0]))),
+                          (lambda p: p[0] <= x1, lambda a, b: (x1, a[1] + (b[1] - a[1]) * (x1 - a[0]) / (b[0] - a[0]))),
+                          (lambda p: p[1] >= y0, lambda a, b: (a[0] + (b[0] - a[0]) * (y0 - a[1]) / (b[1] - a[1]), y0)),
+                          (lambda p: p[1] <= y1, lambda a, b: (a[0] + (b[0] - a[0]) * (y1 - a[1]) / (b[1] - a[1]), y1))):
+        clipped = []
+        for j in xrange(len(points)):
+            a = points[j - 1]
+            b = points[j]
+            if inside(b):
+                if not inside(a): clipped.append(cross(a, b))
+                clipped.append(b)
+            elif inside(a):
+                clipped.append(cross(a, b))
+        points = clipped
+        if not points: return 0.0
+
+    area = 0.0
+    for j in xrange(len(points)):
+        area += points[j - 1][0] * points[j][1] - points[j][0] * points[j - 1][1]
+    return abs(area) / 2
+
+def render_tile(task):
+    z, x, y, path, polygons = task
+    im = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0,0,0,0))
+    draw = ImageDraw.Draw(im)
+    for points, colour in polygons:
+        draw.polygon(points, fill=colour)
+    del draw
+
+    if not os.path.isdir(os.path.dirname(path)):
+        try: os.makedirs(os.path.dirname(path))
+        except OSError: pass
+    im.save(path + '.new', 'PNG')
+    os.rename(path + '.new', path)
+    return (z, x, y)
+
+def make_tasks(home, cells, zooms, outdir, manifest):
+    outlines = [cell_outline(home, *c[:4]) for c in cells]
+    signatures = {}
+    tasks = []
+
+    # everything drawn depends on these as well as on the cells
+    common = repr((home, max_rate, N_COLOURS, ALPHA, TILE_SIZE))
+
+    for z in zooms:
+        scale = TILE_SIZE * (1 << z)
+
+        # find the tiles each cell overlaps; a cell's bounding box can
+        # reach tiles that the cell itself misses, so check those properly
+        # (against the tile plus a pixel all round, as drawing can touch
+        # the edge pixels of a polygon that only meets the tile's edge)
+        tiles = {}
+        for i in xrange(len(cells)):
+            points = [(px * scale, py * scale) for px,py in outlines[i]]
+            x0 = int(min(p[0] for p in points)) // TILE_SIZE
+            x1 = int(max(p[0] for p in points)) // TILE_SIZE
+            y0 = int(min(p[1] for p in points)) // TILE_SIZE
+            y1 = int(max(p[1] for p in points)) // TILE_SIZE
+            for tx in xrange(x0, x1+1):
+                for ty in xrange(y0, y1+1):
+                    if (x0 == x1 and y0 == y1) or clipped_area(points, tx * TILE_SIZE - 1, ty * TILE_SIZE - 1,
+                                                              (tx+1) * TILE_SIZE + 1, (ty+1) * TILE_SIZE + 1) > 0:
+                        tiles.setdefault((tx,ty), []).append((i, points))
+
+        for (tx,ty), contents in tiles.iteritems():
+            key = '%d/%d/%d' % (z, tx, ty)
+            h = hashlib.sha1(common)
+            for i, points in contents:
+                h.update(repr(cells[i]))
+            signatures[key] = sig = h.hexdigest()
+
+            path = os.path.join(outdir, str(z), str(tx), '%d.png' % ty)
+            if manifest.get(key) == sig and os.path.exists(path):
+                continue
+
+            ox = tx * TILE_SIZE
+            oy = ty * TILE_SIZE
+            polygons = [ ([(px - ox, py - oy) for px,py in points], colour_for_bucket(cells[i][4])) for i, points in contents ]
+            tasks.append( (z, tx, ty, path, polygons) )
+
+    return tasks, signatures
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] receiver_lat receiver_lon")
+    parser.add_option("-i", "--input", default="polar_range.csv",
+                      help="polar range histogram to read (default %default)")
+    parser.add_option("-o", "--output", default="tiles",
+                      help="directory to write tiles to (default %default)")
+    parser.add_option("-z", "--zoom", default="5-10",
+                      help="zoom level or range of levels to render (default %default)")
+    parser.add_option("-j", "--jobs", type="int", default=multiprocessing.cpu_count(),
+                      help="number of worker processes (default %default)")
+    (options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.error("need the receiver latitude and longitude")
+
+    home = (float(args[0]), float(args[1]))
+    if '-' in options.zoom:
+        zmin, zmax = options.zoom.split('-')
+        zooms = range(int(zmin), int(zmax) + 1)
+    else:
+        zooms = [int(options.zoom)]
+
+    manifest_file = os.path.join(options.output, 'manifest.json')
+    try:
+        with closing(open(manifest_file, 'r')) as f:
+            manifest = json.load(f)
+    except (IOError, ValueError):
+        manifest = {}
+
+    cells = read_cells(options.input)
+    tasks, signatures = make_tasks(home, cells, zooms, options.output, manifest)
+
+    if tasks:
+        if options.jobs > 1:
+            pool = multiprocessing.Pool(options.jobs)
+            for result in pool.imap_unordered(render_tile, tasks, 16): pass
+            pool.close()
+            pool.join()
+        else:
+            for task in tasks: render_tile(task)
+
+    # remove tiles that used to have data but no longer do
+    for key in manifest:
+        if key not in signatures:
+            z, tx, ty = key.split('/')
+            try: os.unlink(os.path.join(options.output, z, tx, ty + '.png'))
+            except OSError: pass
+
+    if not os.path.isdir(options.output):
+        os.makedirs(options.output)
+    with closing(open(manifest_file + '.new', 'w')) as f:
+        json.dump(signatures, f)
+    os.rename(manifest_file + '.new', manifest_file)
+
+    print "%d tiles with data, %d rendered" % (len(signatures), len(tasks))
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+#
+# Keeps an interpreter running with the plotting libraries already loaded,
+# and runs the cron-driven scripts in it on request instead of starting a
+# fresh interpreter (and re-importing PIL, cairo, urllib2...) every time.
+#
+#   adsb-polar-worker.py -s /run/adsb-polar.sock \
+#       adsb-polar-plot.py adsb-polar-plot-cairo.py ../mrtg/fetch-dump1090-max-range.py
+#
+# Each request forks a child, which changes to the client's directory,
+# calls the script's main() with the client's arguments and sends back its
+# output. From cron or MRTG, the same script acts as the client:
+#
+#   cd /var/lib/adsb-polar && adsb-polar-worker.py -s /run/adsb-polar.sock --run adsb-polar-plot.py
+#   adsb-polar-worker.py -s /run/adsb-polar.sock --run fetch-dump1090-max-range.py http://rpi:8081
+#
+# The client only needs the standard library's socket and json modules, so
+# it starts about as fast as Python can. Scripts are reloaded in the worker
+# when they change on disk.
+#
+
+import errno, imp, json, os, signal, socket, sys, traceback
+from contextlib import closing
+from optparse import OptionParser
+
+DEFAULT_PRELOAD = 'PIL.Image,PIL.ImageDraw,PIL.ImageFont,cairo,colorsys,urllib2'
+
+def run_client(path, argv):
+    """Asks the worker at PATH to run ARGV (a script name and its
+    arguments); copies its output to stdout and returns its exit status."""
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(300.0)
+    with closing(s):
+        s.connect(path)
+        s.sendall(json.dumps({ 'cwd' : os.getcwd(), 'argv' : argv }) + '\n')
+
+        chunks = []
+        while True:
+            data = s.recv(65536)
+            if not data: break
+            chunks.append(data)
+
+    # the output is followed by a NUL and the exit status
+    output, sep, status = ''.join(chunks).rpartition('\0')
+    if not sep:
+        print >>sys.stderr, 'worker closed the connection without a result'
+        return 1
+
+    sys.stdout.write(output)
+    return int(status)
+
+class Worker:
+    def __init__(self, scripts, preload):
+        for name in preload:
+            try:
+                __import__(name)
+            except ImportError:
+                pass
+
+        self.scripts = {}
+        for path in scripts:
+            path = os.path.abspath(path)
+            self.scripts[os.path.basename(path)] = [path, None, None]
+            self.load(os.path.basename(path))
+
+    def load(self, name):
+        """Returns the module for script NAME, (re)loading it if the file
+        has changed."""
+
+        entry = self.scripts[name]
+        path, module, mtime = entry
+        current = os.stat(path).st_mtime
+        if module is None or current != mtime:
+            module_name = os.path.splitext(name)[0].replace('-', '_')
+            entry[1] = imp.load_source(module_name, path)
+            entry[2] = current
+        return entry[1]
+
+    def handle(self, conn):
+        f = conn.makefile('r')
+        request = json.loads(f.readline())
+        f.close()
+
+        argv = request['argv']
+        name = os.path.basename(argv[0]) if argv else None
+        if name not in self.scripts:
+            conn.sendall('unknown script: %s\n\0%d' % (name, 2))
+            return
+
+        try:
+            module = self.load(name)
+        except Exception:
+            conn.sendall(traceback.format_exc() + '\0%d' % 1)
+            return
+
+        sys.stdout.flush()
+        pid = os.fork()
+        if pid != 0:
+            return
+
+        # child: run the script with stdout going to the client
+        status = 0
+        try:
+            os.chdir(request['cwd'])
+            os.dup2(conn.fileno(), 1)
+            sys.argv = [name] + argv[1:]
+            module.main(argv[1:])
+        except SystemExit, e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print >>sys.stderr, e.code
+                status = 1
+        except Exception:
+            traceback.print_exc()
+            status = 1
+
+        try:
+            sys.stdout.flush()
+            conn.sendall('\0%d' % status)
+        finally:
+            os._exit(0)
+
+    def serve(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(16)
+
+        # children are never waited for, so let the kernel reap them
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+        while True:
+            try:
+                conn, address = listener.accept()
+            except socket.error, e:
+                if e.args[0] == errno.EINTR: continue
+                raise
+
+            try:
+                self.handle(conn)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                conn.close()
+
+if __name__ == '__main__':
+    parser = OptionParser(usage="%prog [options] script...\n       %prog [options] --run script [args...]")
+    parser.add_option("-s", "--socket", default="/run/adsb-polar.sock",
+                      help="Unix socket to listen on or connect to (default %default)")
+    parser.add_option("--run", action="store_true", default=False,
+                      help="ask a running worker to run a script, and print its output")
+    parser.add_option("--preload", default=DEFAULT_PRELOAD,
+                      help="comma-separated modules to import up front, if available (default %default)")
+    parser.disable_interspersed_args()
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("need a script")
+
+    if options.run:
+        try:
+            sys.exit(run_client(options.socket, args))
+        except socket.error, e:
+            print >>sys.stderr, '%s: %s' % (options.socket, e)
+            sys.exit(1)
+
+    worker = Worker(args, [name for name in options.preload.split(',') if name])
+    try:
+        worker.serve(options.socket)
+    except KeyboardInterrupt:
+        pass
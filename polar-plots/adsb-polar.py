@@ -85,12 +85,39 @@ def range_bearing_elevation(c,l):
 
     return (rng, bearing, elev)    
 
+class UniqueTracker:
+    """Tracks which (bin, aircraft) pairs have been seen since the last reset.
+
+    Rather than a set of ICAOs per bin, there is one dict keyed by
+    (aircraft id << 20 | bin key) holding the generation in which the pair
+    was last seen. Resetting just starts a new generation; the dict is only
+    cleared when it has grown large, since every entry in it is stale
+    after a reset anyway."""
+
+    MAX_ENTRIES = 100000
+
+    def __init__(self):
+        self.generation = 0
+        self.seen = {}
+
+    def first_sighting(self, key):
+        if self.seen.get(key) == self.generation:
+            return False
+        self.seen[key] = self.generation
+        return True
+
+    def reset(self):
+        self.generation += 1
+        if len(self.seen) > self.MAX_ENTRIES:
+            self.seen.clear()
+
 class BinHisto:
-    def __init__(self, n_bins, min_bin_value, max_bin_value):
+    def __init__(self, n_bins, min_bin_value, max_bin_value, tracker=None, key_base=0):
         self.min_bin = min_bin_value
         self.bins = [0] * n_bins
         self.bins_unique = [0] * n_bins
-        self.icao_seen = [set() for i in xrange(n_bins)]
+        self.tracker = tracker if tracker is not None else UniqueTracker()
+        self.key_base = key_base
         self.bin_size = float(max_bin_value - min_bin_value) / n_bins
         self.n = 0
         self.min_value = None
@@ -108,12 +135,12 @@ class BinHisto:
     def bin_for_upper(self, v):
         return int(math.ceil((v-self.min_bin) / self.bin_size))
 
-    def add(self,icao,v):
+    def add(self,icao_id,v):
+        # icao_id is a small integer id for the aircraft, see intern_icao()
         i = self.bin_for(v)
         if i < 0 or i >= len(self.bins): return
 
-        if icao not in self.icao_seen[i]:
-            self.icao_seen[i].add(icao)
+        if self.tracker.first_sighting((icao_id << 20) | (self.key_base + i)):
             self.bins_unique[i] += 1
 
         self.bins[i] += 1
@@ -122,8 +149,7 @@ class BinHisto:
         self.min_value = v if self.min_value is None else min(self.min_value, v)
 
     def reset_icao_history(self):
-        for s in self.icao_seen:
-            s.clear()
+        self.tracker.reset()
 
     def values(self):
         return ( (self.bin_start(i), self.bin_end(i), self.bins[i], self.bins_unique[i]) for i in xrange(len(self.bins)) )
@@ -177,7 +203,9 @@ class BinHisto:
 class PolarHisto:
     def __init__(self, n_sectors, n_bins, min_value, max_value):
         self.sector_size = 360.0 / n_sectors
-        self.sectors = [BinHisto(n_bins, min_value, max_value) for i in xrange(n_sectors)]
+        # all sectors share one tracker, so a reset is a single operation
+        self.tracker = UniqueTracker()
+        self.sectors = [BinHisto(n_bins, min_value, max_value, self.tracker, i * n_bins) for i in xrange(n_sectors)]
         self.n = 0
 
     def sector_start(self,i):
@@ -193,12 +221,11 @@ class PolarHisto:
         return int(math.ceil((v % 360) / self.sector_size))
 
     def reset_icao_history(self):
-        for histo in self.sectors:
-            histo.reset_icao_history()
+        self.tracker.reset()
 
-    def add(self, icao, b, v):
+    def add(self, icao_id, b, v):
         sector = self.sector_for(b)
-        self.sectors[sector].add(icao, v)
+        self.sectors[sector].add(icao_id, v)
         self.n += 1
 
     def values(self):
@@ -263,6 +290,14 @@ class PolarHisto:
 
                 self.import_sector(b_low, b_high, h_low, h_high, count, unique)
 
+icao_ids = {}
+def intern_icao(icao):
+    # map an ICAO address string to a small integer id
+    i = icao_ids.get(icao)
+    if i is None:
+        icao_ids[icao] = i = len(icao_ids)
+    return i
+
 def process_basestation_messages(home, f):
     count = 0
     range_histo = BinHisto(110, 0, 440000)
@@ -299,9 +334,10 @@ def process_basestation_messages(home, f):
             # bad data
             continue
 
-        range_histo.add(icao, r)
-        polar_range_histo.add(icao, b, r)
-        polar_elev_histo.add(icao, b, e)
+        icao_id = intern_icao(icao)
+        range_histo.add(icao_id, r)
+        polar_range_histo.add(icao_id, b, r)
+        polar_elev_histo.add(icao_id, b, e)
 
         now = time.time()
         if (now - last_save) > 30.0:
@@ -0,0 +1,289 @@
+#
+# Minimal Beast binary format reader and ADS-B airborne position decoder,
+# for feeding the polar collectors from dump1090's port 30005 (or a capture
+# of it) instead of the SBS text output on port 30003.
+#
+# Only DF17 / DF18 (CF=0) airborne position messages are decoded; everything
+# else is skipped as early as possible.
+#
+
+import errno, math, time
+
+# CRC-24 as used by Mode S
+CRC_POLY = 0xFFF409
+CRC_TABLE = []
+for _i in xrange(256):
+    _c = _i << 16
+    for _j in xrange(8):
+        if _c & 0x800000: _c = (_c << 1) ^ CRC_POLY
+        else: _c = _c << 1
+    CRC_TABLE.append(_c & 0xFFFFFF)
+del _i, _j, _c
+
+def crc_residual(msg):
+    # residual over the whole 112-bit message; zero if the CRC is good
+    crc = 0
+    for b in msg[:11]:
+        crc = ((crc << 8) & 0xFFFFFF) ^ CRC_TABLE[((crc >> 16) ^ b) & 0xFF]
+    return crc ^ ((msg[11] << 16) | (msg[12] << 8) | msg[13])
+
+class FrameParser:
+    """Incremental Beast frame parser: feed() it data as it arrives and it
+    returns the complete long frames, keeping any partial frame for next time."""
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        """Returns a list of (timestamp, message) for each long (112-bit) Mode S
+        frame completed by DATA; see read_frames."""
+
+        buf = self.buf
+        buf.extend(data)
+        frames = []
+
+        i = 0
+        n = len(buf)
+        while True:
+            i = buf.find('\x1a', i)
+            if i < 0 or i + 1 >= n:
+                break
+
+            ftype = buf[i+1]
+            if ftype == 0x33: length = 6 + 1 + 14
+            elif ftype == 0x32: length = 6 + 1 + 7
+            elif ftype == 0x31: length = 6 + 1 + 2
+            elif ftype == 0x34: length = 6 + 1 + 14
+            else:
+                # not a frame start (or a doubled escape), resync
+                i += 1
+                continue
+
+            j = i + 2
+            if j + length <= n and buf.find('\x1a', j, j + length) < 0:
+                # common case: nothing escaped, take the body as-is
+                if ftype == 0x33:
+                    ts = (buf[j] << 40) | (buf[j+1] << 32) | (buf[j+2] << 24) | (buf[j+3] << 16) | (buf[j+4] << 8) | buf[j+5]
+                    frames.append((ts, buf[j+7:j+length]))
+                i = j + length
+                continue
+
+            # unescape the frame body, checking we have all of it
+            body = bytearray()
+            while len(body) < length and j < n:
+                b = buf[j]
+                if b == 0x1a:
+                    if j + 1 >= n: break
+                    if buf[j+1] != 0x1a:
+                        # unexpected start of a new frame, this one is truncated
+                        break
+                    j += 1
+                body.append(b)
+                j += 1
+
+            if len(body) < length:
+                if j >= n - 1:
+                    break     # need more data
+                i = j         # truncated frame, resync at the next one
+                continue
+
+            i = j
+            if ftype == 0x33:
+                ts = (body[0] << 40) | (body[1] << 32) | (body[2] << 24) | (body[3] << 16) | (body[4] << 8) | body[5]
+                frames.append((ts, body[7:]))
+
+        if i < 0:
+            # no frame start left in the buffer; keep a trailing escape just in case
+            del buf[:max(0, n-1)]
+        else:
+            del buf[:i]
+
+        return frames
+
+def read_frames(f, chunk_size=65536):
+    """Yields (timestamp, message) for each long (112-bit) Mode S frame in
+    the Beast stream F. TIMESTAMP is the raw 48-bit 12MHz counter and MESSAGE
+    a bytearray. Short frames, Mode A/C and status frames are skipped."""
+
+    parser = FrameParser()
+    while True:
+        try:
+            data = f.read(chunk_size) if hasattr(f, 'read') else f.recv(chunk_size)
+        except IOError, e:
+            # a signal (e.g. SIGUSR1 for a stats dump) interrupted the read
+            if e.errno == errno.EINTR: continue
+            raise
+        if not data: return
+        for frame in parser.feed(data):
+            yield frame
+
+#
+# CPR decoding
+#
+
+CPR_MAX = 131072.0   # 2^17
+
+def cpr_nl(lat):
+    if lat < 0: lat = -lat
+    if lat < 1e-9: return 59
+    if lat > 87.0: return 1
+    if abs(lat - 87.0) < 1e-9: return 2
+    nz = 15.0
+    a = 1 - math.cos(math.pi / (2 * nz))
+    b = math.cos(math.pi / 180.0 * lat) ** 2
+    return int(math.floor(2 * math.pi / math.acos(1 - a / b)))
+
+def cpr_mod(a, b):
+    r = a % b
+    if r < 0: r += b
+    return r
+
+def cpr_global(even, odd, odd_is_latest):
+    """Global airborne decode from an (lat_cpr, lon_cpr) EVEN and ODD pair.
+    Returns (lat, lon) or None if the pair straddles a latitude zone."""
+
+    lat0, lon0 = even
+    lat1, lon1 = odd
+
+    j = int(math.floor((59 * lat0 - 60 * lat1) / CPR_MAX + 0.5))
+    rlat0 = 360.0 / 60 * (cpr_mod(j, 60) + lat0 / CPR_MAX)
+    rlat1 = 360.0 / 59 * (cpr_mod(j, 59) + lat1 / CPR_MAX)
+    if rlat0 >= 270: rlat0 -= 360
+    if rlat1 >= 270: rlat1 -= 360
+    if rlat0 < -90 or rlat0 > 90 or rlat1 < -90 or rlat1 > 90: return None
+
+    nl = cpr_nl(rlat0)
+    if nl != cpr_nl(rlat1): return None
+
+    if odd_is_latest:
+        rlat = rlat1
+        ni = max(nl - 1, 1)
+        m = int(math.floor((lon0 * (nl - 1) - lon1 * nl) / CPR_MAX + 0.5))
+        rlon = 360.0 / ni * (cpr_mod(m, ni) + lon1 / CPR_MAX)
+    else:
+        rlat = rlat0
+        ni = max(nl, 1)
+        m = int(math.floor((lon0 * (nl - 1) - lon1 * nl) / CPR_MAX + 0.5))
+        rlon = 360.0 / ni * (cpr_mod(m, ni) + lon0 / CPR_MAX)
+
+    if rlon >= 180: rlon -= 360
+    return (rlat, rlon)
+
+def cpr_local(ref, cpr, odd):
+    """Local airborne decode of a single frame relative to the REF (lat, lon).
+    Only correct if the true position is within about 180NM of REF."""
+
+    ref_lat, ref_lon = ref
+    lat_cpr, lon_cpr = cpr
+    i = 1 if odd else 0
+
+    dlat = 360.0 / (60 - i)
+    j = int(math.floor(ref_lat / dlat) + math.floor(cpr_mod(ref_lat, dlat) / dlat - lat_cpr / CPR_MAX + 0.5))
+    rlat = dlat * (j + lat_cpr / CPR_MAX)
+    if rlat < -90 or rlat > 90: return None
+
+    dlon = 360.0 / max(cpr_nl(rlat) - i, 1)
+    m = int(math.floor(ref_lon / dlon) + math.floor(cpr_mod(ref_lon, dlon) / dlon - lon_cpr / CPR_MAX + 0.5))
+    rlon = dlon * (m + lon_cpr / CPR_MAX)
+    if rlon >= 180: rlon -= 360
+    if rlon < -180: rlon += 360
+    return (rlat, rlon)
+
+def decode_position(msg):
+    """Returns (icao, odd, lat_cpr, lon_cpr, alt_ft) for a DF17/18 airborne
+    position message, or None."""
+
+    df = msg[0] >> 3
+    if df != 17 and not (df == 18 and (msg[0] & 7) == 0): return None
+
+    tc = msg[4] >> 3
+    if not (9 <= tc <= 18 or 20 <= tc <= 22): return None
+    if crc_residual(msg) != 0: return None
+
+    icao = '%02X%02X%02X' % (msg[1], msg[2], msg[3])
+    alt12 = (msg[5] << 4) | (msg[6] >> 4)
+    if tc >= 20:
+        # GNSS height, in metres
+        alt_ft = alt12 / 0.3048
+    elif alt12 & 0x10:
+        n = ((alt12 & 0xFE0) >> 1) | (alt12 & 0x0F)
+        alt_ft = n * 25 - 1000
+    else:
+        # Gillham-coded altitudes are rare enough to ignore
+        return None
+
+    odd = (msg[6] >> 2) & 1
+    lat_cpr = ((msg[6] & 3) << 15) | (msg[7] << 7) | (msg[8] >> 1)
+    lon_cpr = ((msg[8] & 1) << 16) | (msg[9] << 8) | msg[10]
+    return (icao, odd, lat_cpr, lon_cpr, alt_ft)
+
+class CPRState:
+    def __init__(self):
+        self.frames = [None, None]   # last (timestamp, (lat_cpr, lon_cpr)) for even, odd
+        self.position = None         # last (timestamp, (lat, lon))
+
+class PositionDecoder:
+    """Decodes airborne positions, keeping per-aircraft CPR state between
+    calls so that frames can be handed over as they arrive."""
+
+    def __init__(self, home, clock=None):
+        self.state = {}
+        self.ref = (home[0], home[1])
+        self.clock = clock
+        self.offset = None
+
+    def positions(self, frames):
+        """Yields (icao, timestamp, timestamp_string, lat, lng, alt_ft) for
+        each position decoded from FRAMES; see read_positions."""
+
+        state = self.state
+        clock = self.clock
+
+        for ts, msg in frames:
+            decoded = decode_position(msg)
+            if decoded is None: continue
+            icao, odd, lat_cpr, lon_cpr, alt_ft = decoded
+
+            if clock is None:
+                now = time.time()
+            else:
+                if self.offset is None: self.offset = clock - ts / 12e6
+                now = self.offset + ts / 12e6
+
+            ac = state.get(icao)
+            if ac is None:
+                state[icao] = ac = CPRState()
+
+            cpr = (lat_cpr, lon_cpr)
+            ac.frames[odd] = (now, cpr)
+            other = ac.frames[1 - odd]
+
+            pos = None
+            if other is not None and now - other[0] < 10.0:
+                if odd: pos = cpr_global(other[1], cpr, True)
+                else: pos = cpr_global(cpr, other[1], False)
+            if pos is None and ac.position is not None and now - ac.position[0] < 30.0:
+                # relative to our last fix for this aircraft
+                pos = cpr_local(ac.position[1], cpr, odd)
+            if pos is None:
+                # no first fix without an even/odd pair: decoding relative
+                # to the receiver is only right within about 180NM, and
+                # we keep positions out to 500km
+                continue
+
+            ac.position = (now, pos)
+            timestamp_string = time.strftime('%Y/%m/%d %H:%M:%S', time.localtime(now)) + ('%.3f' % (now % 1))[1:]
+            yield (icao, now, timestamp_string, pos[0], pos[1], alt_ft)
+
+def read_positions(frames, home, clock=None):
+    """Decodes airborne positions from FRAMES (as produced by read_frames)
+    for a receiver at HOME = (lat, lon, alt). An aircraft's first position
+    needs an even/odd pair of frames; after that, single frames are decoded
+    relative to its last position.
+
+    Yields (icao, timestamp, timestamp_string, lat, lng, alt_ft), the same
+    as the SBS reader in adsb-polar-2.py. If CLOCK is None the wall clock is
+    used as the timestamp, otherwise the Beast 12MHz counter is used, with
+    the first frame taken to be at time CLOCK (for replaying captures)."""
+
+    return PositionDecoder(home, clock).positions(frames)
@@ -0,0 +1,272 @@
+#
+# Time-indexed archive of polar histogram snapshots.
+#
+# File layout:
+#
+#   header      magic 'PLRA', version, index capacity, record count,
+#               keyframe interval, layout length
+#   layout      JSON, as in polar_shared.py
+#   index       capacity entries of (time, offset, length, flags)
+#   records     zlib-compressed, appended in time order
+#
+# A snapshot is every histogram's update counts and airsec values as one
+# array of doubles, in layout order. Every KEYFRAME_INTERVAL'th record (and
+# the first one after the archive is reopened) holds the whole array; the
+# others hold only the values that changed since the previous snapshot, as
+# a count, that many indices, and that many differences. Reading a
+# snapshot starts from the nearest keyframe at or before it and applies
+# the deltas one record at a time, so only the one array is in memory.
+#
+# Since the histograms only accumulate, the coverage between two times is
+# the later snapshot less the earlier one.
+#
+# When the index is full, the archive is renamed with the date of its
+# first snapshot appended and a new one is started.
+#
+
+import csv, json, os, struct, time, zlib
+from array import array
+from contextlib import closing
+
+import polar_shared
+
+MAGIC = 'PLRA'
+VERSION = 1
+HEADER = struct.Struct('<4sIIIII')
+COUNT_OFFSET = 12
+COUNT = struct.Struct('<I')
+ENTRY = struct.Struct('<dQII')
+
+KEYFRAME = 1
+
+def layout_of(histograms):
+    """Returns the layout { name: [ [b_low, b_high, bin_min, bin_size, n_bins, offset], ... ] }
+    for HISTOGRAMS, a list of (name, histo), and the total number of values."""
+
+    layout = {}
+    total = 0
+    for name, histo in histograms:
+        entries = layout[name] = []
+        for b_low, b_high, sector in polar_shared.sectors(histo):
+            entries.append([b_low, b_high, sector.min_bin, sector.bin_size, sector.n_bins, total])
+            total += 2 * sector.n_bins
+    return layout, total
+
+def values_of(histograms):
+    values = array('d')
+    for name, histo in histograms:
+        for b_low, b_high, sector in polar_shared.sectors(histo):
+            values.extend(sector.update_bins)
+            values.extend(sector.airsec_bins)
+    return values
+
+class ArchiveWriter:
+    """Appends snapshots of HISTOGRAMS (a list of (name, histo)) to the
+    archive FILENAME, creating it if need be."""
+
+    def __init__(self, filename, histograms, capacity=8760, keyframe_interval=24):
+        self.filename = filename
+        self.histograms = histograms
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.layout, n_values = layout_of(histograms)
+        self.previous = None
+        self.open()
+
+    def open(self):
+        if os.path.exists(self.filename):
+            try:
+                self.f = open(self.filename, 'r+b')
+                self.read_header()
+                if self.layout_json == json.dumps(self.layout, sort_keys=True):
+                    return
+            except (ValueError, struct.error):
+                pass
+
+            # a different histogram layout, or not an archive: keep it out of the way
+            self.f.close()
+            self.rotate()
+
+        self.create()
+
+    def read_header(self):
+        header = self.f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError('%s: truncated archive' % self.filename)
+        magic, version, self.capacity, self.count, self.keyframe_interval, layout_len = HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a polar histogram archive' % self.filename)
+        self.layout_json = self.f.read(layout_len)
+        self.index_offset = HEADER.size + layout_len
+
+        if self.count > 0:
+            self.f.seek(self.index_offset + (self.count - 1) * ENTRY.size)
+            self.last_time = ENTRY.unpack(self.f.read(ENTRY.size))[0]
+        else:
+            self.last_time = None
+
+    def create(self):
+        self.layout_json = json.dumps(self.layout, sort_keys=True)
+        self.index_offset = HEADER.size + len(self.layout_json)
+        self.count = 0
+        self.last_time = None
+
+        with closing(open(self.filename + '.new', 'wb')) as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.capacity, 0, self.keyframe_interval, len(self.layout_json)))
+            f.write(self.layout_json)
+            f.truncate(self.index_offset + self.capacity * ENTRY.size)
+        os.rename(self.filename + '.new', self.filename)
+        self.f = open(self.filename, 'r+b')
+
+    def rotate(self):
+        try:
+            with closing(open(self.filename, 'rb')) as f:
+                magic, version, capacity, count, keyframe_interval, layout_len = HEADER.unpack(f.read(HEADER.size))
+                f.seek(HEADER.size + layout_len)
+                first = ENTRY.unpack(f.read(ENTRY.size))[0] if count > 0 else time.time()
+        except (IOError, struct.error):
+            first = time.time()
+
+        base = '%s.%s' % (self.filename, time.strftime('%Y%m%d', time.gmtime(first)))
+        target = base
+        n = 1
+        while os.path.exists(target):
+            target = '%s-%d' % (base, n)
+            n += 1
+        os.rename(self.filename, target)
+        self.previous = None
+
+    def close(self):
+        self.f.close()
+
+    def append(self, now):
+        if self.count >= self.capacity:
+            self.f.close()
+            self.rotate()
+            self.create()
+
+        values = values_of(self.histograms)
+        if self.previous is None or self.count % self.keyframe_interval == 0:
+            flags = KEYFRAME
+            record = values.tostring()
+        else:
+            flags = 0
+            previous = self.previous
+            changed = array('I', [i for i in xrange(len(values)) if values[i] != previous[i]])
+            deltas = array('d', [values[i] - previous[i] for i in changed])
+            record = COUNT.pack(len(changed)) + changed.tostring() + deltas.tostring()
+        self.previous = values
+
+        data = zlib.compress(record, 6)
+        self.f.seek(0, 2)
+        offset = max(self.f.tell(), self.index_offset + self.capacity * ENTRY.size)
+        self.f.seek(offset)
+        self.f.write(data)
+
+        # the record goes in before the index entry and count that point to it
+        self.f.flush()
+        self.f.seek(self.index_offset + self.count * ENTRY.size)
+        self.f.write(ENTRY.pack(now, offset, len(data), flags))
+        self.count += 1
+        self.f.seek(COUNT_OFFSET)
+        self.f.write(COUNT.pack(self.count))
+        self.f.flush()
+        self.last_time = now
+
+class ArchiveReader:
+    """Random access to the snapshots in an archive."""
+
+    def __init__(self, filename):
+        self.f = open(filename, 'rb')
+        magic, version, self.capacity, self.count, self.keyframe_interval, layout_len = HEADER.unpack(self.f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            self.f.close()
+            raise ValueError('%s: not a polar histogram archive' % filename)
+        self.layout = json.loads(self.f.read(layout_len))
+        self.index = [ENTRY.unpack(self.f.read(ENTRY.size)) for i in xrange(self.count)]
+
+    def close(self):
+        self.f.close()
+
+    def times(self):
+        return [entry[0] for entry in self.index]
+
+    def find(self, t):
+        """Returns the index of the last snapshot at or before T, or -1."""
+
+        lo, hi = 0, len(self.index)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.index[mid][0] <= t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def record(self, i):
+        t, offset, length, flags = self.index[i]
+        self.f.seek(offset)
+        return zlib.decompress(self.f.read(length))
+
+    def snapshot(self, i):
+        """Returns the values of snapshot I as an array('d')."""
+
+        key = i
+        while not (self.index[key][3] & KEYFRAME):
+            key -= 1
+
+        values = array('d')
+        values.fromstring(self.record(key))
+        for j in xrange(key + 1, i + 1):
+            data = self.record(j)
+            n = COUNT.unpack_from(data, 0)[0]
+            changed = array('I')
+            changed.fromstring(data[COUNT.size:COUNT.size + n * changed.itemsize])
+            deltas = array('d')
+            deltas.fromstring(data[COUNT.size + n * changed.itemsize:])
+            for k in xrange(n):
+                values[changed[k]] += deltas[k]
+        return values
+
+    def between(self, start, end):
+        """Returns the values accumulated between the snapshots at or
+        before START and END; if there is none at or before START,
+        everything up to END. If no snapshot falls between the two, the
+        values are all zero."""
+
+        i0 = self.find(start)
+        i1 = self.find(end)
+        if i1 < 0:
+            return None
+
+        if i0 >= i1:
+            n_values = max([offset + 2 * n for entries in self.layout.values() for b_low, b_high, bin_min, bin_size, n, offset in entries] or [0])
+            return array('d', [0.0]) * n_values
+
+        values = self.snapshot(i1)
+        if i0 >= 0:
+            earlier = self.snapshot(i0)
+            for k in xrange(len(values)):
+                values[k] -= earlier[k]
+        return values
+
+    def cells(self, values, name):
+        """Yields (b_low, b_high, h_low, h_high, updates, airsec) for the
+        non-empty cells of histogram NAME in VALUES, as in the CSVs."""
+
+        for b_low, b_high, bin_min, bin_size, n, offset in self.layout[name]:
+            for i in xrange(n):
+                updates = values[offset + i]
+                airsec = values[offset + n + i]
+                if updates > 0 or airsec > 0:
+                    yield (b_low, b_high, bin_min + i * bin_size, bin_min + (i + 1) * bin_size, updates, airsec)
+
+def write_csv(cells, filename):
+    """Writes CELLS in the same format as the collector's CSVs."""
+
+    with closing(open(filename + '.new', 'w')) as w:
+        c = csv.writer(w)
+        c.writerow(['bearing_start','bearing_end','bin_start','bin_end','updates','airsec'])
+        for row in cells:
+            c.writerow(['%.2f' % x for x in row])
+    os.rename(filename + '.new', filename)
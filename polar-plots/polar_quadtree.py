@@ -0,0 +1,230 @@
+#
+# Adaptive-resolution coverage histogram: a quadtree over the receiver's
+# ground plane (east/north metres, as in the rotated frame that
+# range_bearing_elevation_from() works in).
+#
+# Every cell starts as a leaf accumulating updates and airsec like a
+# BinHisto bin. Once a leaf has seen split_threshold samples (and is still
+# bigger than min_size across) it splits into four, each child taking a
+# quarter of the parent's totals, so busy areas end up with fine cells and
+# empty ones stay coarse. Nodes live in flat arrays that grow up to
+# max_nodes and then stop splitting, so memory use is bounded.
+#
+# The serialized form is a header followed by a zlib-compressed preorder
+# walk: one flag byte per node (0 empty leaf, 1 leaf with data, 2 split),
+# then the leaves' updates/airsec doubles and sample counts.
+#
+
+import os, struct, zlib
+from array import array
+from contextlib import closing
+
+MAGIC = 'PLQT'
+VERSION = 1
+HEADER = struct.Struct('<4sIddIII')
+COUNTS = struct.Struct('<II')
+
+EMPTY = 0
+LEAF = 1
+SPLIT = 2
+
+class QuadTree:
+    def __init__(self, half_size=500000.0, min_size=1000.0, split_threshold=256, max_nodes=65536):
+        self.half_size = half_size
+        self.min_size = min_size
+        self.split_threshold = split_threshold
+        self.max_nodes = max_nodes
+
+        # per node: index of the first of 4 children (SW, SE, NW, NE) or -1
+        # for a leaf; accumulated updates and airsec; samples seen as a leaf
+        self.child = array('i', [-1])
+        self.updates = array('d', [0.0])
+        self.airsec = array('d', [0.0])
+        self.count = array('I', [0])
+
+    def __len__(self):
+        return len(self.child)
+
+    def add(self, x, y, updates, airsec):
+        half = self.half_size
+        if x < -half or x >= half or y < -half or y >= half:
+            return
+
+        child = self.child
+        node = 0
+        cx = cy = 0.0
+        while True:
+            c = child[node]
+            if c < 0: break
+
+            half *= 0.5
+            if x >= cx:
+                cx += half
+                c += 1
+            else:
+                cx -= half
+            if y >= cy:
+                cy += half
+                c += 2
+            else:
+                cy -= half
+            node = c
+
+        self.updates[node] += updates
+        self.airsec[node] += airsec
+        n = self.count[node] + 1
+        self.count[node] = n
+
+        # half is now the size of the children this leaf would have
+        if n >= self.split_threshold and half >= self.min_size and len(child) + 4 <= self.max_nodes:
+            self.split(node)
+
+    def alloc(self):
+        first = len(self.child)
+        self.child.extend((-1, -1, -1, -1))
+        self.updates.extend((0.0, 0.0, 0.0, 0.0))
+        self.airsec.extend((0.0, 0.0, 0.0, 0.0))
+        self.count.extend((0, 0, 0, 0))
+        return first
+
+    def split(self, node):
+        first = self.alloc()
+        self.child[node] = first
+
+        # spread what the leaf had collected evenly over its children
+        updates = self.updates[node] / 4.0
+        airsec = self.airsec[node] / 4.0
+        for c in xrange(first, first + 4):
+            self.updates[c] = updates
+            self.airsec[c] = airsec
+        self.updates[node] = 0.0
+        self.airsec[node] = 0.0
+        self.count[node] = 0
+
+    def cells(self):
+        """Yields (x0, y0, size, updates, airsec) for each leaf with data;
+        x0, y0 is the cell's south-west corner."""
+
+        child = self.child
+        stack = [(0, -self.half_size, -self.half_size, 2 * self.half_size)]
+        while stack:
+            node, x0, y0, size = stack.pop()
+            c = child[node]
+            if c >= 0:
+                size *= 0.5
+                stack.append((c, x0, y0, size))
+                stack.append((c + 1, x0 + size, y0, size))
+                stack.append((c + 2, x0, y0 + size, size))
+                stack.append((c + 3, x0 + size, y0 + size, size))
+            elif self.updates[node] > 0 or self.airsec[node] > 0:
+                yield (x0, y0, size, self.updates[node], self.airsec[node])
+
+    def write(self, filename):
+        flags = bytearray()
+        values = array('d')
+        counts = array('I')
+
+        child = self.child
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            c = child[node]
+            if c >= 0:
+                flags.append(SPLIT)
+                stack.extend((c + 3, c + 2, c + 1, c))
+            elif self.updates[node] > 0 or self.airsec[node] > 0 or self.count[node] > 0:
+                flags.append(LEAF)
+                values.append(self.updates[node])
+                values.append(self.airsec[node])
+                counts.append(self.count[node])
+            else:
+                flags.append(EMPTY)
+
+        body = COUNTS.pack(len(flags), len(counts)) + str(flags) + values.tostring() + counts.tostring()
+        with closing(open(filename + '.new', 'wb')) as f:
+            f.write(HEADER.pack(MAGIC, VERSION, self.half_size, self.min_size,
+                                self.split_threshold, self.max_nodes, len(child)))
+            f.write(zlib.compress(body, 6))
+        os.rename(filename + '.new', filename)
+
+    @classmethod
+    def read(cls, filename):
+        with closing(open(filename, 'rb')) as f:
+            data = f.read()
+
+        magic, version, half_size, min_size, split_threshold, max_nodes, n_nodes = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s: not a quadtree histogram file' % filename)
+
+        body = zlib.decompress(data[HEADER.size:])
+        n_flags, n_leaves = COUNTS.unpack_from(body, 0)
+        offset = COUNTS.size
+        flags = bytearray(body[offset:offset + n_flags])
+        offset += n_flags
+        values = array('d')
+        values.fromstring(body[offset:offset + n_leaves * 16])
+        offset += n_leaves * 16
+        counts = array('I')
+        counts.fromstring(body[offset:offset + n_leaves * counts.itemsize])
+
+        tree = cls(half_size, min_size, split_threshold, max_nodes)
+        stack = [0]
+        leaf = 0
+        for flag in flags:
+            node = stack.pop()
+            if flag == SPLIT:
+                first = tree.alloc()
+                tree.child[node] = first
+                stack.extend((first + 3, first + 2, first + 1, first))
+            elif flag == LEAF:
+                tree.updates[node] = values[2 * leaf]
+                tree.airsec[node] = values[2 * leaf + 1]
+                tree.count[node] = counts[leaf]
+                leaf += 1
+
+        return tree
+
+def render(tree, spec):
+    """Draws TREE as a range plot. SPEC is as for polar_render.render:
+    output, size, max_range and max_rate are used."""
+
+    from PIL import Image, ImageDraw, ImageFont
+    import polar_render
+
+    size = int(spec.get('size', 800))
+    max_range = float(spec.get('max_range', 360000.0))
+    max_rate = float(spec.get('max_rate', 2.0))
+
+    im = Image.new("RGB", (size, size), "black")
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+
+    scale = ((size-10) / max_range / 2)
+    center = size/2
+    for x0, y0, cell, updates, airsec in tree.cells():
+        if airsec <= 2.0: continue
+        rate = updates / airsec
+        if rate <= 0: continue
+
+        # north is up
+        draw.rectangle((int(center + x0 * scale),
+                        int(center - (y0 + cell) * scale),
+                        int(center + (x0 + cell) * scale),
+                        int(center - y0 * scale)),
+                       fill = polar_render.color_for(rate, max_rate))
+
+    for r in xrange(0, int(max_range) + 100000, 100000):
+        draw.ellipse((int(center - r * scale), int(center - r * scale),
+                      int(center + r * scale), int(center + r * scale)), outline="#FFFFFF")
+        if r > 0:
+            text = '%.0f km' % (r/1000.0)
+            tsize = font.getsize(text)
+            draw.text((center + 5, center - r * scale - 5 - tsize[1]), text, font=font, fill="#FFFFFF")
+
+    polar_render.draw_legend(draw, font, max_rate)
+    del draw
+
+    output = spec['output']
+    im.save(output + '.new', 'PNG')
+    os.rename(output + '.new', output)
+    return output
@@ -0,0 +1,244 @@
+#
+# Shared loading and drawing code for the PIL polar plots.
+#
+# A Snapshot holds polar_range.csv / polar_elev.csv (or the collector's live
+# shared histograms) as flat arrays so it can be loaded once and then drawn
+# any number of times, at different sizes, ranges and bearing windows.
+#
+
+import csv, math, os
+from array import array
+from contextlib import closing
+
+class Snapshot:
+    def __init__(self):
+        # range cells, sorted for drawing from the outside in
+        self.r_bstart = array('d')
+        self.r_bend = array('d')
+        self.r_start = array('d')
+        self.r_end = array('d')
+        self.r_rate = array('d')
+
+        # elevation cells
+        self.e_bstart = array('d')
+        self.e_bend = array('d')
+        self.e_start = array('d')
+        self.e_end = array('d')
+        self.e_rate = array('d')
+
+    def read_range(self, filename):
+        self.set_range(range_rates(read_cells(filename)))
+
+    def set_range(self, rows):
+        rows.sort(key = lambda x: (-x[3], x[0], -x[2]))
+        for b_start, b_end, r_start, r_end, rate in rows:
+            self.r_bstart.append(b_start)
+            self.r_bend.append(b_end)
+            self.r_start.append(r_start)
+            self.r_end.append(r_end)
+            self.r_rate.append(rate)
+
+    def read_elevation(self, filename):
+        self.set_elevation(elevation_rates(read_cells(filename)))
+
+    def set_elevation(self, rows):
+        for b_start, b_end, e_start, e_end, rate in rows:
+            self.e_bstart.append(b_start)
+            self.e_bend.append(b_end)
+            self.e_start.append(e_start)
+            self.e_end.append(e_end)
+            self.e_rate.append(rate)
+
+    def read_shared(self, filename):
+        """Loads both histograms from a collector's live memory-mapped file
+        (adsb-polar-2.py --shared) instead of the CSVs."""
+
+        import polar_shared
+        cells = polar_shared.read(filename)
+        self.set_range(range_rates(cells['range']))
+        self.set_elevation(elevation_rates(cells['elevation']))
+
+    def range_cells(self, window=None):
+        for i in xrange(len(self.r_rate)):
+            if window is None or in_window(window, self.r_bstart[i], self.r_bend[i]):
+                yield (self.r_bstart[i], self.r_bend[i], self.r_start[i], self.r_end[i], self.r_rate[i])
+
+    def elevation_cells(self, window=None):
+        for i in xrange(len(self.e_rate)):
+            if window is None or in_window(window, self.e_bstart[i], self.e_bend[i]):
+                yield (self.e_bstart[i], self.e_bend[i], self.e_start[i], self.e_end[i], self.e_rate[i])
+
+def read_cells(filename):
+    """Yields (b_start, b_end, start, end, updates, airsec) for each row of a
+    polar_range.csv or polar_elev.csv."""
+
+    with closing(open(filename, 'r')) as f:
+        r = csv.reader(f)
+        r.next() # header
+        for row in r:
+            yield tuple(float(x) for x in row[:6])
+
+def range_rates(cells):
+    rows = []
+    for b_start, b_end, r_start, r_end, updates, airsec in cells:
+        if airsec > 2.0:
+            rate = float(updates) / airsec
+        else:
+            rate = 0.0
+
+        if rate > 0:
+            rows.append( (b_start, b_end, r_start, r_end, rate) )
+    return rows
+
+def elevation_rates(cells):
+    rows = []
+    for b_start, b_end, e_start, e_end, count, unique in cells:
+        if unique > 0:
+            rate = count / unique
+        else:
+            rate = 0.0
+
+        if rate > 0:
+            rows.append( (b_start, b_end, e_start, e_end, rate) )
+    return rows
+
+def in_window(window, b_start, b_end):
+    # window is (start, end) in degrees, possibly wrapping through north
+    w_start, w_end = window
+    mid = ((b_start + b_end) / 2.0) % 360
+    if w_start <= w_end:
+        return w_start <= mid < w_end
+    else:
+        return mid >= w_start or mid < w_end
+
+def color_for(x, max_rate):
+    if x == 0.0:
+        return 'black'
+    else:
+        if x < 0.1: intensity = 0
+        else: intensity = (1.0 * x / max_rate) ** 0.8
+        return "hsl(%d,%d%%,%d%%)" % (0 + int(0 + intensity * 180), 100, int(30 + intensity*50))
+
+def draw_range(draw, font, snap, size, max_range, max_rate, window=None):
+    scale = ((size-10) / max_range / 2)
+    center = size/2
+
+    def bounds(r):
+        return (int(center - r * scale),
+                int(center - r * scale),
+                int(center + r * scale),
+                int(center + r * scale))
+
+    last_r_start = None
+    last_r_end = None
+    for s_start, s_end, r_start, r_end, rate in snap.range_cells(window):
+        if r_end != last_r_end:
+            # clear inner part
+            if last_r_start is not None:
+                draw.ellipse(bounds(last_r_start), fill = '#101010')
+            last_r_start = r_start
+            last_r_end = r_end
+
+        draw.pieslice(bounds(r_end), int(s_start - 90), int(s_end-90), fill = color_for(rate, max_rate))
+
+    if last_r_start is not None:
+        draw.ellipse(bounds(last_r_start), fill = '#101010')
+
+    for r in xrange(0, int(max_range) + 100000, 100000):
+        draw.ellipse(bounds(r), outline="#FFFFFF")
+
+        if r > 0:
+            text = '%.0f km' % (r/1000.0)
+            tsize = font.getsize(text)
+            draw.text((center + 5, center - r * scale - 5 - tsize[1]), text, font=font, fill="#FFFFFF")
+
+def draw_legend(draw, font, max_rate):
+    text1 = 'Rate: 0'
+    size1 = font.getsize(text1)
+    text2 = '%.1f updates/s/aircraft' % max_rate
+
+    draw.text((5, 5), text1)
+    draw.text((5 + size1[0] + 5 + 102 + 5, 5), text2)
+    draw.rectangle((5 + size1[0] + 5, 5, 5 + size1[0] + 5 + 101, 5 + size1[1]), outline='#FFFFFF')
+    for i in xrange(0,100):
+        c = i * max_rate / 100
+        draw.line((5 + size1[0] + 5 + 1 + i, 6, 5 + size1[0] + 5 + 1 + i, 4 + size1[1]), fill=color_for(c, max_rate))
+
+def draw_elevation(draw, font, snap, x0, height, max_rate, window=None, min_elev=-5.0, max_elev=90.0):
+    # a 730 pixel wide strip starting at x0, 2 pixels per degree of bearing
+    ESCALE = -1.0 * height / (max_elev - min_elev)
+    EZERO = int(-1.0 * max_elev * ESCALE)
+
+    draw.rectangle( (x0,0,x0+730,height), fill='black' )
+
+    for i in xrange(0,361,30):
+        draw.line( (x0+5+i*2,
+                    EZERO+int(ESCALE*min_elev),
+                    x0+5+i*2,
+                    EZERO+int(ESCALE*max_elev)),
+                   fill='#202020' )
+
+    i = 0.0
+    while i < max_elev:
+        draw.line( (x0+5, EZERO+int(ESCALE*i), x0+725, EZERO+int(ESCALE*i)), fill='#202020' )
+        i += 5.0
+
+    i = 0.0
+    while i > min_elev:
+        draw.line( (x0+5, EZERO+int(ESCALE*i), x0+725, EZERO+int(ESCALE*i)), fill='#202020' )
+        i -= 5.0
+
+    for bs, be, es, ee, rate in snap.elevation_cells(window):
+        x1 = int(bs)*2 + x0+5
+        x2 = int(be)*2 + x0+5
+        y1 = EZERO + int(ESCALE * es)
+        y2 = EZERO + int(ESCALE * ee)
+
+        draw.rectangle( (x1,y1,x2,y2), fill=color_for(rate, max_rate) )
+
+    draw.line( (x0+5,EZERO,x0+725,EZERO), fill='white' )
+    for i in xrange(0,361,30):
+        draw.line( (x0+5+i*2,EZERO,x0+5+i*2,EZERO+5), fill='white' )
+        text = '%03d' % i
+        tsize = font.getsize(text)
+        draw.text((x0+5+i*2 - tsize[0]/2, EZERO+10), text)
+
+def render(snap, spec):
+    """Render one output described by SPEC (a dict) from SNAP.
+
+    SPEC keys: type ('range', 'elevation' or 'combined'), output (filename),
+    size, max_range, max_rate, and bearings ([start,end] to only draw that window)."""
+
+    from PIL import Image, ImageDraw, ImageFont
+
+    kind = spec.get('type', 'combined')
+    size = int(spec.get('size', 800))
+    max_range = float(spec.get('max_range', 360000.0))
+    max_rate = float(spec.get('max_rate', 2.0))
+    window = spec.get('bearings')
+    if window is not None: window = (float(window[0]) % 360, float(window[1]) % 360)
+
+    if kind == 'range':
+        im = Image.new("RGB", (size, size), "black")
+    elif kind == 'elevation':
+        im = Image.new("RGB", (730, size), "black")
+    else:
+        im = Image.new("RGB", (size + 730, size), "black")
+
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+
+    if kind in ('range', 'combined'):
+        draw_range(draw, font, snap, size, max_range, max_rate, window)
+        draw_legend(draw, font, max_rate)
+    if kind == 'elevation':
+        draw_elevation(draw, font, snap, 0, size, max_rate, window)
+    elif kind == 'combined':
+        draw_elevation(draw, font, snap, size, size, max_rate, window)
+
+    del draw
+
+    output = spec['output']
+    im.save(output + '.new', 'PNG')
+    os.rename(output + '.new', output)
+    return output
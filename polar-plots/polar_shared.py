@@ -0,0 +1,140 @@
+#
+# Polar histograms kept in a memory-mapped file, so that plotters can read
+# the collector's live data without waiting for (and re-parsing) the CSVs.
+#
+# File layout:
+#
+#   header      magic 'PLRH', version, sequence counter, data offset, layout length
+#   layout      JSON: { name: [ [b_low, b_high, bin_min, bin_size, n_bins, offset], ... ], ... }
+#   data        doubles; each sector's n_bins update counts, then its n_bins airsec values,
+#               starting at data + offset * 8
+#
+# The collector (the only writer) makes the sequence counter odd while it
+# updates the histograms and even again afterwards. Readers copy the data
+# out and retry if the counter was odd or changed while they were copying.
+#
+
+import ctypes, json, mmap, os, struct, time
+from array import array
+from contextlib import closing
+from itertools import izip
+
+MAGIC = 'PLRH'
+VERSION = 1
+HEADER = struct.Struct('<4sIQII')
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = 8
+
+def sectors(histo):
+    """Yields (b_low, b_high, bin_histo) for each BinHisto sector of a
+    PolarHisto or MultiPolarRangeHisto."""
+
+    if hasattr(histo, 'ranges'):
+        for start_range, end_range, polar in histo.ranges:
+            for sector in polar.values():
+                yield sector
+    else:
+        for sector in histo.values():
+            yield sector
+
+class SharedHistograms:
+    """Moves the bins of HISTOGRAMS, a list of (name, histo), into the
+    memory-mapped file FILENAME. The histograms keep working as before;
+    wrap each batch of updates in begin() / end()."""
+
+    def __init__(self, filename, histograms):
+        layout = {}
+        bins = []
+        total = 0
+        for name, histo in histograms:
+            entries = layout[name] = []
+            for b_low, b_high, sector in sectors(histo):
+                entries.append([b_low, b_high, sector.min_bin, sector.bin_size, sector.n_bins, total])
+                bins.append((sector, total))
+                total += 2 * sector.n_bins
+
+        layout = json.dumps(layout)
+        data_offset = (HEADER.size + len(layout) + 7) & ~7
+        size = data_offset + total * 8
+
+        # build it under a temporary name so readers never see a half-made file
+        with closing(open(filename + '.new', 'w+b')) as f:
+            f.truncate(size)
+            f.write(HEADER.pack(MAGIC, VERSION, 0, data_offset, len(layout)))
+            f.write(layout)
+            f.flush()
+            self.map = mmap.mmap(f.fileno(), size)
+
+        self.seq = ctypes.c_uint64.from_buffer(self.map, SEQ_OFFSET)
+        for sector, offset in bins:
+            n = sector.n_bins
+            updates = (ctypes.c_double * n).from_buffer(self.map, data_offset + offset * 8)
+            airsec = (ctypes.c_double * n).from_buffer(self.map, data_offset + (offset + n) * 8)
+            updates[:] = sector.update_bins
+            airsec[:] = sector.airsec_bins
+            sector.update_bins = updates
+            sector.airsec_bins = airsec
+
+        os.rename(filename + '.new', filename)
+
+    def begin(self):
+        self.seq.value += 1
+
+    def end(self):
+        self.seq.value += 1
+
+class SharedReader:
+    """Read-only view of a file written by SharedHistograms."""
+
+    def __init__(self, filename):
+        with closing(open(filename, 'rb')) as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, seq, self.data_offset, layout_len = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError('%s: not a shared polar histogram file' % filename)
+        self.layout = json.loads(self.map[HEADER.size:HEADER.size + layout_len])
+
+    def close(self):
+        self.map.close()
+
+    def data(self, retries=1000):
+        """Returns a consistent copy of the data section as an array('d')."""
+
+        for attempt in xrange(retries):
+            seq = SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+            if seq & 1:
+                # writer is mid-update
+                time.sleep(0.001)
+                continue
+
+            data = array('d')
+            data.fromstring(self.map[self.data_offset:])
+            if SEQ.unpack_from(self.map, SEQ_OFFSET)[0] == seq:
+                return data
+
+        raise IOError('no consistent snapshot after %d attempts' % retries)
+
+    def snapshot(self):
+        """Returns { name: [ (b_low, b_high, h_low, h_high, updates, airsec), ... ] }
+        for the non-empty cells of each histogram, as in the CSVs."""
+
+        data = self.data()
+        result = {}
+        for name, entries in self.layout.items():
+            cells = result[name] = []
+            for b_low, b_high, bin_min, bin_size, n, offset in entries:
+                i = 0
+                for updates, airsec in izip(data[offset:offset + n], data[offset + n:offset + 2 * n]):
+                    if updates > 0 or airsec > 0:
+                        cells.append((b_low, b_high, bin_min + i * bin_size, bin_min + (i + 1) * bin_size, updates, airsec))
+                    i += 1
+        return result
+
+def read(filename):
+    reader = SharedReader(filename)
+    try:
+        return reader.snapshot()
+    finally:
+        reader.close()
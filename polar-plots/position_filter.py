@@ -0,0 +1,134 @@
+#
+# Plausibility filter for aircraft position updates.
+#
+# Rejects positions that are implausibly far away or below the horizon,
+# or that imply an implausible speed since the aircraft's previous position,
+# and blacklists the offending aircraft for a while. Used by the polar
+# collectors and (via symlinks in ../collectd, ../daemon and ../mrtg) the
+# max-range calculations of the collectd plugin, dump1090-cached.py and
+# the MRTG probe.
+#
+
+import logging, math, time
+
+MEAN_R = 6371009.0
+
+def xyz(lat, lon, alt):
+    "Spherical earth-centered cartesian coordinates, good enough for speed checks"
+    lat = lat * math.pi / 180.0
+    lon = lon * math.pi / 180.0
+    r = MEAN_R + alt
+    clat = math.cos(lat)
+    return (r * clat * math.cos(lon), r * clat * math.sin(lon), r * math.sin(lat))
+
+class RateLimitedLog:
+    """Passes at most BURST messages per INTERVAL seconds to EMIT, and then
+    reports how many were suppressed once the interval is over."""
+
+    def __init__(self, emit=None, burst=10, interval=60.0):
+        self.emit = emit if emit is not None else logging.getLogger('position_filter').info
+        self.burst = burst
+        self.interval = interval
+        self.window_start = 0
+        self.count = 0
+        self.suppressed = 0
+
+    def __call__(self, msg, *args):
+        now = time.time()
+        if now - self.window_start >= self.interval:
+            if self.suppressed:
+                self.emit('%d similar messages suppressed' % self.suppressed)
+            self.window_start = now
+            self.count = 0
+            self.suppressed = 0
+
+        if self.count < self.burst:
+            self.count += 1
+            self.emit(msg % args if args else msg)
+        else:
+            self.suppressed += 1
+
+class PositionFilter:
+    def __init__(self, max_range=500000.0, min_elevation=-5.0, max_speed=500.0, blacklist_time=60.0,
+                 log=None, counters=None):
+        self.max_range = max_range
+        self.min_elevation = min_elevation
+        self.max_speed = max_speed            # m/s; 500m/s is about 970 knots
+        self.blacklist_time = blacklist_time
+        self.log = log if log is not None else RateLimitedLog()
+
+        # blacklist_position, blacklist_speed and unblacklist counts; pass in
+        # a dict to have them accumulate somewhere else
+        self.counters = counters if counters is not None else {}
+        for k in ('blacklist_position', 'blacklist_speed', 'unblacklist'):
+            self.counters.setdefault(k, 0)
+
+        # icao -> (timestamp, (x,y,z)) of the last position seen
+        self.last = {}
+        # icao -> blacklist expiry time
+        self.blacklist = {}
+
+    def is_blacklisted(self, icao):
+        return icao in self.blacklist
+
+    def forget(self, icao):
+        self.last.pop(icao, None)
+        self.blacklist.pop(icao, None)
+
+    def expire(self, now, max_age=300.0):
+        # drop state for aircraft not seen recently
+        for icao, (ts, pos) in self.last.items():
+            if now - ts > max_age:
+                self.forget(icao)
+
+    def check_batch(self, batch):
+        """BATCH is a list of (icao, timestamp, range, elevation, (x,y,z)) updates,
+        in time order; ELEVATION may be None if unknown. Returns a list with
+        True for each update that should be used and False for each that should
+        be ignored because the aircraft is blacklisted."""
+
+        last = self.last
+        blacklist = self.blacklist
+        max_range = self.max_range
+        min_elevation = self.min_elevation
+        max_speed = self.max_speed
+        blacklist_time = self.blacklist_time
+        log = self.log
+        counters = self.counters
+
+        results = []
+        for icao, ts, r, e, pos in batch:
+            if r > max_range or (e is not None and e < min_elevation):
+                if icao not in blacklist:
+                    counters['blacklist_position'] += 1
+                    log("contact with improbable position, blacklisting: %s range %.1fkm elevation %s",
+                        icao, r/1000.0, 'unknown' if e is None else '%.1f' % e)
+                blacklist[icao] = ts + blacklist_time
+
+            prev = last.get(icao)
+            if prev is not None:
+                elapsed = ts - prev[0]
+                if elapsed > 0:
+                    ppos = prev[1]
+                    dx = pos[0] - ppos[0]
+                    dy = pos[1] - ppos[1]
+                    dz = pos[2] - ppos[2]
+                    moved = math.sqrt(dx*dx + dy*dy + dz*dz)
+                    if (elapsed > 4.0 or moved > 2000.0) and moved / elapsed > max_speed:
+                        if icao not in blacklist:
+                            counters['blacklist_speed'] += 1
+                            log("contact with improbable speed, blacklisting: %s moved %.1fkm at %.1fm/s",
+                                icao, moved/1000.0, moved/elapsed)
+                        blacklist[icao] = ts + blacklist_time
+
+            expiry = blacklist.get(icao)
+            results.append(expiry is None)
+
+            if expiry is not None and expiry < ts:
+                counters['unblacklist'] += 1
+                log("un-blacklisting %s", icao)
+                del blacklist[icao]
+
+            last[icao] = (ts, pos)
+
+        return results